@@ -72,6 +72,7 @@ from app.formatters import (
     recipient_count_label,
     valid_phone_number,
 )
+from app.http_sessions import http_sessions
 from app.models.organisation import Organisation
 from app.models.service import Service
 from app.models.user import AnonymousUser, User
@@ -81,7 +82,11 @@ from app.navigation import (
     MainNavigation,
     OrgNavigation,
 )
-from app.notify_client import InviteTokenError
+from app.notify_client import (
+    InviteTokenError,
+    log_request_memo_stats,
+    prefetch_cache_keys,
+)
 from app.notify_client.api_key_api_client import api_key_api_client
 from app.notify_client.billing_api_client import billing_api_client
 from app.notify_client.broadcast_message_api_client import (
@@ -119,7 +124,7 @@ from app.url_converters import (
     TemplateTypeConverter,
     TicketTypeConverter,
 )
-from app.utils import get_logo_cdn_domain
+from app.utils import REVALIDATE_CACHE_CONTROL, get_logo_cdn_domain
 
 login_manager = LoginManager()
 csrf = CSRFProtect()
@@ -167,6 +172,7 @@ def create_app(application):
         login_manager,
         proxy_fix,
         request_helper,
+        http_sessions,
 
         # API clients
         api_key_api_client,
@@ -222,7 +228,9 @@ def create_app(application):
 
 def init_app(application):
     application.after_request(useful_headers_after_request)
+    application.after_request(log_request_memo_stats)
 
+    application.before_request(prefetch_cache_before_request)
     application.before_request(load_service_before_request)
     application.before_request(load_organisation_before_request)
     application.before_request(request_helper.check_proxy_header_before_request)
@@ -287,6 +295,39 @@ def make_session_permanent():
     session.permanent = True
 
 
+def get_cache_keys_for_request():
+    if request.view_args:
+        service_id = request.view_args.get('service_id', session.get('service_id'))
+    else:
+        service_id = session.get('service_id')
+
+    if session.get('user_id'):
+        yield 'user-{}'.format(session['user_id'])
+
+    if service_id:
+        yield 'service-{}'.format(service_id)
+        yield 'has_jobs-{}'.format(service_id)
+
+        # Templates and folders can be big, so only get them for pages which are about templates
+        if 'template' in (request.endpoint or '') or {
+            'template_id', 'template_folder_id', 'template_type'
+        } & (request.view_args or {}).keys():
+            yield 'service-{}-templates'.format(service_id)
+            yield 'service-{}-template-folders'.format(service_id)
+
+
+def prefetch_cache_before_request():
+    """
+    Most pages need the current user and service (and sometimes the service’s
+    templates) from the cache. Getting them all from Redis in one go here, rather
+    than one at a time as they’re first used, saves several round trips per page.
+    Static files and the healthcheck don’t use any of them.
+    """
+    if '/static/' in request.url or request.endpoint == 'static' or request.blueprint == 'status':
+        return
+    prefetch_cache_keys(*get_cache_keys_for_request())
+
+
 def load_service_before_request():
     if '/static/' in request.url:
         _request_ctx_stack.top.service = None
@@ -370,10 +411,12 @@ def useful_headers_after_request(response):
             asset_url=f'https://{current_app.config["ASSET_DOMAIN"]}'
         )
     ))
-    if 'Cache-Control' in response.headers:
-        del response.headers['Cache-Control']
-    response.headers.add(
-        'Cache-Control', 'no-store, no-cache, private, must-revalidate')
+    # things with no personal data in, like previews of templates, can be kept by the browser and revalidated
+    if response.headers.get('Cache-Control') != REVALIDATE_CACHE_CONTROL:
+        if 'Cache-Control' in response.headers:
+            del response.headers['Cache-Control']
+        response.headers.add(
+            'Cache-Control', 'no-store, no-cache, private, must-revalidate')
     for key, value in response.headers:
         response.headers[key] = SanitiseASCII.encode(value)
     return response
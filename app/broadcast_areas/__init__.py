@@ -3,8 +3,9 @@ from notifications_utils.serialised_model import SerialisedModelCollection
 from werkzeug.utils import cached_property
 
 from .polygons import Polygons
-from .populations import CITY_OF_LONDON
-from .repo import BroadcastAreasRepository
+from .repo import SharedBroadcastAreasRepository
+
+repository = SharedBroadcastAreasRepository()
 
 
 class SortableMixin:
@@ -40,30 +41,26 @@ class BroadcastArea(SortableMixin):
     @cached_property
     def polygons(self):
         return Polygons(
-            BroadcastAreasRepository().get_polygons_for_area(self.id)
+            repository.get_polygons_for_area(self.id)
         )
 
     @cached_property
     def simple_polygons(self):
         return Polygons(
-            BroadcastAreasRepository().get_simple_polygons_for_area(self.id)
+            repository.get_simple_polygons_for_area(self.id)
         )
 
     @cached_property
     def sub_areas(self):
         return [
             BroadcastArea(row)
-            for row in BroadcastAreasRepository().get_all_areas_for_group(self.id)
+            for row in repository.get_all_areas_for_group(self.id)
         ]
 
     @property
     def count_of_phones(self):
-        if self.id.endswith(CITY_OF_LONDON.WARDS):
-            return CITY_OF_LONDON.DAYTIME_POPULATION * (
-                self.polygons.estimated_area / CITY_OF_LONDON.AREA_SQUARE_MILES
-            )
-        if self.sub_areas:
-            return sum(area.count_of_phones for area in self.sub_areas)
+        # Includes the phones in any sub areas, which are added up when
+        # the database is built
         # TODO: remove the `or 0` once missing data is fixed, see
         # https://www.pivotaltracker.com/story/show/174837293
         return self._count_of_phones or 0
@@ -77,7 +74,7 @@ class BroadcastArea(SortableMixin):
         id = self.id
 
         while True:
-            parent = BroadcastAreasRepository().get_parent_for_area(id)
+            parent = repository.get_parent_for_area(id)
 
             if not parent:
                 return None
@@ -134,7 +131,7 @@ class BroadcastAreaLibrary(SerialisedModelCollection, SortableMixin, GetItemById
         self.name = name
         self.name_singular = name_singular
         self.is_group = bool(is_group)
-        self.items = BroadcastAreasRepository().get_all_areas_for_library(self.id)
+        self.items = repository.get_all_areas_for_library(self.id)
 
     def get_examples(self):
         # we show up to four things. three areas, then either a fourth area if there are exactly four, or "and X more".
@@ -153,14 +150,14 @@ class BroadcastAreaLibraries(SerialisedModelCollection, GetItemByIdMixin):
     model = BroadcastAreaLibrary
 
     def __init__(self):
-        self.items = BroadcastAreasRepository().get_libraries()
+        self.items = repository.get_libraries()
 
     def get_areas(self, *area_ids):
         # allow people to call `get_areas('a', 'b') or get_areas(['a', 'b'])`
         if len(area_ids) == 1 and isinstance(area_ids[0], list):
             area_ids = area_ids[0]
 
-        areas = BroadcastAreasRepository().get_areas(area_ids)
+        areas = repository.get_areas(area_ids)
         return [BroadcastArea(area) for area in areas]
 
 
@@ -1,7 +1,12 @@
 #!/usr/bin/env python
 
+import argparse
 import csv
-import sys
+import hashlib
+import json
+import os
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
 import geojson
@@ -31,34 +36,83 @@ def simplify_geometry(feature):
         raise Exception("Unknown type: {}".format(feature["type"]))
 
 
-def polygons_and_simplified_polygons(feature):
-    if keep_old_polygons:
-        # cheat and shortcut out
-        return [], []
+def get_source_hash(feature):
+    return hashlib.sha256(json.dumps(feature, sort_keys=True).encode('utf-8')).hexdigest()
+
 
+def polygons_and_simplified_polygons(feature):
+    # runs in a separate process, so returns what it’s done rather than
+    # printing it
     polygons = Polygons(simplify_geometry(feature))
     full_resolution = polygons.remove_too_small
     smoothed = full_resolution.smooth
     simplified = smoothed.simplify
 
-    print(  # noqa: T001
-        f'    Original:{full_resolution.point_count: >5} points'
-        f'    Smoothed:{smoothed.point_count: >5} points'
-        f'    Simplified:{simplified.point_count: >4} points'
+    return (
+        full_resolution.as_coordinate_pairs_long_lat,
+        simplified.as_coordinate_pairs_long_lat,
+        (full_resolution.point_count, smoothed.point_count, simplified.point_count),
     )
 
-    point_counts.append(simplified.point_count)
 
-    if simplified.point_count >= 200:
-        raise RuntimeError(
-            'Too many points '
-            '(adjust Polygons.perimeter_to_simplification_ratio or '
-            'Polygons.perimeter_to_buffer_ratio)'
+def simplify_features(features_to_simplify):
+    if not features_to_simplify:
+        return
+
+    ids, features, source_hashes = zip(*features_to_simplify)
+
+    if executor:
+        # results come back in order as soon as each one is ready, so
+        # they can be written while the rest are still being simplified
+        results = executor.map(polygons_and_simplified_polygons, features, chunksize=8)
+    else:
+        results = map(polygons_and_simplified_polygons, features)
+
+    for id, source_hash, (feature, simple_feature, point_count) in zip(ids, source_hashes, results):
+        original_point_count, smoothed_point_count, simplified_point_count = point_count
+
+        print()  # noqa: T001
+        print(id)  # noqa: T001
+        print(  # noqa: T001
+            f'    Original:{original_point_count: >5} points'
+            f'    Smoothed:{smoothed_point_count: >5} points'
+            f'    Simplified:{simplified_point_count: >4} points'
         )
 
-    return (
-        full_resolution.as_coordinate_pairs_long_lat,
-        simplified.as_coordinate_pairs_long_lat,
+        point_counts.append(simplified_point_count)
+
+        if simplified_point_count >= 200:
+            raise RuntimeError(
+                'Too many points '
+                '(adjust Polygons.perimeter_to_simplification_ratio or '
+                'Polygons.perimeter_to_buffer_ratio)'
+            )
+
+        yield id, feature, simple_feature, source_hash
+
+
+def add_areas(areas_to_add):
+    """
+    `areas_to_add` are lists of id, name, library id, group id, GeoJSON
+    geometry and count of phones.
+    """
+    features_to_simplify = []
+
+    for id, _name, _dataset_id, _group_id, feature, _count_of_phones in areas_to_add:
+        if keep_old_polygons:
+            # cheat and shortcut out
+            continue
+        source_hash = get_source_hash(feature)
+        if incremental and source_hashes.get(id) == source_hash:
+            continue
+        features_to_simplify.append((id, feature, source_hash))
+
+    repo.insert_broadcast_areas(
+        [
+            (id, name, dataset_id, group_id, count_of_phones)
+            for id, name, dataset_id, group_id, _feature, count_of_phones in areas_to_add
+        ],
+        simplify_features(features_to_simplify),
     )
 
 
@@ -112,39 +166,45 @@ population_filepath_northern_ireland = source_files_path / "Ward-2014_Northern_I
 population_filepath_uk = source_files_path / "MYE1-2019.csv"
 
 
-ward_code_to_la_mapping = {
-    f["properties"]["WD19CD"]: f["properties"]["LAD19NM"]
-    for f in geojson.loads(wd_lad_map_filepath.read_text())["features"]
-}
-ward_code_to_la_id_mapping = {
-    f["properties"]["WD19CD"]: f["properties"]["LAD19CD"]
-    for f in geojson.loads(wd_lad_map_filepath.read_text())["features"]
-}
-
-
-# the mapping dict is empty for lower tier local authorities that are also upper tier (unitary authorities, etc)
-ltla_utla_mapping_csv = csv.DictReader(ltla_utla_map_filepath.open())
-la_code_to_cty_id_mapping = {
-    row['LTLA19CD']: row['UTLA19CD'] for row in ltla_utla_mapping_csv if row['LTLA19CD'] != row['UTLA19CD']
-}
-
-area_to_population_mapping = {}
-
-for population_filepath in (
-    population_filepath_uk,
-    population_filepath_england_wales,
-    population_filepath_northern_ireland,
-    population_filepath_scotland,
-):
-    area_to_population_csv = csv.DictReader(population_filepath.open())
-    for row in area_to_population_csv:
-        area_to_population_mapping[row['ward']] = [
-            (
-                int(k) if k.isnumeric() else MEDIAN_AGE_UK,
-                int(float(v.replace(',', '') or '0'))
-            )
-            for k, v in row.items() if k != 'ward'
-        ]
+def load_lookups():
+    # only the main process needs these, so they’re not loaded when the
+    # processes simplifying features import this file
+    global ward_code_to_la_mapping, ward_code_to_la_id_mapping
+    global la_code_to_cty_id_mapping, area_to_population_mapping
+
+    wd_lad_map_features = geojson.loads(wd_lad_map_filepath.read_text())["features"]
+    ward_code_to_la_mapping = {
+        f["properties"]["WD19CD"]: f["properties"]["LAD19NM"]
+        for f in wd_lad_map_features
+    }
+    ward_code_to_la_id_mapping = {
+        f["properties"]["WD19CD"]: f["properties"]["LAD19CD"]
+        for f in wd_lad_map_features
+    }
+
+    # the mapping dict is empty for lower tier local authorities that are also upper tier (unitary authorities, etc)
+    ltla_utla_mapping_csv = csv.DictReader(ltla_utla_map_filepath.open())
+    la_code_to_cty_id_mapping = {
+        row['LTLA19CD']: row['UTLA19CD'] for row in ltla_utla_mapping_csv if row['LTLA19CD'] != row['UTLA19CD']
+    }
+
+    area_to_population_mapping = {}
+
+    for population_filepath in (
+        population_filepath_uk,
+        population_filepath_england_wales,
+        population_filepath_northern_ireland,
+        population_filepath_scotland,
+    ):
+        area_to_population_csv = csv.DictReader(population_filepath.open())
+        for row in area_to_population_csv:
+            area_to_population_mapping[row['ward']] = [
+                (
+                    int(k) if k.isnumeric() else MEDIAN_AGE_UK,
+                    int(float(v.replace(',', '') or '0'))
+                )
+                for k, v in row.items() if k != 'ward'
+            ]
 
 
 def add_countries():
@@ -165,17 +225,14 @@ def add_countries():
         print()  # noqa: T001
         print(f_name)  # noqa: T001
 
-        feature, simple_feature = (
-            polygons_and_simplified_polygons(feature["geometry"])
-        )
         areas_to_add.append([
             f'ctry19-{f_id}', f_name,
             dataset_id, None,
-            feature, simple_feature,
+            feature["geometry"],
             estimate_number_of_smartphones_in_area(f_id),
         ])
 
-    repo.insert_broadcast_areas(areas_to_add, keep_old_polygons)
+    add_areas(areas_to_add)
 
 
 def add_wards_local_authorities_and_counties():
@@ -207,21 +264,17 @@ def _add_electoral_wards(dataset_id):
         try:
             la_id = "lad20-" + ward_code_to_la_id_mapping[ward_code]
 
-            feature, simple_feature = (
-                polygons_and_simplified_polygons(feature["geometry"])
-            )
-
             areas_to_add.append([
                 ward_id, ward_name,
                 dataset_id, la_id,
-                feature, simple_feature,
+                feature["geometry"],
                 estimate_number_of_smartphones_in_area(ward_code),
             ])
 
         except KeyError:
             print("Skipping", ward_code, ward_name)  # noqa: T001
 
-    repo.insert_broadcast_areas(areas_to_add, keep_old_polygons)
+    add_areas(areas_to_add)
 
 
 def _add_local_authorities(dataset_id):
@@ -236,21 +289,16 @@ def _add_local_authorities(dataset_id):
 
         group_id = "lad20-" + la_id
 
-        feature, simple_feature = (
-            polygons_and_simplified_polygons(feature["geometry"])
-        )
-
         ctyua_id = la_code_to_cty_id_mapping.get(la_id)
         areas_to_add.append([
             group_id,
             group_name,
             dataset_id,
             'ctyua19-' + ctyua_id if ctyua_id else None,
-            feature,
-            simple_feature,
+            feature["geometry"],
             None,
         ])
-    repo.insert_broadcast_areas(areas_to_add, keep_old_polygons)
+    add_areas(areas_to_add)
 
 
 # counties and unitary authorities
@@ -266,43 +314,132 @@ def _add_counties_and_unitary_authorities(dataset_id):
 
         group_id = "ctyua19-" + ctyua_id
 
-        feature, simple_feature = (
-            polygons_and_simplified_polygons(feature["geometry"])
-        )
-
         areas_to_add.append([
             group_id, group_name,
             dataset_id, None,
-            feature, simple_feature,
+            feature["geometry"],
             None,
         ])
 
-    repo.insert_broadcast_areas(areas_to_add, keep_old_polygons)
+    add_areas(areas_to_add)
+
+
+def add_estimated_areas_counts_of_phones_and_bounding_boxes():
+    # Adding up the phones in every sub area (and estimating City of
+    # London wards from their physical area) is too slow to do on every
+    # page load, so do it once here. The bounding boxes go in a spatial
+    # index, for finding areas without looking at every polygon.
+    areas = repo.get_all_areas_for_estimating_phones()
+    sub_area_ids = defaultdict(list)
+    for id, group_id, _count_of_phones in areas:
+        if group_id:
+            sub_area_ids[group_id].append(id)
+
+    estimated_areas = {}
+    bounding_boxes = []
+    for id, _group_id, _count_of_phones in areas:
+        polygons = Polygons(repo.get_polygons_for_area(id))
+        estimated_areas[id] = polygons.estimated_area
+        if polygons.bounds:
+            bounding_boxes.append((id, *polygons.bounds))
+    counts_of_phones = {}
+
+    def count_of_phones(id, own_count_of_phones):
+        if id.endswith(CITY_OF_LONDON.WARDS):
+            return CITY_OF_LONDON.DAYTIME_POPULATION * (
+                estimated_areas[id] / CITY_OF_LONDON.AREA_SQUARE_MILES
+            )
+        if sub_area_ids[id]:
+            return sum(counts_of_phones[sub_area_id] or 0 for sub_area_id in sub_area_ids[id])
+        return own_count_of_phones
+
+    # sub areas are always in the database before the areas they’re part
+    # of, so their counts are ready by the time they need adding up
+    for id, _group_id, own_count_of_phones in areas:
+        counts_of_phones[id] = count_of_phones(id, own_count_of_phones)
+
+    repo.update_estimated_areas_and_counts_of_phones(
+        (id, estimated_areas[id], counts_of_phones[id])
+        for id, _group_id, _count_of_phones in areas
+    )
+    repo.insert_bounding_boxes(bounding_boxes)
+
 
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--keep-old-polygons',
+        action='store_true',
+        help="don’t simplify any features, keep the polygons already in the database",
+    )
+    parser.add_argument(
+        '--incremental',
+        action='store_true',
+        help="only simplify features whose geometry has changed since the database was built",
+    )
+    parser.add_argument(
+        '--migrate',
+        action='store_true',
+        help=(
+            "bring a database built by an older version of this script up to date, "
+            "without rebuilding it from the source files"
+        ),
+    )
+    parser.add_argument(
+        '--processes',
+        type=int,
+        default=os.cpu_count(),
+        help='how many processes to simplify features with (default: one for each CPU)',
+    )
+    args = parser.parse_args()
+
+    # cheeky global variables
+    keep_old_polygons = args.keep_old_polygons
+    incremental = args.incremental
+    print('keep_old_polygons: ', keep_old_polygons)  # noqa: T001
+    print('incremental: ', incremental)  # noqa: T001
+
+    repo = BroadcastAreasRepository()
+
+    if args.migrate:
+        repo.migrate_polygons_to_wkb()
+        repo.add_missing_columns_and_tables()
+        if repo.has_estimated_areas():
+            print('Already up to date')  # noqa: T001
+        else:
+            add_estimated_areas_counts_of_phones_and_bounding_boxes()
+            print('Added estimated areas, counts of phones and bounding boxes')  # noqa: T001
+        raise SystemExit
+
+    if keep_old_polygons or incremental:
+        repo.delete_library_data()
+        repo.migrate_polygons_to_wkb()
+        repo.add_missing_columns_and_tables()
+    else:
+        repo.delete_db()
+        repo.create_tables()
 
-# cheeky global variable
-keep_old_polygons = sys.argv[1:] == ['--keep-old-polygons']
-print('keep_old_polygons: ', keep_old_polygons)  # noqa: T001
+    source_hashes = repo.get_source_hashes()
+    load_lookups()
+    executor = ProcessPoolExecutor(max_workers=args.processes) if args.processes > 1 else None
 
-repo = BroadcastAreasRepository()
+    add_countries()
+    add_wards_local_authorities_and_counties()
+    repo.delete_polygons_without_areas()
+    add_estimated_areas_counts_of_phones_and_bounding_boxes()
 
-if keep_old_polygons:
-    repo.delete_library_data()
-else:
-    repo.delete_db()
-    repo.create_tables()
-add_countries()
-add_wards_local_authorities_and_counties()
+    if executor:
+        executor.shutdown()
 
-most_detailed_polygons = formatted_list(
-    sorted(point_counts, reverse=True)[:5],
-    before_each='',
-    after_each='',
-)
+    most_detailed_polygons = formatted_list(
+        sorted(point_counts, reverse=True)[:5],
+        before_each='',
+        after_each='',
+    )
 
-print(  # noqa: T001
-    '\n'
-    'DONE\n'
-    f'    Processed {len(point_counts):,} polygons.\n'
-    f'    Highest point counts once simplifed: {most_detailed_polygons}\n'
-)
+    print(  # noqa: T001
+        '\n'
+        'DONE\n'
+        f'    Processed {len(point_counts):,} polygons.\n'
+        f'    Highest point counts once simplifed: {most_detailed_polygons}\n'
+    )
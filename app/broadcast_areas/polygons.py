@@ -164,6 +164,13 @@ class Polygons():
     def point_count(self):
         return len(list(itertools.chain(*self.as_coordinate_pairs_long_lat)))
 
+    @property
+    def bounds(self):
+        if not self:
+            return None
+        min_xs, min_ys, max_xs, max_ys = zip(*(polygon.bounds for polygon in self))
+        return min(min_xs), min(min_ys), max(max_xs), max(max_ys)
+
     @property
     def estimated_area(self):
         return sum(
@@ -2,6 +2,32 @@ import json
 import os
 import sqlite3
 from pathlib import Path
+from urllib.parse import quote
+
+from shapely import wkb
+from shapely.geometry import MultiPolygon, Point, Polygon, box
+from shapely.prepared import prep
+
+
+def dump_polygons(polygons):
+    """
+    Polygons are stored as WKB, which shapely can read far quicker than
+    it can build them from JSON coordinates.
+    """
+    return wkb.dumps(MultiPolygon([
+        polygon if isinstance(polygon, Polygon) else Polygon(polygon)
+        for polygon in polygons
+    ]))
+
+
+def load_polygons(value):
+    """
+    Returns a list of shapely polygons, from WKB or from JSON coordinates
+    for databases which haven’t been migrated yet.
+    """
+    if isinstance(value, str):
+        return [Polygon(polygon) for polygon in json.loads(value)]
+    return list(wkb.loads(value).geoms)
 
 
 class BroadcastAreasRepository(object):
@@ -38,6 +64,7 @@ class BroadcastAreasRepository(object):
                 broadcast_area_library_id TEXT NOT NULL,
                 broadcast_area_library_group_id TEXT,
                 count_of_phones INTEGER,
+                estimated_area REAL,
 
                 FOREIGN KEY (broadcast_area_library_id)
                     REFERENCES broadcast_area_libraries(id),
@@ -49,8 +76,9 @@ class BroadcastAreasRepository(object):
             conn.execute("""
             CREATE TABLE broadcast_area_polygons (
                 id TEXT PRIMARY KEY,
-                polygons TEXT NOT NULL,
-                simple_polygons TEXT NOT NULL
+                polygons BLOB NOT NULL,
+                simple_polygons BLOB NOT NULL,
+                source_hash TEXT
             )""")
 
             conn.execute("""
@@ -63,6 +91,15 @@ class BroadcastAreasRepository(object):
             ON broadcast_areas (broadcast_area_library_group_id);
             """)
 
+            # keyed on the rowid of broadcast_area_polygons, because R-tree
+            # ids have to be integers
+            conn.execute("""
+            CREATE VIRTUAL TABLE broadcast_area_bounding_boxes USING rtree(
+                id,
+                min_x, max_x,
+                min_y, max_y
+            )""")
+
     def delete_library_data(self):
         # delete everything except broadcast_area_polygons
         with self.conn() as conn:
@@ -80,7 +117,12 @@ class BroadcastAreasRepository(object):
         with self.conn() as conn:
             conn.execute(q, (id, name, name_singular, is_group))
 
-    def insert_broadcast_areas(self, areas, keep_old_features):
+    def insert_broadcast_areas(self, areas, polygons=()):
+        """
+        `polygons` can be a generator, so they’re written as they’re made,
+        in the same transaction as the areas. Areas without polygons keep
+        the ones already in the database.
+        """
 
         areas_q = """
         INSERT INTO broadcast_areas (
@@ -92,22 +134,107 @@ class BroadcastAreasRepository(object):
         """
 
         features_q = """
-        INSERT INTO broadcast_area_polygons (
+        INSERT OR REPLACE INTO broadcast_area_polygons (
             id,
-            polygons, simple_polygons
+            polygons, simple_polygons,
+            source_hash
         )
-        VALUES (?, ?, ?)
+        VALUES (?, ?, ?, ?)
         """
 
         with self.conn() as conn:
-            for id, name, area_id, group, polygons, simple_polygons, count_of_phones in areas:
-                conn.execute(areas_q, (
-                    id, name, area_id, group, count_of_phones
-                ))
-                if not keep_old_features:
-                    conn.execute(features_q, (
-                        id, json.dumps(polygons), json.dumps(simple_polygons),
-                    ))
+            conn.executemany(areas_q, areas)
+            conn.executemany(features_q, (
+                (id, dump_polygons(full_resolution), dump_polygons(simplified), source_hash)
+                for id, full_resolution, simplified, source_hash in polygons
+            ))
+
+    def add_missing_columns_and_tables(self):
+        # databases built before incremental rebuilds, estimated areas and
+        # the bounding box index don’t have all of these
+        with self.conn() as conn:
+            columns = [row[1] for row in conn.execute('PRAGMA table_info(broadcast_area_polygons)')]
+            if 'source_hash' not in columns:
+                conn.execute('ALTER TABLE broadcast_area_polygons ADD COLUMN source_hash TEXT')
+
+            columns = [row[1] for row in conn.execute('PRAGMA table_info(broadcast_areas)')]
+            if 'estimated_area' not in columns:
+                conn.execute('ALTER TABLE broadcast_areas ADD COLUMN estimated_area REAL')
+
+            conn.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS broadcast_area_bounding_boxes USING rtree(
+                id,
+                min_x, max_x,
+                min_y, max_y
+            )""")
+
+    def get_source_hashes(self):
+        return dict(self.query('SELECT id, source_hash FROM broadcast_area_polygons'))
+
+    def delete_polygons_without_areas(self):
+        with self.conn() as conn:
+            conn.execute('DELETE FROM broadcast_area_polygons WHERE id NOT IN (SELECT id FROM broadcast_areas);')
+
+    def migrate_polygons_to_wkb(self):
+        # databases built before polygons were stored as WKB have them as JSON text
+        q = """
+        SELECT id, polygons, simple_polygons
+        FROM broadcast_area_polygons
+        WHERE typeof(polygons) = 'text' OR typeof(simple_polygons) = 'text'
+        """
+
+        with self.conn() as conn:
+            conn.executemany(
+                """
+                UPDATE broadcast_area_polygons
+                SET polygons = ?, simple_polygons = ?
+                WHERE id = ?
+                """,
+                (
+                    (dump_polygons(load_polygons(polygons)), dump_polygons(load_polygons(simple_polygons)), id)
+                    for id, polygons, simple_polygons in conn.execute(q).fetchall()
+                ),
+            )
+
+    def has_estimated_areas(self):
+        return not self.query('SELECT 1 FROM broadcast_areas WHERE estimated_area IS NULL LIMIT 1')
+
+    def get_all_areas_for_estimating_phones(self):
+        q = """
+        SELECT id, broadcast_area_library_group_id, count_of_phones
+        FROM broadcast_areas
+        ORDER BY rowid
+        """
+
+        return self.query(q)
+
+    def update_estimated_areas_and_counts_of_phones(self, areas):
+        q = """
+        UPDATE broadcast_areas
+        SET estimated_area = ?, count_of_phones = ?
+        WHERE id = ?
+        """
+
+        with self.conn() as conn:
+            conn.executemany(q, (
+                (estimated_area, count_of_phones, id)
+                for id, estimated_area, count_of_phones in areas
+            ))
+
+    def insert_bounding_boxes(self, bounding_boxes):
+        q = """
+        INSERT INTO broadcast_area_bounding_boxes (id, min_x, max_x, min_y, max_y)
+        SELECT rowid, ?, ?, ?, ?
+        FROM broadcast_area_polygons
+        WHERE id = ?
+        """
+
+        with self.conn() as conn:
+            conn.execute('DELETE FROM broadcast_area_bounding_boxes;')
+            conn.executemany(q, (
+                (min_x, max_x, min_y, max_y, id)
+                for id, min_x, min_y, max_x, max_y in bounding_boxes
+            ))
 
     def query(self, sql, *args):
         with self.conn() as conn:
@@ -138,36 +265,26 @@ class BroadcastAreasRepository(object):
         return areas
 
     def get_all_areas_for_library(self, library_id):
-        is_multi_tier_library = self.query("""
-        SELECT exists(
-            SELECT 1
-            FROM broadcast_areas
-            WHERE broadcast_area_library_id = ? AND
-            broadcast_area_library_group_id IS NOT NULL
-        )
-        """, library_id)[0][0]
-
-        if is_multi_tier_library:
-            # only interested in areas with children - eg local authorities, counties, unitary authorities. not wards.
-            q = """
-            SELECT id, name, count_of_phones, broadcast_area_library_id
-            FROM broadcast_areas
-            JOIN (
-                SELECT DISTINCT broadcast_area_library_group_id
+        # if the library has more than one tier, only return areas with children - eg local authorities, counties,
+        # unitary authorities, but not wards. Countries don't have any children, so return all of them.
+        q = """
+        SELECT id, name, count_of_phones, broadcast_area_library_id
+        FROM broadcast_areas
+        WHERE broadcast_area_library_id = ? AND (
+            id IN (
+                SELECT broadcast_area_library_group_id
                 FROM broadcast_areas
                 WHERE broadcast_area_library_group_id IS NOT NULL
-            ) AS parent_broadcast_areas ON parent_broadcast_areas.broadcast_area_library_group_id = broadcast_areas.id
-            WHERE broadcast_area_library_id = ?
-            """
-        else:
-            # Countries don't have any children, so the above query wouldn't return anything.
-            q = """
-            SELECT id, name, count_of_phones, broadcast_area_library_id
-            FROM broadcast_areas
-            WHERE broadcast_area_library_id = ?
-            """
+            ) OR NOT exists(
+                SELECT 1
+                FROM broadcast_areas
+                WHERE broadcast_area_library_id = ? AND
+                broadcast_area_library_group_id IS NOT NULL
+            )
+        )
+        """
 
-        results = self.query(q, library_id)
+        results = self.query(q, library_id, library_id)
 
         return [
             (row[0], row[1], row[2], row[3])
@@ -217,7 +334,7 @@ class BroadcastAreasRepository(object):
 
         results = self.query(q, area_id)
 
-        return json.loads(results[0][0])
+        return load_polygons(results[0][0])
 
     def get_simple_polygons_for_area(self, area_id):
         q = """
@@ -228,4 +345,86 @@ class BroadcastAreasRepository(object):
 
         results = self.query(q, area_id)
 
-        return json.loads(results[0][0])
+        return load_polygons(results[0][0])
+
+    def _get_areas_intersecting(self, geometry):
+        # the R-tree finds areas whose bounding box overlaps, then each of
+        # their polygons is checked against a prepared geometry, which is
+        # quick to rule out any whose envelope doesn’t overlap
+        min_x, min_y, max_x, max_y = geometry.bounds
+        q = """
+        SELECT broadcast_areas.id, name, count_of_phones, broadcast_area_library_id, polygons
+        FROM broadcast_area_bounding_boxes
+        JOIN broadcast_area_polygons ON broadcast_area_polygons.rowid = broadcast_area_bounding_boxes.id
+        JOIN broadcast_areas ON broadcast_areas.id = broadcast_area_polygons.id
+        WHERE min_x <= ? AND max_x >= ? AND min_y <= ? AND max_y >= ?
+        ORDER BY broadcast_areas.id
+        """
+
+        results = self.query(q, max_x, min_x, max_y, min_y)
+        prepared_geometry = prep(geometry)
+
+        return [
+            (row[0], row[1], row[2], row[3])
+            for row in results
+            if any(prepared_geometry.intersects(polygon) for polygon in load_polygons(row[4]))
+        ]
+
+    def get_areas_intersecting_bounding_box(self, min_x, min_y, max_x, max_y):
+        """
+        Coordinates are longitude (x) and latitude (y), the same way round
+        as the polygons in the database.
+        """
+        return self._get_areas_intersecting(box(min_x, min_y, max_x, max_y))
+
+    def get_areas_containing_point(self, x, y):
+        return self._get_areas_intersecting(Point(x, y))
+
+
+class SharedBroadcastAreasRepository(BroadcastAreasRepository):
+    """
+    Reads from the database through one long-lived connection per thread,
+    rather than connecting again for every query. Under eventlet that means
+    one per worker, shared by all its green threads, because the connections
+    are kept in an unpatched `threading.local`.
+
+    The database is opened read-only and immutable, so SQLite doesn’t need to
+    lock it or check whether it has changed. Connections keep the compiled
+    form of the statements they run.
+
+    Each connection’s page cache is SQLite’s default size unless
+    `BROADCAST_AREAS_PAGE_CACHE_SIZE_IN_KIB` says otherwise, because every
+    worker has its own. Pages it doesn’t hold are still read from the
+    operating system’s page cache, which all the workers share, rather than
+    from disk.
+    """
+
+    PAGE_CACHE_SIZE_IN_KIB = int(os.environ.get('BROADCAST_AREAS_PAGE_CACHE_SIZE_IN_KIB', 2000))
+    CACHED_STATEMENTS = 256
+
+    def __init__(self):
+        # imported here so create-broadcast-areas-db.py, which uses the
+        # other repository, doesn’t need eventlet
+        from eventlet.patcher import original
+
+        super().__init__()
+        self._connections = original('threading').local()
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            'file:{}?mode=ro&immutable=1'.format(quote(str(self.database))),
+            uri=True,
+            cached_statements=self.CACHED_STATEMENTS,
+        )
+        conn.execute('PRAGMA cache_size = -{}'.format(self.PAGE_CACHE_SIZE_IN_KIB))
+        return conn
+
+    def _get_connection(self):
+        # a forked process (like one checking spreadsheets) needs its own connection
+        if getattr(self._connections, 'pid', None) != os.getpid():
+            self._connections.conn = self._connect()
+            self._connections.pid = os.getpid()
+        return self._connections.conn
+
+    def query(self, sql, *args):
+        return self._get_connection().execute(sql, args).fetchall()
@@ -1,5 +1,7 @@
 from flask import current_app
 
+from app.extensions import redis_client
+
 
 def list_routes():
     """List URLs of all application routes."""
@@ -7,5 +9,11 @@ def list_routes():
         print("{:10} {}".format(", ".join(rule.methods - set(['OPTIONS', 'HEAD'])), rule.rule))  # noqa
 
 
+def tag_cache_keys():
+    """Add cache keys set before we started tagging them to their tags."""
+    redis_client.tag_existing_keys()
+
+
 def setup_commands(application):
     application.cli.command('list-routes')(list_routes)
+    application.cli.command('tag-cache-keys')(tag_cache_keys)
@@ -80,6 +80,39 @@ class Config(object):
     REDIS_URL = os.environ.get('REDIS_URL')
     REDIS_ENABLED = os.environ.get('REDIS_ENABLED') == '1'
 
+    # keep a copy of rarely changing cache keys (organisations, branding) in each worker
+    LOCAL_CACHE_ENABLED = os.environ.get('LOCAL_CACHE_ENABLED') == '1'
+    LOCAL_CACHE_MAX_SIZE = 500
+    LOCAL_CACHE_TTL_IN_SECONDS = 300
+
+    # remember how many pages each letter has, rather than asking template preview every time it’s shown
+    LETTER_PAGE_COUNT_CACHE_ENABLED = os.environ.get('LETTER_PAGE_COUNT_CACHE_ENABLED', '1') == '1'
+
+    # keep rendered previews of letters in Redis, and let browsers revalidate the ones without personal data in
+    TEMPLATE_PREVIEW_CACHE_ENABLED = os.environ.get('TEMPLATE_PREVIEW_CACHE_ENABLED', '1') == '1'
+
+    # only turn on once every instance is running code which can read compressed values
+    CACHE_COMPRESSION_ENABLED = os.environ.get('CACHE_COMPRESSION_ENABLED') == '1'
+    CACHE_COMPRESSION_THRESHOLD_IN_BYTES = 2048
+
+    # connections to the API and template preview, kept open and shared by each worker
+    HTTP_POOL_MAX_SIZE = int(os.environ.get('HTTP_POOL_MAX_SIZE', 10))
+    HTTP_KEEP_ALIVE = os.environ.get('HTTP_KEEP_ALIVE', '1') == '1'
+    HTTP_CONNECT_TIMEOUT_IN_SECONDS = float(os.environ.get('HTTP_CONNECT_TIMEOUT_IN_SECONDS', 5))
+    # by default, wait as long as it takes for a response
+    HTTP_READ_TIMEOUT_IN_SECONDS = (
+        float(os.environ['HTTP_READ_TIMEOUT_IN_SECONDS']) if os.environ.get('HTTP_READ_TIMEOUT_IN_SECONDS') else None
+    )
+
+    # convert uploaded spreadsheets to CSV as they’re uploaded to S3, rather than all at once in memory
+    STREAMING_SPREADSHEET_UPLOADS = os.environ.get('STREAMING_SPREADSHEET_UPLOADS', '0') == '1'
+
+    # reports of sent notifications can be written to S3 in the background and downloaded from there once
+    # they’re ready, rather than streamed to the user while the request waits for every page from the API.
+    # The background work is a green thread in the web worker, so it competes with requests for that worker
+    # and is lost if the worker restarts – see `NotificationsExport`
+    NOTIFICATION_EXPORTS_IN_BACKGROUND = os.environ.get('NOTIFICATION_EXPORTS_IN_BACKGROUND', '0') == '1'
+
     ASSET_DOMAIN = ''
     ASSET_PATH = '/static/'
 
@@ -128,6 +161,8 @@ class Test(Development):
     ANTIVIRUS_API_HOST = 'https://test-antivirus'
     ANTIVIRUS_API_KEY = 'test-antivirus-secret'
     ANTIVIRUS_ENABLED = True
+    LETTER_PAGE_COUNT_CACHE_ENABLED = False
+    TEMPLATE_PREVIEW_CACHE_ENABLED = False
 
     ASSET_DOMAIN = 'static.example.com'
     ASSET_PATH = 'https://static.example.com/'
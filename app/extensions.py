@@ -1,9 +1,389 @@
+import json
+import re
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import timedelta
+from fnmatch import fnmatchcase
+from time import monotonic, time
+
+from flask import current_app
+from gds_metrics.metrics import Counter, Histogram
 from notifications_utils.clients.antivirus.antivirus_client import (
     AntivirusClient,
 )
 from notifications_utils.clients.redis.redis_client import RedisClient
 from notifications_utils.clients.zendesk.zendesk_client import ZendeskClient
 
+from app.local_cache import LocalCache
+
+# note: `service-{uuid}-templates` cache is cleared for both services and templates.
+CACHE_KEY_GROUPS = OrderedDict([
+    ('user', [
+        'user-????????-????-????-????-????????????',
+    ]),
+    ('service', [
+        'has_jobs-????????-????-????-????-????????????',
+        'service-????????-????-????-????-????????????',
+        'service-????????-????-????-????-????????????-templates',
+        'service-????????-????-????-????-????????????-data-retention',
+        'service-????????-????-????-????-????????????-template-folders',
+        'service-????????-????-????-????-????????????-returned-letters-statistics',
+        'service-????????-????-????-????-????????????-returned-letters-summary',
+    ]),
+    ('template', [
+        'service-????????-????-????-????-????????????-templates',
+        'service-????????-????-????-????-????????????-template-????????-????-????-????-????????????-version-*',
+        'service-????????-????-????-????-????????????-template-????????-????-????-????-????????????-versions',
+    ]),
+    ('email_branding', [
+        'email_branding',
+        'email_branding-????????-????-????-????-????????????',
+    ]),
+    ('letter_branding', [
+        'letter_branding',
+        'letter_branding-????????-????-????-????-????????????',
+    ]),
+    ('organisation', [
+        'organisations',
+        'domains',
+        'live-service-and-organisation-counts',
+        'organisation-????????-????-????-????-????????????-name',
+    ]),
+    ('broadcast', [
+        'service-????????-????-????-????-????????????-broadcast-message-????????-????-????-????-????????????',
+    ]),
+    ('template_preview', [
+        'template-preview-*',
+        'service-????????-????-????-????-????????????-letter-upload-????????-????-????-????-????????????-page-*',
+    ]),
+])
+
+# the first pattern a key matches decides which family its metrics are counted under
+CACHE_KEY_FAMILIES = [
+    ('user-*', 'user'),
+    ('has_jobs-*', 'has-jobs'),
+    ('service-*-checked-upload-*', 'checked-upload'),
+    ('service-*-notifications-export-*', 'notifications-export'),
+    ('service-*-letter-upload-*', 'letter-upload-preview'),
+    ('service-*-templates', 'templates'),
+    ('service-*-template-folders', 'template-folders'),
+    ('service-*-template-*-versions', 'template-versions'),
+    ('service-*-template-*-version-*', 'template-version'),
+    ('service-*-data-retention', 'data-retention'),
+    ('service-*-returned-letters-*', 'returned-letters'),
+    ('service-*-broadcast-message-*', 'broadcast-message'),
+    ('service-*', 'service'),
+    ('email_branding*', 'branding'),
+    ('letter_branding*', 'branding'),
+    ('organisation-*', 'organisation'),
+    ('organisations', 'organisations'),
+    ('domains', 'domains'),
+    ('live-service-and-organisation-counts', 'live-counts'),
+    ('platform-stats-*', 'platform-stats'),
+    ('live-services-data-*', 'live-services-data'),
+    ('usage-for-all-services-*', 'usage-for-all-services'),
+    ('notification-status-by-service-*', 'notification-status-by-service'),
+    ('letter-page-count-*', 'letter-page-count'),
+    ('template-preview-*', 'template-preview'),
+]
+
+CACHE_HITS = Counter(
+    'admin_cache_hits_total',
+    'Cache keys looked up by RequestCache and found',
+    ['family'],
+)
+CACHE_MISSES = Counter(
+    'admin_cache_misses_total',
+    'Cache keys looked up by RequestCache and not found',
+    ['family'],
+)
+CACHE_SETS = Counter(
+    'admin_cache_sets_total',
+    'Cache keys set by RequestCache',
+    ['family'],
+)
+CACHE_DELETES = Counter(
+    'admin_cache_deletes_total',
+    'Cache keys deleted by RequestCache',
+    ['family'],
+)
+REDIS_REQUEST_DURATION_SECONDS = Histogram(
+    'admin_redis_request_duration_seconds',
+    'Time taken by requests to Redis',
+    ['operation', 'family'],
+)
+
+SERVICE_TEMPLATE_CACHE_KEY = re.compile(r'^service-([0-9a-f-]{36})-template-')
+SERVICE_TEMPLATE_CACHE_KEY_PATTERN = re.compile(r'^service-[0-9a-f-]{36}-template-\*$')
+
+
+def get_cache_key_tags(key):
+    """
+    Returns the patterns we delete keys by which `key` matches: the ones in
+    `CACHE_KEY_GROUPS` and `service-{service_id}-template-*` for its service.
+    """
+    tags = {
+        pattern
+        for patterns in CACHE_KEY_GROUPS.values()
+        for pattern in patterns
+        if fnmatchcase(key, pattern)
+    }
+    match = SERVICE_TEMPLATE_CACHE_KEY.match(key)
+    if match:
+        tags.add('service-{}-template-*'.format(match.group(1)))
+    return tags
+
+
+def get_cache_key_family(*keys):
+    families = {
+        next((family for pattern, family in CACHE_KEY_FAMILIES if fnmatchcase(key, pattern)), 'other')
+        for key in keys
+    }
+    return families.pop() if len(families) == 1 else 'multiple'
+
+
+@contextmanager
+def time_redis_request(operation, *keys):
+    start = monotonic()
+    try:
+        yield
+    finally:
+        REDIS_REQUEST_DURATION_SECONDS.labels(operation, get_cache_key_family(*keys)).observe(monotonic() - start)
+
+
+def is_cache_key_tag(pattern):
+    return (
+        any(pattern in patterns for patterns in CACHE_KEY_GROUPS.values())
+        or bool(SERVICE_TEMPLATE_CACHE_KEY_PATTERN.match(pattern))
+    )
+
+
+class NotifyAdminRedisClient(RedisClient):
+    """
+    Adds two things to the standard Redis client.
+
+    Tags: whenever we set a key, we also add it to a Redis sorted set for each
+    pattern we might later delete it by (see `get_cache_key_tags`), scored by
+    when the key expires. Deleting by one of those patterns then deletes the
+    members of its set, rather than scanning the whole keyspace. Keys set before
+    tagging was added aren’t in any set, so we keep scanning until
+    `flask tag-cache-keys` has been run once to add them.
+
+    A local cache: a copy of cache keys which hardly ever change (organisations,
+    domains, branding) is kept in each worker’s memory, in front of Redis.
+    Deleting keys, one at a time or by pattern, forgets them locally and then
+    tells every other worker to do the same over a Redis pub/sub channel. If a
+    worker stops listening to that channel it stops using its local copies
+    until it’s restarted, and anything kept locally expires after
+    `LOCAL_CACHE_TTL_IN_SECONDS` in case a message goes missing.
+
+    It also records how long each request to Redis takes, by cache key family.
+    """
+
+    LOCAL_CACHE_KEYS = (
+        'organisations',
+        'domains',
+        'email_branding',
+        'email_branding-*',
+        'letter_branding',
+        'letter_branding-*',
+        'live-service-and-organisation-counts',
+    )
+
+    INVALIDATION_CHANNEL = 'admin-local-cache-invalidation'
+
+    TAG_PREFIX = 'cache-tag:'
+    TAGS_COMPLETE_KEY = 'cache-tags-complete'
+    # at least as long as the longest TTL we set keys with (`RequestCache.TTL`),
+    # so a tag never expires before the keys in it
+    TAG_TTL_IN_SECONDS = int(timedelta(days=7).total_seconds())
+
+    local_cache = None
+    _listener = None
+
+    def init_app(self, app):
+        super().init_app(app)
+        if self.active and app.config['LOCAL_CACHE_ENABLED']:
+            try:
+                self._listener = self._listen_for_invalidations()
+            except Exception:
+                app.logger.exception('Could not subscribe to {}, not using local cache'.format(
+                    self.INVALIDATION_CHANNEL
+                ))
+            else:
+                self.local_cache = LocalCache(
+                    maxsize=app.config['LOCAL_CACHE_MAX_SIZE'],
+                    ttl=app.config['LOCAL_CACHE_TTL_IN_SECONDS'],
+                )
+
+    @property
+    def local_cache_in_use(self):
+        if self.local_cache is None:
+            return False
+        if not self._listener.is_alive():
+            # without invalidation messages we can’t trust anything we’ve kept
+            self.local_cache.clear()
+            return False
+        return True
+
+    def is_local_cache_key(self, key):
+        return any(fnmatchcase(key, pattern) for pattern in self.LOCAL_CACHE_KEYS)
+
+    def get(self, key, *args, **kwargs):
+        if not (self.is_local_cache_key(key) and self.local_cache_in_use):
+            return self._get_from_redis(key, *args, **kwargs)
+
+        value = self.local_cache.get(key)
+        if value is None:
+            value = self._get_from_redis(key, *args, **kwargs)
+            if value is not None:
+                self.local_cache.set(key, value)
+        return value
+
+    def _get_from_redis(self, key, *args, **kwargs):
+        with time_redis_request('get', key):
+            return super().get(key, *args, **kwargs)
+
+    def set(self, key, *args, **kwargs):
+        if self.local_cache is not None:
+            self.local_cache.forget(key)
+        with time_redis_request('set', key):
+            ret = super().set(key, *args, **kwargs)
+            self.tag(key, ex=kwargs.get('ex'))
+        return ret
+
+    def tag(self, *keys, ex=None):
+        """
+        Adding keys to a tag also removes any keys in it which have expired, so
+        tags that keys are always being added to don’t grow forever. Every key
+        added pushes its tags’ expiry back to `TAG_TTL_IN_SECONDS`, or `ex` if
+        that’s longer, so tags nothing is added to go away too.
+        """
+        if not self.active:
+            return
+        now = time()
+        expires_at = now + ex if ex else float('inf')
+        tag_ttl_in_seconds = max(ex or 0, self.TAG_TTL_IN_SECONDS)
+        try:
+            pipeline = self.redis_store.pipeline(transaction=False)
+            for key in keys:
+                for tag in get_cache_key_tags(key):
+                    pipeline.zadd(self.TAG_PREFIX + tag, {key: expires_at})
+                    pipeline.zremrangebyscore(self.TAG_PREFIX + tag, '-inf', now)
+                    pipeline.expire(self.TAG_PREFIX + tag, tag_ttl_in_seconds)
+            pipeline.execute()
+        except Exception:
+            current_app.logger.exception('Redis error tagging {}'.format(keys))
+
+    def untag(self, *keys):
+        if not self.active:
+            return
+        try:
+            pipeline = self.redis_store.pipeline(transaction=False)
+            for key in keys:
+                for tag in get_cache_key_tags(key):
+                    pipeline.zrem(self.TAG_PREFIX + tag, key)
+            pipeline.execute()
+        except Exception:
+            current_app.logger.exception('Redis error untagging {}'.format(keys))
+
+    def delete(self, *keys, **kwargs):
+        with time_redis_request('delete', *keys):
+            ret = super().delete(*keys, **kwargs)
+            self.untag(*keys)
+        local_keys = [key for key in keys if self.is_local_cache_key(key)]
+        if local_keys:
+            self._invalidate({'keys': local_keys})
+        return ret
+
+    def delete_cache_keys_by_pattern(self, pattern, *args, **kwargs):
+        with time_redis_request('delete_by_pattern', pattern):
+            if is_cache_key_tag(pattern) and self.tags_complete:
+                ret = self._delete_cache_keys_by_tag(pattern)
+            else:
+                ret = super().delete_cache_keys_by_pattern(pattern, *args, **kwargs)
+        self._invalidate({'pattern': pattern})
+        return ret
+
+    @property
+    def tags_complete(self):
+        return self.active and bool(super().get(self.TAGS_COMPLETE_KEY))
+
+    def _delete_cache_keys_by_tag(self, tag):
+        tag_key = self.TAG_PREFIX + tag
+        now = time()
+        try:
+            keys = self.redis_store.zrangebyscore(tag_key, now, '+inf')
+            if not keys:
+                self.redis_store.zremrangebyscore(tag_key, '-inf', now)
+                return 0
+            pipeline = self.redis_store.pipeline()
+            pipeline.delete(*keys)
+            # only remove the keys we’ve deleted, in case any were added since we looked
+            pipeline.zrem(tag_key, *keys)
+            pipeline.zremrangebyscore(tag_key, '-inf', now)
+            num_deleted, *_ = pipeline.execute()
+            return num_deleted
+        except Exception:
+            current_app.logger.exception('Redis error deleting keys tagged {}'.format(tag))
+            return 0
+
+    def tag_existing_keys(self):
+        """
+        Adds keys set before we started tagging to their tags, then marks the tags
+        as complete so `delete_cache_keys_by_pattern` can start using them.
+        """
+        for patterns in CACHE_KEY_GROUPS.values():
+            for pattern in patterns:
+                for key in self.redis_store.scan_iter(pattern):
+                    key = key.decode('utf-8') if isinstance(key, bytes) else key
+                    # -1 if the key never expires, -2 if it’s already gone
+                    ttl_in_seconds = self.redis_store.ttl(key)
+                    if ttl_in_seconds != -2:
+                        self.tag(key, ex=ttl_in_seconds if ttl_in_seconds > 0 else None)
+        self.redis_store.set(self.TAGS_COMPLETE_KEY, b'true')
+
+    def acquire_lock(self, name, timeout_in_seconds):
+        """
+        Returns True if nobody else holds the lock called `name`. The lock is
+        released by deleting `lock:{name}`, or when `timeout_in_seconds` is up.
+        """
+        if not self.active:
+            return True
+        try:
+            return bool(self.redis_store.set('lock:{}'.format(name), b'locked', nx=True, ex=timeout_in_seconds))
+        except Exception:
+            current_app.logger.exception('Redis error acquiring lock {}'.format(name))
+            return False
+
+    def release_lock(self, name):
+        self.delete('lock:{}'.format(name))
+
+    def _invalidate(self, message):
+        if self.local_cache is None:
+            return
+        self._forget(message)
+        try:
+            self.redis_store.publish(self.INVALIDATION_CHANNEL, json.dumps(message))
+        except Exception:
+            current_app.logger.exception('Redis error publishing to {}'.format(self.INVALIDATION_CHANNEL))
+
+    def _forget(self, message):
+        if 'pattern' in message:
+            self.local_cache.forget_matching(message['pattern'])
+        else:
+            self.local_cache.forget(*message['keys'])
+
+    def _handle_invalidation_message(self, message):
+        self._forget(json.loads(message['data']))
+
+    def _listen_for_invalidations(self):
+        pubsub = self.redis_store.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(**{self.INVALIDATION_CHANNEL: self._handle_invalidation_message})
+        # on our eventlet workers `threading` is monkey patched, so this runs in a green thread
+        return pubsub.run_in_thread(sleep_time=1, daemon=True)
+
+
 antivirus_client = AntivirusClient()
 zendesk_client = ZendeskClient()
-redis_client = RedisClient()
+redis_client = NotifyAdminRedisClient()
@@ -0,0 +1,84 @@
+from threading import Lock
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class HTTPSessions():
+    """
+    Keeps a `requests.Session` for each host we talk to (the API and template
+    preview) for the life of the worker, so connections to them, and the TLS
+    handshakes done on those connections, are reused rather than made again for
+    every request.
+
+    A pool never makes a green thread wait for a connection: if more than
+    `HTTP_POOL_MAX_SIZE` want one at once, the extras get a new connection which
+    is closed afterwards.
+    """
+
+    def __init__(self):
+        self._sessions = {}
+        self._adapters = {}
+        self._lock = Lock()
+        self.pool_max_size = 10
+        self.keep_alive = True
+        self.timeout = None
+
+    def init_app(self, app):
+        self.pool_max_size = app.config['HTTP_POOL_MAX_SIZE']
+        self.keep_alive = app.config['HTTP_KEEP_ALIVE']
+        self.timeout = (
+            app.config['HTTP_CONNECT_TIMEOUT_IN_SECONDS'],
+            app.config['HTTP_READ_TIMEOUT_IN_SECONDS'],
+        )
+
+    @staticmethod
+    def _get_origin(url):
+        scheme, netloc, *_ = urlsplit(url)
+        return '{}://{}'.format(scheme, netloc)
+
+    def _create_session(self, origin):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_max_size, pool_block=False)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        if not self.keep_alive:
+            session.headers['Connection'] = 'close'
+        self._adapters[origin] = adapter
+        return session
+
+    def get_session(self, url):
+        origin = self._get_origin(url)
+        with self._lock:
+            if origin not in self._sessions:
+                self._sessions[origin] = self._create_session(origin)
+            return self._sessions[origin]
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return self.get_session(url).request(method, url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def get_stats(self):
+        stats = {}
+        with self._lock:
+            for origin, adapter in self._adapters.items():
+                pools = [adapter.poolmanager.pools[key] for key in adapter.poolmanager.pools.keys()]
+                stats[origin] = {
+                    'pool_max_size': self.pool_max_size,
+                    'connections_made': sum(pool.num_connections for pool in pools),
+                    'requests_made': sum(pool.num_requests for pool in pools),
+                    # pools are filled with `None` until they have made that many connections
+                    'idle_connections': sum(
+                        connection is not None
+                        for pool in pools if pool.pool is not None
+                        for connection in list(pool.pool.queue)
+                    ),
+                }
+        return stats
+
+
+http_sessions = HTTPSessions()
@@ -0,0 +1,38 @@
+from fnmatch import fnmatchcase
+from threading import Lock
+from time import monotonic
+
+from cachetools import TTLCache
+
+
+class LocalCache():
+    """
+    A size-limited, per-worker store of values which expire after `ttl` seconds,
+    dropping the least recently used values first when it’s full.
+    """
+
+    def __init__(self, maxsize, ttl, timer=monotonic):
+        self._values = TTLCache(maxsize=maxsize, ttl=ttl, timer=timer)
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            return self._values.get(key)
+
+    def set(self, key, value):
+        with self._lock:
+            self._values[key] = value
+
+    def forget(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._values.pop(key, None)
+
+    def forget_matching(self, pattern):
+        with self._lock:
+            for key in [key for key in self._values.keys() if fnmatchcase(key, pattern)]:
+                self._values.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
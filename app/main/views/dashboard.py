@@ -25,6 +25,7 @@ from app import (
 )
 from app.formatters import format_date_numeric, format_datetime_numeric
 from app.main import main
+from app.notify_client import fetch_concurrently
 from app.statistics_utils import get_formatted_percentage
 from app.utils import (
     DELIVERED_STATUSES,
@@ -133,16 +134,20 @@ def template_usage(service_id):
 def usage(service_id):
     year, current_financial_year = requested_and_current_financial_year(request)
 
-    free_sms_allowance = billing_api_client.get_free_sms_fragment_limit_for_year(service_id, year)
-    units = billing_api_client.get_billable_units(service_id, year)
-    yearly_usage = billing_api_client.get_service_usage(service_id, year)
+    results = fetch_concurrently(
+        free_sms_allowance=partial(billing_api_client.get_free_sms_fragment_limit_for_year, service_id, year),
+        units=partial(billing_api_client.get_billable_units, service_id, year),
+        yearly_usage=partial(billing_api_client.get_service_usage, service_id, year),
+    )
+    free_sms_allowance = results['free_sms_allowance']
+    yearly_usage = results['yearly_usage']
 
     return render_template(
         'views/usage.html',
         months=list(get_free_paid_breakdown_for_billable_units(
             year,
             free_sms_allowance,
-            units
+            results['units']
         )),
         selected_year=year,
         years=get_tuples_of_financial_years(
@@ -281,19 +286,35 @@ def aggregate_notifications_stats(template_statistics):
 
 
 def get_dashboard_partials(service_id):
-    all_statistics = template_statistics_client.get_template_statistics_for_service(service_id, limit_days=7)
+    results = fetch_concurrently(
+        all_statistics=partial(
+            template_statistics_client.get_template_statistics_for_service,
+            service_id,
+            limit_days=7,
+        ),
+        free_sms_allowance=partial(
+            billing_api_client.get_free_sms_fragment_limit_for_year,
+            current_service.id,
+            get_current_financial_year(),
+        ),
+        yearly_usage=partial(
+            billing_api_client.get_service_usage,
+            service_id,
+            get_current_financial_year(),
+        ),
+        # The upcoming and inbox partials read these from `current_service` while
+        # rendering, so load them now alongside everything else
+        scheduled_job_stats=lambda: current_service.scheduled_job_stats,
+        inbound_sms_summary=lambda: current_service.inbound_sms_summary,
+        returned_letter_statistics=lambda: current_service.returned_letter_statistics,
+    )
+    all_statistics = results['all_statistics']
     template_statistics = aggregate_template_usage(all_statistics)
     stats = aggregate_notifications_stats(all_statistics)
 
     dashboard_totals = get_dashboard_totals(stats),
-    free_sms_allowance = billing_api_client.get_free_sms_fragment_limit_for_year(
-        current_service.id,
-        get_current_financial_year(),
-    )
-    yearly_usage = billing_api_client.get_service_usage(
-        service_id,
-        get_current_financial_year(),
-    )
+    free_sms_allowance = results['free_sms_allowance']
+    yearly_usage = results['yearly_usage']
     return {
         'upcoming': render_template(
             'views/dashboard/_upcoming.html',
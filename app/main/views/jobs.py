@@ -33,6 +33,7 @@ from app.formatters import get_time_left
 from app.main import main
 from app.main.forms import SearchNotificationsForm
 from app.models.job import Job
+from app.models.notifications_export import NotificationsExport
 from app.utils import (
     generate_next_dict,
     generate_notifications_csv,
@@ -93,24 +94,30 @@ def view_job_csv(service_id, job_id):
     filter_args = parse_filter_args(request.args)
     filter_args['status'] = set_status_filters(filter_args)
 
+    csv_kwargs = dict(
+        job_id=job_id,
+        status=filter_args.get('status'),
+        page=request.args.get('page', 1),
+        page_size=5000,
+        format_for_csv=True,
+        template_type=job.template_type,
+    )
+    filename = '{} - {}.csv'.format(
+        job.template['name'],
+        format_datetime_short(job.created_at)
+    )
+
+    if NotificationsExport.can_start():
+        export = NotificationsExport.start(service_id=service_id, filename=filename, **csv_kwargs)
+        return redirect(url_for('.view_notifications_export', service_id=service_id, export_id=export.id))
+
     return Response(
         stream_with_context(
-            generate_notifications_csv(
-                service_id=service_id,
-                job_id=job_id,
-                status=filter_args.get('status'),
-                page=request.args.get('page', 1),
-                page_size=5000,
-                format_for_csv=True,
-                template_type=job.template_type,
-            )
+            generate_notifications_csv(service_id=service_id, **csv_kwargs)
         ),
         mimetype='text/csv',
         headers={
-            'Content-Disposition': 'inline; filename="{} - {}.csv"'.format(
-                job.template['name'],
-                format_datetime_short(job.created_at)
-            )
+            'Content-Disposition': 'inline; filename="{}"'.format(filename)
         }
     )
 
@@ -184,7 +191,8 @@ def view_notifications(service_id, message_type=None):
             service_id=current_service.id,
             message_type=message_type,
             status=request.args.get('status')
-        )
+        ),
+        background_export=NotificationsExport.can_start(),
     )
 
 
@@ -402,6 +410,7 @@ def get_job_partials(job):
                 job_id=job.id,
                 status=request.args.get('status')
             ),
+            background_export=NotificationsExport.can_start(),
             time_left=get_time_left(job.created_at, service_data_retention_days=service_data_retention_days),
             job=job,
             service_data_retention_days=service_data_retention_days,
@@ -8,6 +8,7 @@ from datetime import datetime
 from dateutil import parser
 from flask import (
     Response,
+    abort,
     flash,
     jsonify,
     redirect,
@@ -32,6 +33,7 @@ from app import (
     notification_api_client,
 )
 from app.main import main
+from app.models.notifications_export import NotificationsExport
 from app.notify_client.api_key_api_client import KEY_TYPE_TEST
 from app.template_previews import get_page_count_for_letter
 from app.utils import (
@@ -270,24 +272,73 @@ def download_notifications_csv(service_id):
     filter_args['status'] = set_status_filters(filter_args)
 
     service_data_retention_days = current_service.get_days_of_retention(filter_args.get('message_type')[0])
+    csv_kwargs = dict(
+        job_id=None,
+        status=filter_args.get('status'),
+        page=request.args.get('page', 1),
+        page_size=10000,
+        format_for_csv=True,
+        template_type=filter_args.get('message_type'),
+        limit_days=service_data_retention_days,
+    )
+    filename = '{} - {} - {} report.csv'.format(
+        format_date_numeric(datetime.now().strftime("%Y-%m-%dT%H:%M:%S.%fZ")),
+        filter_args['message_type'][0],
+        current_service.name,
+    )
+
+    if NotificationsExport.can_start():
+        export = NotificationsExport.start(service_id=service_id, filename=filename, **csv_kwargs)
+        return redirect(url_for('.view_notifications_export', service_id=service_id, export_id=export.id))
+
     return Response(
         stream_with_context(
-            generate_notifications_csv(
-                service_id=service_id,
-                job_id=None,
-                status=filter_args.get('status'),
-                page=request.args.get('page', 1),
-                page_size=10000,
-                format_for_csv=True,
-                template_type=filter_args.get('message_type'),
-                limit_days=service_data_retention_days,
-            )
+            generate_notifications_csv(service_id=service_id, **csv_kwargs)
         ),
         mimetype='text/csv',
         headers={
-            'Content-Disposition': 'inline; filename="{} - {} - {} report.csv"'.format(
-                format_date_numeric(datetime.now().strftime("%Y-%m-%dT%H:%M:%S.%fZ")),
-                filter_args['message_type'][0],
-                current_service.name)
+            'Content-Disposition': 'inline; filename="{}"'.format(filename)
         }
     )
+
+
+@main.route("/services/<uuid:service_id>/notifications-export/<uuid:export_id>")
+@user_has_permissions('view_activity')
+def view_notifications_export(service_id, export_id):
+    export = NotificationsExport.from_id(export_id, service_id=service_id)
+    return render_template(
+        'views/notifications/export.html',
+        export=export,
+        partials=get_notifications_export_partials(export),
+        updates_url=url_for('.view_notifications_export_updates', service_id=service_id, export_id=export.id),
+    )
+
+
+@main.route("/services/<uuid:service_id>/notifications-export/<uuid:export_id>.json")
+@user_has_permissions('view_activity')
+def view_notifications_export_updates(service_id, export_id):
+    export = NotificationsExport.from_id(export_id, service_id=service_id)
+    return jsonify(
+        status=export.status,
+        download_url=export.get_download_url() if export.finished else None,
+        stop=0 if export.pending else 1,
+        **get_notifications_export_partials(export)
+    )
+
+
+@main.route("/services/<uuid:service_id>/notifications-export/<uuid:export_id>.csv")
+@user_has_permissions('view_activity')
+def download_notifications_export(service_id, export_id):
+    export = NotificationsExport.from_id(export_id, service_id=service_id)
+    if not export.finished:
+        abort(404)
+    return redirect(export.get_download_url())
+
+
+def get_notifications_export_partials(export):
+    return {
+        'export': render_template(
+            'partials/notifications/export.html',
+            export=export,
+        ),
+    }
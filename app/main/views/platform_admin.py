@@ -1,6 +1,7 @@
 import itertools
+import os
 import re
-from collections import OrderedDict
+from collections import OrderedDict, defaultdict
 from datetime import datetime
 
 from flask import abort, flash, redirect, render_template, request, url_for
@@ -11,11 +12,12 @@ from app import (
     complaint_api_client,
     format_date_numeric,
     letter_jobs_client,
+    metrics,
     notification_api_client,
     platform_stats_api_client,
     service_api_client,
 )
-from app.extensions import redis_client
+from app.extensions import CACHE_KEY_GROUPS, redis_client
 from app.main import main
 from app.main.forms import (
     ClearCacheForm,
@@ -399,53 +401,15 @@ def platform_admin_returned_letters():
 @main.route("/platform-admin/clear-cache", methods=['GET', 'POST'])
 @user_is_platform_admin
 def clear_cache():
-    # note: `service-{uuid}-templates` cache is cleared for both services and templates.
-    CACHE_KEYS = OrderedDict([
-        ('user', [
-            'user-????????-????-????-????-????????????',
-        ]),
-        ('service', [
-            'has_jobs-????????-????-????-????-????????????',
-            'service-????????-????-????-????-????????????',
-            'service-????????-????-????-????-????????????-templates',
-            'service-????????-????-????-????-????????????-data-retention',
-            'service-????????-????-????-????-????????????-template-folders',
-            'service-????????-????-????-????-????????????-returned-letters-statistics',
-            'service-????????-????-????-????-????????????-returned-letters-summary',
-        ]),
-        ('template', [
-            'service-????????-????-????-????-????????????-templates',
-            'service-????????-????-????-????-????????????-template-????????-????-????-????-????????????-version-*',
-            'service-????????-????-????-????-????????????-template-????????-????-????-????-????????????-versions',
-        ]),
-        ('email_branding', [
-            'email_branding',
-            'email_branding-????????-????-????-????-????????????',
-        ]),
-        ('letter_branding', [
-            'letter_branding',
-            'letter_branding-????????-????-????-????-????????????',
-        ]),
-        ('organisation', [
-            'organisations',
-            'domains',
-            'live-service-and-organisation-counts',
-            'organisation-????????-????-????-????-????????????-name',
-        ]),
-        ('broadcast', [
-            'service-????????-????-????-????-????????????-broadcast-message-????????-????-????-????-????????????',
-        ]),
-    ])
-
     form = ClearCacheForm()
-    form.model_type.choices = [(key, key.replace('_', ' ').title()) for key in CACHE_KEYS]
+    form.model_type.choices = [(key, key.replace('_', ' ').title()) for key in CACHE_KEY_GROUPS]
 
     if form.validate_on_submit():
         to_delete = form.model_type.data
 
         num_deleted = max(
             redis_client.delete_cache_keys_by_pattern(pattern)
-            for pattern in CACHE_KEYS[to_delete]
+            for pattern in CACHE_KEY_GROUPS[to_delete]
         )
         msg = 'Removed {} {} object{} from redis'
         flash(msg.format(num_deleted, to_delete, 's' if num_deleted != 1 else ''), category='default')
@@ -456,6 +420,47 @@ def clear_cache():
     )
 
 
+@main.route("/platform-admin/cache-statistics")
+@user_is_platform_admin
+def cache_statistics():
+    return render_template(
+        'views/platform-admin/cache-statistics.html',
+        families=get_cache_statistics(metrics.registry),
+        process_id=os.getpid(),
+    )
+
+
+def get_cache_statistics(registry):
+    """
+    Adds up the cache metrics by cache key family. The registry only has this
+    process’s metrics – Prometheus is where they’re added up across workers.
+    """
+    families = defaultdict(lambda: {
+        'hits': 0, 'misses': 0, 'sets': 0, 'deletes': 0, 'get_seconds': 0, 'gets': 0,
+    })
+    sample_names = {
+        'admin_cache_hits_total': 'hits',
+        'admin_cache_misses_total': 'misses',
+        'admin_cache_sets_total': 'sets',
+        'admin_cache_deletes_total': 'deletes',
+        'admin_redis_request_duration_seconds_sum': 'get_seconds',
+        'admin_redis_request_duration_seconds_count': 'gets',
+    }
+    for metric in registry.collect():
+        for sample in metric.samples:
+            if sample.name not in sample_names or sample.labels.get('operation', 'get') != 'get':
+                continue
+            families[sample.labels['family']][sample_names[sample.name]] += sample.value
+
+    for name, family in families.items():
+        lookups = family['hits'] + family['misses']
+        family['name'] = name
+        family['hit_ratio'] = family['hits'] / lookups if lookups else None
+        family['average_get_milliseconds'] = 1000 * family['get_seconds'] / family['gets'] if family['gets'] else None
+
+    return sorted(families.values(), key=lambda family: family['name'])
+
+
 def sum_service_usage(service):
     total = 0
     for notification_type in service['statistics'].keys():
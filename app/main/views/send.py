@@ -1,4 +1,7 @@
+import csv
 import itertools
+import json
+from datetime import timedelta
 from string import ascii_uppercase
 from zipfile import BadZipFile
 
@@ -43,6 +46,7 @@ from app.main.forms import (
 )
 from app.models.contact_list import ContactList, ContactListsAlphabetical
 from app.models.user import Users
+from app.notify_client import cache
 from app.s3_client.s3_csv_client import (
     get_csv_metadata,
     s3download,
@@ -60,6 +64,8 @@ from app.utils import (
     user_has_permissions,
 )
 
+CHECKED_UPLOAD_TTL_IN_SECONDS = int(timedelta(hours=1).total_seconds())
+
 letter_address_columns = [
     column.replace('_', ' ')
     for column in address_lines_1_to_7_keys
@@ -147,7 +153,9 @@ def send_messages(service_id, template_id):
         try:
             upload_id = s3upload(
                 service_id,
-                Spreadsheet.from_file_form(form).as_dict,
+                Spreadsheet.from_file_form(
+                    form, streaming=current_app.config['STREAMING_SPREADSHEET_UPLOADS']
+                ).as_dict,
                 current_app.config['AWS_REGION']
             )
             file_name_metadata = unicode_truncate(
@@ -589,7 +597,7 @@ def send_from_contact_list(service_id, template_id, contact_list_id):
     ))
 
 
-def _check_messages(service_id, template_id, upload_id, preview_row, letters_as_pdf=False):
+def _check_messages(service_id, template_id, upload_id, preview_row):
 
     try:
         # The happy path is that the job doesn’t already exist, so the
@@ -634,7 +642,7 @@ def _check_messages(service_id, template_id, upload_id, preview_row, letters_as_
             upload_id=upload_id,
             filetype='png',
             row_index=preview_row,
-        ) if not letters_as_pdf else None,
+        ),
         email_reply_to=email_reply_to,
         sms_sender=sms_sender,
         page_count=get_page_count_for_letter(db_template),
@@ -701,6 +709,106 @@ def _check_messages(service_id, template_id, upload_id, preview_row, letters_as_
     )
 
 
+def _get_checked_upload_cache_key(service_id, upload_id, db_template):
+    return 'service-{}-checked-upload-{}-template-{}-version-{}'.format(
+        service_id, upload_id, db_template['id'], db_template['version']
+    )
+
+
+def _get_row_line_numbers(contents):
+    """
+    Returns the number of lines taken up by the column headers and the line each
+    row starts on, or `None` instead of the list if every row is one line long.
+    The last item is where a row after the last one would start.
+    """
+    reader = csv.reader(contents.strip().splitlines(), quoting=csv.QUOTE_MINIMAL, skipinitialspace=True)
+    next(reader, None)
+    header_line_count = reader.line_num
+    row_line_numbers = [header_line_count]
+    for _row in reader:
+        row_line_numbers.append(reader.line_num)
+    if row_line_numbers == list(range(header_line_count, header_line_count + len(row_line_numbers))):
+        return header_line_count, len(row_line_numbers) - 1, None
+    return header_line_count, len(row_line_numbers) - 1, row_line_numbers
+
+
+def _cache_checked_upload(service_id, upload_id, db_template, contents, recipients):
+    """
+    Stores what the preview of a row needs to know about a checked upload: how
+    many rows it has and where in the file each one is. Errors aren’t stored
+    because they depend on the service’s daily limit and team members, which
+    can change between requests.
+    """
+    key = _get_checked_upload_cache_key(service_id, upload_id, db_template)
+    header_line_count, row_count, row_line_numbers = _get_row_line_numbers(contents)
+    checked_upload = {
+        'count_of_recipients': len(recipients),
+        'column_headers': list(recipients.column_headers),
+        'header_line_count': header_line_count,
+        # if we split the file differently to RecipientCSV we can’t find
+        # rows in it, so we have to check the whole file every time
+        'rows_can_be_found': row_count == len(recipients),
+        'row_line_numbers': row_line_numbers,
+    }
+    cache.redis_client.set(key, json.dumps(checked_upload), ex=CHECKED_UPLOAD_TTL_IN_SECONDS)
+    return checked_upload
+
+
+def _get_checked_upload(service_id, upload_id, db_template, contents, template):
+    cached = cache.redis_client.get(_get_checked_upload_cache_key(service_id, upload_id, db_template))
+    if cached:
+        return json.loads(cached.decode('utf-8'))
+    return _cache_checked_upload(
+        service_id, upload_id, db_template, contents, RecipientCSV(contents, template=template)
+    )
+
+
+def _get_row_values(contents, checked_upload, template, row_index):
+    if not checked_upload['rows_can_be_found']:
+        return RecipientCSV(contents, template=template)[row_index].recipient_and_personalisation
+
+    lines = contents.strip().splitlines()
+    header_line_count = checked_upload['header_line_count']
+    if checked_upload['row_line_numbers'] is None:
+        start, end = header_line_count + row_index, header_line_count + row_index + 1
+    else:
+        start, end = checked_upload['row_line_numbers'][row_index:row_index + 2]
+
+    row = RecipientCSV('\n'.join(lines[:header_line_count] + lines[start:end]), template=template)
+    if len(row) != 1:
+        return RecipientCSV(contents, template=template)[row_index].recipient_and_personalisation
+    return row[0].recipient_and_personalisation
+
+
+def _check_messages_preview_template(service_id, template_id, upload_id, preview_row):
+    """
+    Previews of a row are requested once for each page of the letter, so rather
+    than check the whole file each time, the first preview stores where each row
+    is and the rest use that to pick out just the row being previewed. The check
+    page itself doesn’t use or store this, because it has to check every row to
+    show errors anyway.
+    """
+    if preview_row < 2:
+        abort(404)
+
+    db_template = current_service.get_template_with_user_permission_or_403(template_id, current_user)
+    template = get_template(
+        db_template,
+        current_service,
+        show_recipient=True,
+        page_count=get_page_count_for_letter(db_template),
+    )
+    contents = s3download(service_id, upload_id)
+    checked_upload = _get_checked_upload(service_id, upload_id, db_template, contents, template)
+
+    if preview_row < checked_upload['count_of_recipients'] + 2:
+        template.values = _get_row_values(contents, checked_upload, template, preview_row - 2)
+    elif preview_row > 2:
+        abort(404)
+
+    return template
+
+
 @main.route("/services/<uuid:service_id>/<uuid:template_id>/check/<uuid:upload_id>", methods=['GET'])
 @main.route(
     "/services/<uuid:service_id>/<uuid:template_id>/check/<uuid:upload_id>/row-<int:row_index>",
@@ -763,9 +871,7 @@ def check_messages_preview(service_id, template_id, upload_id, filetype, row_ind
     else:
         abort(404)
 
-    template = _check_messages(
-        service_id, template_id, upload_id, row_index, letters_as_pdf=True
-    )['template']
+    template = _check_messages_preview_template(service_id, template_id, upload_id, row_index)
     return TemplatePreview.from_utils_template(template, filetype, page=page)
 
 
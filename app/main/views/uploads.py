@@ -5,9 +5,11 @@ import uuid
 from datetime import datetime
 from functools import partial
 from io import BytesIO
+from time import monotonic
 from zipfile import BadZipFile
 
 from botocore.exceptions import ClientError
+from eventlet import sleep
 from flask import (
     abort,
     current_app,
@@ -34,7 +36,7 @@ from app import (
     service_api_client,
     upload_api_client,
 )
-from app.extensions import antivirus_client
+from app.extensions import antivirus_client, redis_client
 from app.main import main
 from app.main.forms import CsvUploadForm, LetterUploadPostageForm, PDFUploadForm
 from app.models.contact_list import ContactList
@@ -44,12 +46,17 @@ from app.s3_client.s3_letter_upload_client import (
     get_transient_letter_file_location,
     upload_letter_to_s3,
 )
-from app.template_previews import TemplatePreview, sanitise_letter
+from app.template_previews import (
+    TemplatePreview,
+    get_cached_preview,
+    sanitise_letter,
+)
 from app.utils import (
     Spreadsheet,
+    count_row_errors,
     generate_next_dict,
     generate_previous_dict,
-    get_errors_for_csv,
+    get_errors_for_row_error_counts,
     get_letter_printing_statement,
     get_letter_validation_error,
     get_page_from_request,
@@ -61,6 +68,9 @@ from app.utils import (
 
 MAX_FILE_UPLOAD_SIZE = 2 * 1024 * 1024  # 2MB
 
+# how long to wait for another request which is rendering every page of the same letter
+LETTER_UPLOAD_PREVIEW_WAIT_IN_SECONDS = 10
+
 
 @main.route("/services/<uuid:service_id>/uploads")
 @user_has_permissions()
@@ -327,17 +337,68 @@ def view_letter_upload_as_preview(service_id, file_id):
     except ValueError:
         abort(400)
 
+    if not (current_app.config['TEMPLATE_PREVIEW_CACHE_ENABLED'] and redis_client.active):
+        pdf_file, metadata = get_letter_pdf_and_metadata(service_id, file_id)
+        if page in _get_invalid_pages(metadata):
+            return TemplatePreview.from_invalid_pdf_file(pdf_file, page)
+        else:
+            return TemplatePreview.from_valid_pdf_file(pdf_file, page)
+
+    cache_key = _get_letter_upload_preview_cache_key(service_id, file_id, page)
+
+    preview = get_cached_preview(cache_key, personal_data=True)
+    if preview:
+        return preview
+
+    lock_name = _get_letter_upload_preview_cache_key(service_id, file_id, 'all')
+    if redis_client.acquire_lock(lock_name, LETTER_UPLOAD_PREVIEW_WAIT_IN_SECONDS):
+        try:
+            return _render_letter_upload_previews(service_id, file_id, page)
+        finally:
+            redis_client.release_lock(lock_name)
+
+    # another request is already rendering every page, so wait for it to store this one
+    give_up_at = monotonic() + LETTER_UPLOAD_PREVIEW_WAIT_IN_SECONDS
+    while monotonic() < give_up_at:
+        sleep(0.2)
+        preview = get_cached_preview(cache_key, personal_data=True)
+        if preview:
+            return preview
+
+    return _render_letter_upload_previews(service_id, file_id, page, all_pages=False)
+
+
+def _get_invalid_pages(metadata):
+    if metadata.get('message') != 'content-outside-printable-area':
+        return []
+    return json.loads(metadata.get('invalid_pages', '[]'))
+
+
+def _get_letter_upload_preview_cache_key(service_id, file_id, page):
+    return 'service-{}-letter-upload-{}-page-{}'.format(service_id, file_id, page)
+
+
+def _render_letter_upload_previews(service_id, file_id, page, all_pages=True):
+    """
+    Renders every page of an uploaded letter in one go, so the browser’s
+    requests for the other pages can be answered from the cache instead of
+    each downloading and reading the whole PDF again.
+    """
     pdf_file, metadata = get_letter_pdf_and_metadata(service_id, file_id)
-    invalid_pages = json.loads(metadata.get('invalid_pages', '[]'))
+    page_count = int(metadata.get('page_count') or 0)
 
-    if (
-        metadata.get('message') == 'content-outside-printable-area' and
-        page in invalid_pages
-    ):
-        return TemplatePreview.from_invalid_pdf_file(pdf_file, page)
-    else:
+    if not 1 <= page <= page_count:
+        # let template preview explain what’s wrong with it
         return TemplatePreview.from_valid_pdf_file(pdf_file, page)
 
+    previews = TemplatePreview.from_pdf_file_pages(
+        pdf_file,
+        range(1, page_count + 1) if all_pages else [page],
+        invalid_pages=_get_invalid_pages(metadata),
+        get_cache_key=partial(_get_letter_upload_preview_cache_key, service_id, file_id),
+    )
+    return previews[page]
+
 
 @main.route("/services/<uuid:service_id>/upload-letter/send/<uuid:file_id>", methods=['POST'])
 @user_has_permissions('send_messages', restrict_admin_usage=True)
@@ -383,7 +444,9 @@ def upload_contact_list(service_id):
         try:
             upload_id = ContactList.upload(
                 current_service.id,
-                Spreadsheet.from_file_form(form).as_dict,
+                Spreadsheet.from_file_form(
+                    form, streaming=current_app.config['STREAMING_SPREADSHEET_UPLOADS']
+                ).as_dict,
             )
             file_name_metadata = unicode_truncate(
                 SanitiseASCII.encode(form.file.data.filename),
@@ -469,13 +532,16 @@ def check_contact_list(service_id, upload_id):
             allowed_file_extensions=Spreadsheet.ALLOWED_FILE_EXTENSIONS
         )
 
-    row_errors = get_errors_for_csv(recipients, template_type)
+    row_error_counts = count_row_errors(recipients)
+    row_errors = get_errors_for_row_error_counts(row_error_counts, template_type)
     if row_errors:
         return render_template(
             'views/uploads/contact-list/row-errors.html',
             recipients=recipients,
             original_file_name=original_file_name,
             row_errors=row_errors,
+            count_of_rows_with_errors=row_error_counts.rows_with_errors,
+            count_of_displayed_recipients=len(list(recipients.displayed_rows)),
             form=form,
             allowed_file_extensions=Spreadsheet.ALLOWED_FILE_EXTENSIONS
         )
@@ -558,7 +624,7 @@ def delete_contact_list(service_id, contact_list_id):
 def download_contact_list(service_id, contact_list_id):
     contact_list = ContactList.from_id(contact_list_id, service_id=service_id)
     return send_file(
-        filename_or_fp=BytesIO(contact_list.contents.encode('utf-8')),
+        filename_or_fp=ContactList.download_stream(service_id, contact_list_id),
         attachment_filename=contact_list.saved_file_name,
         as_attachment=True,
     )
@@ -13,6 +13,7 @@ from app.notify_client.contact_list_api_client import contact_list_api_client
 from app.s3_client.s3_csv_client import (
     get_csv_metadata,
     s3download,
+    s3download_stream,
     s3upload,
     set_metadata_on_csv_upload,
 )
@@ -62,6 +63,14 @@ class ContactList(JSONModel):
             bucket=ContactList.get_bucket_name(),
         ))
 
+    @staticmethod
+    def download_stream(service_id, upload_id):
+        return s3download_stream(
+            service_id,
+            upload_id,
+            bucket=ContactList.get_bucket_name(),
+        )
+
     @staticmethod
     def set_metadata(service_id, upload_id, **kwargs):
         return set_metadata_on_csv_upload(
@@ -0,0 +1,163 @@
+import json
+import uuid
+from time import time
+
+from eventlet import spawn_after, spawn_n
+from flask import abort, current_app
+
+from app.extensions import redis_client
+from app.notify_client import cache
+from app.s3_client.s3_csv_client import (
+    delete_notifications_export,
+    delete_notifications_exports_older_than,
+    get_csv_download_url,
+    get_notifications_export_location,
+    s3upload_multipart,
+)
+from app.utils import generate_notifications_csv
+
+
+class NotificationsExport():
+    """
+    A report of sent notifications which is written to S3 by a green thread,
+    so the request asking for it can return straight away instead of waiting
+    for every page of notifications from the API. How it’s getting on is kept
+    in Redis, so the page showing it can be polled from any worker, and once
+    it’s finished the file is downloaded straight from S3.
+
+    The green thread runs in the web worker which started the export, so uses
+    that worker’s memory and connections until it’s finished, and the export
+    is lost if the worker restarts. That’s why it’s behind the
+    `NOTIFICATION_EXPORTS_IN_BACKGROUND` flag: only turn it on where the web
+    workers have room to spare.
+
+    The file is deleted from S3 once the export has expired from Redis, since
+    nothing can link to it after that. Files left behind by a worker which
+    restarted first are deleted the next time the service starts an export.
+    """
+
+    # an export is lost if its worker is restarted, so while it’s being written
+    # it’s saved again every so often, and we stop waiting for it if it hasn’t
+    # been for a while
+    HEARTBEAT_INTERVAL_IN_SECONDS = 30
+    TIMEOUT_IN_SECONDS = 5 * 60
+    EXPIRY_IN_SECONDS = 24 * 60 * 60
+    DOWNLOAD_URL_EXPIRY_IN_SECONDS = 60
+
+    def __init__(self, *, service_id, id, filename, status, started_at, updated_at=None):
+        self.service_id = str(service_id)
+        self.id = str(id)
+        self.filename = filename
+        self._status = status
+        self.started_at = started_at
+        self.updated_at = updated_at or started_at
+
+    @staticmethod
+    def _get_cache_key(service_id, export_id):
+        return 'service-{}-notifications-export-{}'.format(service_id, export_id)
+
+    @staticmethod
+    def can_start():
+        return current_app.config['NOTIFICATION_EXPORTS_IN_BACKGROUND'] and redis_client.active
+
+    @classmethod
+    def start(cls, *, service_id, filename, **csv_kwargs):
+        """
+        `csv_kwargs` are passed to `generate_notifications_csv` to make the
+        report.
+        """
+        export = cls(service_id=service_id, id=uuid.uuid4(), filename=filename, status='pending', started_at=time())
+        export._save()
+        spawn_n(_write_to_s3, current_app._get_current_object(), export, dict(service_id=service_id, **csv_kwargs))
+        return export
+
+    @classmethod
+    def from_id(cls, export_id, service_id):
+        cached = cache.redis_client.get(cls._get_cache_key(service_id, export_id))
+        if cached is None:
+            abort(404)
+        return cls(service_id=service_id, id=export_id, **json.loads(cached.decode('utf-8')))
+
+    def _save(self):
+        self.updated_at = time()
+        cache.redis_client.set(
+            self._get_cache_key(self.service_id, self.id),
+            json.dumps({
+                'filename': self.filename,
+                'status': self._status,
+                'started_at': self.started_at,
+                'updated_at': self.updated_at,
+            }),
+            ex=self.EXPIRY_IN_SECONDS,
+        )
+
+    def _set_status(self, status):
+        self._status = status
+        self._save()
+
+    @property
+    def status(self):
+        if self._status == 'pending' and time() - self.updated_at > self.TIMEOUT_IN_SECONDS:
+            return 'failed'
+        return self._status
+
+    @property
+    def pending(self):
+        return self.status == 'pending'
+
+    @property
+    def finished(self):
+        return self.status == 'finished'
+
+    @property
+    def failed(self):
+        return self.status == 'failed'
+
+    def get_download_url(self):
+        return get_csv_download_url(
+            *get_notifications_export_location(self.service_id, self.id),
+            self.filename,
+            expires_in_seconds=self.DOWNLOAD_URL_EXPIRY_IN_SECONDS,
+        )
+
+    def _with_heartbeat(self, lines):
+        for line in lines:
+            if time() - self.updated_at >= self.HEARTBEAT_INTERVAL_IN_SECONDS:
+                self._save()
+            yield line.encode('utf-8')
+
+    def write_to_s3(self, csv_kwargs):
+        bucket_name, file_location = get_notifications_export_location(self.service_id, self.id)
+        try:
+            delete_notifications_exports_older_than(self.service_id, self.EXPIRY_IN_SECONDS)
+        except Exception:
+            current_app.logger.exception('Could not delete old notifications exports for {}'.format(self.service_id))
+        try:
+            s3upload_multipart(
+                chunks=self._with_heartbeat(generate_notifications_csv(**csv_kwargs)),
+                region=current_app.config['AWS_REGION'],
+                bucket_name=bucket_name,
+                file_location=file_location,
+            )
+        except Exception:
+            current_app.logger.exception('Could not export notifications to {}'.format(file_location))
+            self._set_status('failed')
+        else:
+            self._set_status('finished')
+
+    def delete_from_s3(self):
+        try:
+            delete_notifications_export(self.service_id, self.id)
+        except Exception:
+            current_app.logger.exception('Could not delete notifications export {}'.format(self.id))
+
+
+def _write_to_s3(app, export, csv_kwargs):
+    with app.app_context():
+        export.write_to_s3(csv_kwargs)
+    spawn_after(export.EXPIRY_IN_SECONDS, _delete_from_s3, app, export)
+
+
+def _delete_from_s3(app, export):
+    with app.app_context():
+        export.delete_from_s3()
@@ -1,34 +1,51 @@
+import codecs
 import csv
+from collections import OrderedDict, namedtuple
+from functools import partial
 from io import BytesIO, StringIO
+from itertools import chain, dropwhile
 from os import path
 
 import pyexcel
 import pyexcel_xlsx
+from notifications_utils.columns import Columns
+from notifications_utils.formatters import strip_whitespace
+from notifications_utils.recipients import RecipientCSV
+from orderedset._orderedset import OrderedSet
 
 
 class Spreadsheet():
 
     ALLOWED_FILE_EXTENSIONS = ('csv', 'xlsx', 'xls', 'ods', 'xlsm', 'tsv')
 
-    def __init__(self, csv_data=None, rows=None, filename=''):
+    CHUNK_SIZE_IN_BYTES = 64 * 1024
+
+    def __init__(self, csv_data=None, rows=None, filename='', csv_lines=None, streaming=False):
 
         self.filename = filename
 
-        if csv_data and rows:
+        if (csv_data or csv_lines) and rows:
             raise TypeError('Spreadsheet must be created from either rows or CSV data')
 
         self._csv_data = csv_data or ''
+        self._csv_lines = csv_lines
         self._rows = rows or []
+        self.streaming = streaming
+        self.row_count = None
+        self.column_headers = None
 
     @property
     def as_dict(self):
         return {
             'file_name': self.filename,
-            'data': self.as_csv_data
+            'data': self.iter_csv_data() if self.streaming else self.as_csv_data
         }
 
     @property
     def as_csv_data(self):
+        if self._csv_lines is not None:
+            self._csv_data = '\r\n'.join(self._csv_lines)
+            self._csv_lines = None
         if not self._csv_data:
             with StringIO() as converted:
                 output = csv.writer(converted)
@@ -37,6 +54,67 @@ class Spreadsheet():
                 self._csv_data = converted.getvalue()
         return self._csv_data
 
+    def iter_csv_data(self):
+        """
+        Yields the spreadsheet as UTF-8 encoded CSV data a chunk at a time, so
+        it can be uploaded without the whole file being held in memory. Once
+        it’s all been read, `row_count` and `column_headers` say what was in it
+        (or are `None` if it couldn’t be read as CSV).
+        """
+        self.row_count, self.column_headers = 0, None
+        with StringIO() as buffer:
+            for text in self._iter_csv_text():
+                buffer.write(text)
+                if buffer.tell() >= self.CHUNK_SIZE_IN_BYTES:
+                    yield buffer.getvalue().encode('utf-8')
+                    buffer.seek(0)
+                    buffer.truncate()
+            yield buffer.getvalue().encode('utf-8')
+        if self.row_count is not None:
+            self.column_headers = self.column_headers or []
+
+    def _iter_csv_text(self):
+        if self._csv_lines is None and not self._csv_data:
+            with StringIO() as converted:
+                output = csv.writer(converted)
+                for row in self._rows:
+                    output.writerow(row)
+                    self._add_to_summary(['' if value is None else str(value) for value in row])
+                    yield converted.getvalue()
+                    converted.seek(0)
+                    converted.truncate()
+            return
+
+        lines = iter(self._csv_lines if self._csv_lines is not None else self._csv_data.splitlines())
+        lines_read = []
+
+        def read_lines():
+            for line in lines:
+                lines_read.append(line)
+                yield line
+
+        separator = ''
+        try:
+            for row in csv.reader(read_lines(), quoting=csv.QUOTE_MINIMAL, skipinitialspace=True):
+                self._add_to_summary(row)
+                for line in lines_read:
+                    yield separator + line
+                    separator = '\r\n'
+                lines_read.clear()
+        except csv.Error:
+            # upload the file as it is anyway, like we do when it’s not
+            # streamed – it gets checked properly once it’s uploaded
+            self.row_count = self.column_headers = None
+            for line in chain(lines_read, lines):
+                yield separator + line
+                separator = '\r\n'
+
+    def _add_to_summary(self, row):
+        if self.column_headers is None:
+            self.column_headers = row
+        else:
+            self.row_count += 1
+
     @classmethod
     def can_handle(cls, filename):
         return cls.get_extension(filename) in cls.ALLOWED_FILE_EXTENSIONS
@@ -49,6 +127,23 @@ class Spreadsheet():
     def normalise_newlines(file_content):
         return '\r\n'.join(file_content.read().decode('utf-8').splitlines())
 
+    @staticmethod
+    def iter_normalised_lines(file_content, chunk_size=CHUNK_SIZE_IN_BYTES):
+        """
+        Yields the same lines as `normalise_newlines` joins together, reading
+        and decoding the file a chunk at a time.
+        """
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        unfinished_line = ''
+        for chunk in iter(partial(file_content.read, chunk_size), b''):
+            lines = (unfinished_line + decoder.decode(chunk)).splitlines(keepends=True)
+            # the last line might carry on in the next chunk (even if it ends
+            # with `\r`, because the next chunk could start with `\n`)
+            unfinished_line = lines.pop() if lines else ''
+            for line in lines:
+                yield line.splitlines()[0]
+        yield from (unfinished_line + decoder.decode(b'', final=True)).splitlines()
+
     @classmethod
     def from_rows(cls, rows, filename=''):
         return cls(rows=rows, filename=filename)
@@ -63,9 +158,12 @@ class Spreadsheet():
         )
 
     @classmethod
-    def from_file(cls, file_content, filename=''):
+    def from_file(cls, file_content, filename='', streaming=False):
         extension = cls.get_extension(filename)
 
+        if extension == 'csv' and streaming:
+            return cls(csv_lines=Spreadsheet.iter_normalised_lines(file_content), filename=filename, streaming=True)
+
         if extension == 'csv':
             return cls(csv_data=Spreadsheet.normalise_newlines(file_content), filename=filename)
 
@@ -78,21 +176,23 @@ class Spreadsheet():
                 file_type=extension,
                 file_stream=file_content),
             filename)
+        instance.streaming = streaming
         pyexcel.free_resources()
         return instance
 
     @classmethod
-    def from_file_form(cls, form):
+    def from_file_form(cls, form, streaming=False):
         return cls.from_file(
             form.file.data,
             filename=form.file.data.filename,
+            streaming=streaming,
         )
 
     @property
     def as_rows(self):
         if not self._rows:
             self._rows = list(csv.reader(
-                StringIO(self._csv_data),
+                StringIO(self.as_csv_data),
                 quoting=csv.QUOTE_MINIMAL,
                 skipinitialspace=True,
             ))
@@ -103,3 +203,105 @@ class Spreadsheet():
         io = BytesIO()
         pyexcel_xlsx.save_data(io, {'Sheet 1': self.as_rows})
         return io.getvalue()
+
+
+Cell = namedtuple('Cell', ['data'])
+
+
+class StreamingCSVRow():
+
+    def __init__(self, cells):
+        self._cells = cells
+
+    def get(self, header):
+        key = Columns.make_key(header)
+        if key in self._cells:
+            return Cell(self._cells[key])
+
+
+class StreamingCSV():
+    """
+    Reads the rows of a CSV file as it goes (for example from
+    `s3download_lines`), giving the same column headers and cell values as
+    `RecipientCSV` would for `template`, without building and validating a
+    `Row` for every row. It doesn’t check the file, so isn’t a replacement for
+    `RecipientCSV` when a file needs checking.
+
+    Iterating over it from the start keeps nothing. Rows can also be looked up
+    by index, in any order, so doing that keeps the values of every row read
+    so far – memory still grows with the size of the file, just by less than
+    the whole file as a string plus a `Row` for every row.
+    """
+
+    def __init__(self, lines, template):
+        self._reader = csv.reader(
+            dropwhile(lambda line: not line.strip(), lines),
+            quoting=csv.QUOTE_MINIMAL,
+            skipinitialspace=True,
+        )
+        self._raw_column_headers = next(self._reader, [])
+        self.column_headers = list(OrderedSet(self._raw_column_headers))
+        self._values = []
+        self._keys = {header: Columns.make_key(header) for header in self._raw_column_headers}
+        recipient_column_keys = {
+            Columns.make_key(header)
+            for header in RecipientCSV('', template=template).recipient_column_headers
+        }
+        self._is_recipient_column = [
+            self._keys[header] in recipient_column_keys for header in self._raw_column_headers
+        ]
+
+    def __iter__(self):
+        for values in self._values:
+            yield StreamingCSVRow(self._get_cells(values))
+        self._values = []
+        for values in self._reader:
+            yield StreamingCSVRow(self._get_cells(values))
+
+    def _get_values(self, index):
+        while len(self._values) <= index:
+            values = next(self._reader, None)
+            if values is None:
+                break
+            self._values.append(values)
+        return self._values[index]
+
+    def _get_cells(self, values):
+        # Works out the cells the same way `RecipientCSV` does. A header used
+        # more than once gets a list of its values, unless it’s a recipient
+        # column, which gets its last value. Then, of headers which only
+        # differ by case, spaces and so on, the last one wins.
+        row = OrderedDict()
+        for header, is_recipient_column, value in zip(
+            self._raw_column_headers, self._is_recipient_column, values
+        ):
+            value = strip_whitespace(value) or None
+            if is_recipient_column:
+                row[header] = value
+            elif not (header or value):
+                continue
+            elif header not in row:
+                row[header] = value
+            elif isinstance(row[header], list):
+                row[header].append(value)
+            else:
+                row[header] = [row[header], value]
+        for header in self._raw_column_headers[len(values):]:
+            row[header] = None
+        return {
+            self._keys[header]: value for header, value in row.items()
+        }
+
+    def __getitem__(self, index):
+        return StreamingCSVRow(self._get_cells(self._get_values(index)))
+
+    def get_data(self, index):
+        """
+        Returns the data for each of `column_headers` in a row, the same as
+        `[self[index].get(header).data for header in self.column_headers]`, but
+        without a `Cell` for each of them.
+        """
+        cells = self._get_cells(self._get_values(index))
+        return [
+            cells.get(self._keys[header]) for header in self.column_headers
+        ]
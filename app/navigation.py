@@ -85,6 +85,7 @@ class HeaderNavigation(Navigation):
         },
         'platform-admin': {
             'archive_user',
+            'cache_statistics',
             'clear_cache',
             'create_email_branding',
             'create_letter_branding',
@@ -180,6 +181,7 @@ class HeaderNavigation(Navigation):
         'design_content',
         'download_contact_list',
         'download_notifications_csv',
+        'download_notifications_export',
         'edit_data_retention',
         'edit_organisation_agreement',
         'edit_organisation_crown_status',
@@ -351,6 +353,8 @@ class HeaderNavigation(Navigation):
         'view_notification_updates',
         'view_notifications',
         'view_notifications_csv',
+        'view_notifications_export',
+        'view_notifications_export_updates',
         'view_template',
         'view_template_version',
         'no_cookie.view_template_version_preview',
@@ -398,6 +402,7 @@ class MainNavigation(Navigation):
             'template_usage',
             'view_notification',
             'view_notifications',
+            'view_notifications_export',
         },
         'current-broadcasts': {
             'broadcast_dashboard',
@@ -545,6 +550,7 @@ class MainNavigation(Navigation):
         'archive_user',
         'bat_phone',
         'begin_tour',
+        'cache_statistics',
         'callbacks',
         'cancel_invited_org_user',
         'cancel_invited_user',
@@ -573,6 +579,7 @@ class MainNavigation(Navigation):
         'documentation',
         'download_contact_list',
         'download_notifications_csv',
+        'download_notifications_export',
         'edit_data_retention',
         'edit_organisation_agreement',
         'edit_organisation_crown_status',
@@ -720,6 +727,7 @@ class MainNavigation(Navigation):
         'view_letter_upload_as_preview',
         'view_notification_updates',
         'view_notifications_csv',
+        'view_notifications_export_updates',
         'view_provider',
         'view_providers',
         'no_cookie.view_template_version_preview',
@@ -748,6 +756,7 @@ class CaseworkNavigation(Navigation):
         'sent-messages': {
             'view_notifications',
             'view_notification',
+            'view_notifications_export',
         },
         'uploads': {
             'view_jobs',
@@ -784,6 +793,7 @@ class CaseworkNavigation(Navigation):
         'bat_phone',
         'begin_tour',
         'branding_request',
+        'cache_statistics',
         'callbacks',
         'cancel_invited_org_user',
         'cancel_invited_user',
@@ -830,6 +840,7 @@ class CaseworkNavigation(Navigation):
         'documentation',
         'download_contact_list',
         'download_notifications_csv',
+        'download_notifications_export',
         'edit_data_retention',
         'edit_organisation_agreement',
         'edit_organisation_crown_status',
@@ -1038,6 +1049,7 @@ class CaseworkNavigation(Navigation):
         'view_letter_upload_as_preview',
         'view_notification_updates',
         'view_notifications_csv',
+        'view_notifications_export_updates',
         'view_provider',
         'view_providers',
         'view_template',
@@ -1118,6 +1130,7 @@ class OrgNavigation(Navigation):
         'bat_phone',
         'begin_tour',
         'branding_request',
+        'cache_statistics',
         'callbacks',
         'cancel_invited_org_user',
         'cancel_invited_user',
@@ -1159,6 +1172,7 @@ class OrgNavigation(Navigation):
         'documentation',
         'download_contact_list',
         'download_notifications_csv',
+        'download_notifications_export',
         'edit_data_retention',
         'edit_provider',
         'edit_service_notes',
@@ -1370,6 +1384,8 @@ class OrgNavigation(Navigation):
         'view_notification_updates',
         'view_notifications',
         'view_notifications_csv',
+        'view_notifications_export',
+        'view_notifications_export_updates',
         'view_provider',
         'view_providers',
         'view_template',
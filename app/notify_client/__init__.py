@@ -1,12 +1,31 @@
-from flask import abort, has_request_context, request
+import json
+import zlib
+from copy import deepcopy
+from datetime import timedelta
+from functools import partial, wraps
+from inspect import signature
+from time import monotonic, time
+
+import requests
+from eventlet import GreenPool, spawn, spawn_n
+from flask import abort, current_app, has_request_context, request
+from flask.globals import _app_ctx_stack, _request_ctx_stack
 from flask_login import current_user
 from notifications_python_client import __version__
 from notifications_python_client.base import BaseAPIClient
+from notifications_python_client.errors import HTTPError
 from notifications_utils.clients.redis import RequestCache
 
-from app.extensions import redis_client
-
-cache = RequestCache(redis_client)
+from app.extensions import (
+    CACHE_DELETES,
+    CACHE_HITS,
+    CACHE_MISSES,
+    CACHE_SETS,
+    get_cache_key_family,
+    redis_client,
+    time_redis_request,
+)
+from app.http_sessions import http_sessions
 
 
 def _attach_current_user(data):
@@ -16,6 +35,284 @@ def _attach_current_user(data):
     )
 
 
+class RequestMemo():
+    """
+    Remembers the responses to GET requests made to the API for the lifetime of
+    a single request to the admin app. Lots of things (`load_service_before_request`,
+    the `Service` and `User` models, views) ask for the same data while building one
+    page, and this means only the first of them pays for the round trip.
+
+    It also holds the values `RequestCache` has read from Redis during the request,
+    including any loaded up front by `prefetch_cache_keys`.
+    """
+
+    def __init__(self):
+        self.responses = {}
+        self.cache_values = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(*args):
+        return json.dumps(args, sort_keys=True, default=str)
+
+    def get(self, key, fetch):
+        if key in self.responses:
+            self.hits += 1
+        else:
+            self.misses += 1
+            self.responses[key] = fetch()
+        # callers are free to mutate what they get back, so never hand out the stored copy
+        return deepcopy(self.responses[key])
+
+    def clear(self):
+        self.responses.clear()
+        self.cache_values.clear()
+
+
+def get_request_memo():
+    if not has_request_context():
+        return None
+    request_context = _request_ctx_stack.top
+    if not hasattr(request_context, 'api_request_memo'):
+        request_context.api_request_memo = RequestMemo()
+    return request_context.api_request_memo
+
+
+def log_request_memo_stats(response):
+    memo = get_request_memo()
+    if memo and (memo.hits or memo.misses):
+        current_app.logger.debug(
+            'API request memo for {} had {} hits and {} misses'.format(request.endpoint, memo.hits, memo.misses),
+            extra={'api_request_memo_hits': memo.hits, 'api_request_memo_misses': memo.misses},
+        )
+    return response
+
+
+class RequestScopedRedisClient():
+    """
+    Sits between `RequestCache` and Redis. Each key is only read from Redis once
+    per request to the admin app, and keys we know a page will need can be read
+    together in one round trip with `prefetch`. Outside a request, or for any
+    other operation, it behaves exactly like the Redis client it wraps.
+
+    It counts the hits, misses, sets and deletes `RequestCache` makes, by cache
+    key family, so we can see which keys are worth caching.
+
+    With `CACHE_COMPRESSION_ENABLED`, values of `CACHE_COMPRESSION_THRESHOLD_IN_BYTES`
+    or more (like the templates for a service with thousands of them) are
+    compressed before they go into Redis. Values are decompressed however they
+    were set, so this can be turned on once every instance can read them.
+    """
+
+    COMPRESSED_PREFIX = b'zlib:'
+
+    def __init__(self, redis_client):
+        self.redis_client = redis_client
+
+    def __getattr__(self, attr):
+        return getattr(self.redis_client, attr)
+
+    def prefetch(self, *keys):
+        memo = get_request_memo()
+        keys = [key for key in keys if memo is not None and key not in memo.cache_values]
+        if not keys or not self.redis_client.active:
+            return
+        try:
+            with time_redis_request('mget', *keys):
+                values = self.redis_client.redis_store.mget(keys)
+        except Exception:
+            current_app.logger.exception('Redis error performing mget on {}'.format(keys))
+        else:
+            memo.cache_values.update(zip(keys, values))
+
+    def get(self, key, *args, **kwargs):
+        value = self._get(key, *args, **kwargs)
+        if self.redis_client.active:
+            (CACHE_MISSES if value is None else CACHE_HITS).labels(get_cache_key_family(key)).inc()
+        return self.decode(value)
+
+    def _get(self, key, *args, **kwargs):
+        memo = get_request_memo()
+        if memo is None:
+            return self.redis_client.get(key, *args, **kwargs)
+        if key not in memo.cache_values:
+            memo.cache_values[key] = self.redis_client.get(key, *args, **kwargs)
+        return memo.cache_values[key]
+
+    def set(self, key, value, *args, **kwargs):
+        self._forget(key)
+        if self.redis_client.active:
+            CACHE_SETS.labels(get_cache_key_family(key)).inc()
+        return self.redis_client.set(key, self.encode(value), *args, **kwargs)
+
+    @classmethod
+    def encode(cls, value):
+        if not current_app.config['CACHE_COMPRESSION_ENABLED']:
+            return value
+        if isinstance(value, str):
+            value = value.encode('utf-8')
+        if len(value) < current_app.config['CACHE_COMPRESSION_THRESHOLD_IN_BYTES']:
+            return value
+        return cls.COMPRESSED_PREFIX + zlib.compress(value)
+
+    @classmethod
+    def decode(cls, value):
+        # JSON never starts with `z`, so anything without the prefix was set uncompressed
+        if isinstance(value, bytes) and value.startswith(cls.COMPRESSED_PREFIX):
+            return zlib.decompress(value[len(cls.COMPRESSED_PREFIX):])
+        return value
+
+    def delete(self, *keys, **kwargs):
+        self._forget(*keys)
+        if self.redis_client.active:
+            for key in keys:
+                CACHE_DELETES.labels(get_cache_key_family(key)).inc()
+        return self.redis_client.delete(*keys, **kwargs)
+
+    def delete_cache_keys_by_pattern(self, pattern, *args, **kwargs):
+        memo = get_request_memo()
+        if memo is not None:
+            memo.cache_values.clear()
+        return self.redis_client.delete_cache_keys_by_pattern(pattern, *args, **kwargs)
+
+    @staticmethod
+    def _forget(*keys):
+        memo = get_request_memo()
+        if memo is not None:
+            for key in keys:
+                memo.cache_values.pop(key, None)
+
+
+cache = RequestCache(RequestScopedRedisClient(redis_client))
+
+
+def prefetch_cache_keys(*keys):
+    cache.redis_client.prefetch(*keys)
+
+
+def stale_while_revalidate(
+    key_prefix,
+    *,
+    refresh_after_seconds,
+    expire_after_seconds=int(timedelta(days=1).total_seconds()),
+):
+    """
+    For slow API calls whose results don’t need to be right up to date, like the
+    statistics on the platform admin pages. If there’s a cached result it’s
+    returned straight away, however old it is. Once it’s older than
+    `refresh_after_seconds` a fresh one is fetched in a green thread, under a
+    Redis lock so only one worker fetches it at a time. Only the first caller,
+    or the first after `expire_after_seconds`, waits for the API.
+
+    The cache key is `key_prefix` followed by the method’s arguments as JSON.
+    """
+    def _stale_while_revalidate(client_method):
+
+        method_signature = signature(client_method)
+
+        def fetch_and_cache(key, args, kwargs):
+            value = client_method(*args, **kwargs)
+            cache.redis_client.set(
+                key,
+                json.dumps({'value': value, 'refresh_after': time() + refresh_after_seconds}),
+                ex=expire_after_seconds,
+            )
+            return value
+
+        def refresh_in_background(app, key, args, kwargs):
+            with app.app_context():
+                try:
+                    fetch_and_cache(key, args, kwargs)
+                except Exception:
+                    current_app.logger.exception('Could not refresh {}'.format(key))
+                finally:
+                    redis_client.release_lock(key)
+
+        @wraps(client_method)
+        def new_client_method(*args, **kwargs):
+            if not redis_client.active:
+                return client_method(*args, **kwargs)
+
+            arguments = method_signature.bind(*args, **kwargs)
+            arguments.apply_defaults()
+            key = '{}-{}'.format(key_prefix, json.dumps(
+                {name: value for name, value in arguments.arguments.items() if name != 'self'},
+                sort_keys=True,
+                default=str,
+            ))
+
+            cached = cache.redis_client.get(key)
+            if cached is None:
+                return fetch_and_cache(key, args, kwargs)
+
+            cached = json.loads(cached.decode('utf-8'))
+            if time() >= cached['refresh_after'] and redis_client.acquire_lock(key, refresh_after_seconds):
+                spawn_n(refresh_in_background, current_app._get_current_object(), key, args, kwargs)
+            return cached['value']
+
+        return new_client_method
+
+    return _stale_while_revalidate
+
+
+def _in_current_context(call):
+    app_context, request_context = _app_ctx_stack.top, _request_ctx_stack.top
+
+    def call_in_current_context():
+        if app_context:
+            _app_ctx_stack.push(app_context)
+        if request_context:
+            _request_ctx_stack.push(request_context)
+        try:
+            return call()
+        finally:
+            if request_context:
+                _request_ctx_stack.pop()
+            if app_context:
+                _app_ctx_stack.pop()
+
+    return call_in_current_context
+
+
+def fetch_concurrently(*, max_concurrency=None, **calls):
+    """
+    Makes a set of independent calls to the API at the same time, rather than
+    one after the other, and returns their results under the same names, eg
+
+        fetch_concurrently(
+            usage=partial(billing_api_client.get_service_usage, service_id, year),
+            units=partial(billing_api_client.get_billable_units, service_id, year),
+        )
+
+    On our eventlet workers this means waiting for the slowest call, not the
+    sum of all of them. The calls share the current request context (so they
+    can see `current_service`, `current_user` and the request memo). If any of
+    them raises, the exception is re-raised here once they have all finished.
+    No more than `max_concurrency` calls are made at once, if it’s given.
+    """
+    if not has_request_context():
+        return {name: call() for name, call in calls.items()}
+
+    pool = GreenPool(size=min(len(calls), max_concurrency or len(calls)) or 1)
+    threads = {
+        name: pool.spawn(_in_current_context(call))
+        for name, call in calls.items()
+    }
+    pool.waitall()
+    return {name: thread.wait() for name, thread in threads.items()}
+
+
+def fetch_in_background(call):
+    """
+    Starts a call to the API and returns straight away, so something else can
+    be done while waiting for the response – for example, fetching the next
+    page of a report while streaming the current one. Call `wait()` on what’s
+    returned to get the result (or have any exception re-raised).
+    """
+    return spawn(_in_current_context(call))
+
+
 class NotifyAdminAPIClient(BaseAPIClient):
 
     def __init__(self):
@@ -54,17 +351,62 @@ class NotifyAdminAPIClient(BaseAPIClient):
         if current_service and not current_service.active and not current_user.platform_admin:
             abort(403)
 
+    def _perform_request(self, method, url, kwargs):
+        # the same as `BaseAPIClient._perform_request`, but reusing this worker’s connections to the API
+        start_time = monotonic()
+        try:
+            response = http_sessions.request(method, url, **kwargs)
+            response.raise_for_status()
+            return response
+        except requests.RequestException as e:
+            api_error = HTTPError.create(e)
+            current_app.logger.error(
+                "API {} request on {} failed with {} '{}'".format(
+                    method, url, api_error.status_code, api_error.message
+                )
+            )
+            raise api_error
+        finally:
+            current_app.logger.debug("API {} request on {} finished in {}".format(
+                method, url, monotonic() - start_time
+            ))
+
+    def get(self, url, params=None):
+        memo = get_request_memo()
+        if memo is None:
+            return super().get(url, params=params)
+        return memo.get(
+            memo.make_key(self.base_url, url, params),
+            partial(super().get, url, params=params),
+        )
+
+    @staticmethod
+    def clear_request_memo():
+        # anything we’ve remembered might be out of date once we’ve changed something
+        memo = get_request_memo()
+        if memo is not None:
+            memo.clear()
+
     def post(self, *args, **kwargs):
         self.check_inactive_service()
-        return super().post(*args, **kwargs)
+        try:
+            return super().post(*args, **kwargs)
+        finally:
+            self.clear_request_memo()
 
     def put(self, *args, **kwargs):
         self.check_inactive_service()
-        return super().put(*args, **kwargs)
+        try:
+            return super().put(*args, **kwargs)
+        finally:
+            self.clear_request_memo()
 
     def delete(self, *args, **kwargs):
         self.check_inactive_service()
-        return super().delete(*args, **kwargs)
+        try:
+            return super().delete(*args, **kwargs)
+        finally:
+            self.clear_request_memo()
 
 
 class InviteTokenError(Exception):
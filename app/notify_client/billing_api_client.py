@@ -1,4 +1,4 @@
-from app.notify_client import NotifyAdminAPIClient
+from app.notify_client import NotifyAdminAPIClient, stale_while_revalidate
 
 
 class BillingAPIClient(NotifyAdminAPIClient):
@@ -34,6 +34,7 @@ class BillingAPIClient(NotifyAdminAPIClient):
             data=data
         )
 
+    @stale_while_revalidate('usage-for-all-services', refresh_after_seconds=3600)
     def get_usage_for_all_services(self, start_date, end_date):
         return self.get(url='/platform-stats/usage-for-all-services',
                         params={
@@ -1,4 +1,8 @@
-from app.notify_client import NotifyAdminAPIClient, _attach_current_user
+from app.notify_client import (
+    NotifyAdminAPIClient,
+    _attach_current_user,
+    stale_while_revalidate,
+)
 
 
 class NotificationApiClient(NotifyAdminAPIClient):
@@ -109,6 +113,7 @@ class NotificationApiClient(NotifyAdminAPIClient):
             url='/service/{}/notifications/{}/cancel'.format(service_id, notification_id),
             data={})
 
+    @stale_while_revalidate('notification-status-by-service', refresh_after_seconds=3600)
     def get_notification_status_by_service(self, start_date, end_date):
         return self.get(
             url='service/monthly-data-by-service',
@@ -1,8 +1,9 @@
-from app.notify_client import NotifyAdminAPIClient
+from app.notify_client import NotifyAdminAPIClient, stale_while_revalidate
 
 
 class PlatformStatsAPIClient(NotifyAdminAPIClient):
 
+    @stale_while_revalidate('platform-stats', refresh_after_seconds=300)
     def get_aggregate_platform_stats(self, params_dict=None):
         return self.get("/platform-stats", params=params_dict)
 
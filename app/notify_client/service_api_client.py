@@ -1,7 +1,12 @@
 from datetime import datetime
 
 from app.extensions import redis_client
-from app.notify_client import NotifyAdminAPIClient, _attach_current_user, cache
+from app.notify_client import (
+    NotifyAdminAPIClient,
+    _attach_current_user,
+    cache,
+    stale_while_revalidate,
+)
 
 
 class ServiceAPIClient(NotifyAdminAPIClient):
@@ -55,6 +60,7 @@ class ServiceAPIClient(NotifyAdminAPIClient):
     def find_services_by_name(self, service_name):
         return self.get('/service/find-services-by-name', params={"service_name": service_name})
 
+    @stale_while_revalidate('live-services-data', refresh_after_seconds=600)
     def get_live_services_data(self, params_dict=None):
         """
         Retrieve a list of live services data with contact names and notification counts.
@@ -1,12 +1,25 @@
 import uuid
+from datetime import datetime, timedelta, timezone
+from io import BytesIO
+from itertools import chain
+from urllib.parse import quote
 
 import botocore
+from boto3 import resource
 from flask import current_app
 from notifications_utils.s3 import s3upload as utils_s3upload
 
 from app.s3_client.s3_logo_client import get_s3_object
 
 FILE_LOCATION_STRUCTURE = 'service-{}-notify/{}.csv'
+# kept apart from uploads, so an export can’t be opened as if it was an upload
+NOTIFICATIONS_EXPORTS_PREFIX_STRUCTURE = 'service-{}-notify/notifications-exports/'
+NOTIFICATIONS_EXPORT_LOCATION_STRUCTURE = NOTIFICATIONS_EXPORTS_PREFIX_STRUCTURE + '{}.csv'
+
+DOWNLOAD_CHUNK_SIZE_IN_BYTES = 64 * 1024
+
+# S3 won’t accept smaller parts, apart from the last one
+MULTIPART_UPLOAD_PART_SIZE_IN_BYTES = 5 * 1024 * 1024
 
 
 def get_csv_location(service_id, upload_id, bucket=None):
@@ -16,6 +29,29 @@ def get_csv_location(service_id, upload_id, bucket=None):
     )
 
 
+def get_notifications_export_location(service_id, export_id):
+    return (
+        current_app.config['CSV_UPLOAD_BUCKET_NAME'],
+        NOTIFICATIONS_EXPORT_LOCATION_STRUCTURE.format(service_id, export_id),
+    )
+
+
+def delete_notifications_export(service_id, export_id):
+    resource('s3', region_name=current_app.config['AWS_REGION']).Object(
+        *get_notifications_export_location(service_id, export_id)
+    ).delete()
+
+
+def delete_notifications_exports_older_than(service_id, seconds):
+    bucket = resource('s3', region_name=current_app.config['AWS_REGION']).Bucket(
+        current_app.config['CSV_UPLOAD_BUCKET_NAME']
+    )
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=seconds)
+    for s3_object in bucket.objects.filter(Prefix=NOTIFICATIONS_EXPORTS_PREFIX_STRUCTURE.format(service_id)):
+        if s3_object.last_modified < cutoff:
+            s3_object.delete()
+
+
 def get_csv_upload(service_id, upload_id, bucket=None):
     return get_s3_object(*get_csv_location(service_id, upload_id, bucket))
 
@@ -23,15 +59,83 @@ def get_csv_upload(service_id, upload_id, bucket=None):
 def s3upload(service_id, filedata, region, bucket=None):
     upload_id = str(uuid.uuid4())
     bucket_name, file_location = get_csv_location(service_id, upload_id, bucket)
-    utils_s3upload(
-        filedata=filedata['data'],
-        region=region,
-        bucket_name=bucket_name,
-        file_location=file_location,
-    )
+    if isinstance(filedata['data'], str):
+        utils_s3upload(
+            filedata=filedata['data'],
+            region=region,
+            bucket_name=bucket_name,
+            file_location=file_location,
+        )
+    else:
+        s3upload_chunks(
+            chunks=filedata['data'],
+            region=region,
+            bucket_name=bucket_name,
+            file_location=file_location,
+        )
     return upload_id
 
 
+def join_into_parts(chunks, part_size):
+    parts_yielded = 0
+    with BytesIO() as part:
+        for chunk in chunks:
+            part.write(chunk)
+            if part.tell() >= part_size:
+                yield part.getvalue()
+                parts_yielded += 1
+                part.seek(0)
+                part.truncate()
+        # an empty file is still one (empty) part
+        if part.tell() or not parts_yielded:
+            yield part.getvalue()
+
+
+def s3upload_chunks(chunks, region, bucket_name, file_location):
+    """
+    Uploads a file from an iterable of bytes. Most files fit in one part, so
+    go up in a single request, and only bigger ones need a multipart upload.
+    """
+    parts = join_into_parts(chunks, part_size=MULTIPART_UPLOAD_PART_SIZE_IN_BYTES)
+    first_part = next(parts)
+    second_part = next(parts, None)
+    if second_part is None:
+        utils_s3upload(
+            filedata=first_part,
+            region=region,
+            bucket_name=bucket_name,
+            file_location=file_location,
+        )
+    else:
+        s3upload_multipart(
+            chunks=chain((first_part, second_part), parts),
+            region=region,
+            bucket_name=bucket_name,
+            file_location=file_location,
+        )
+
+
+def s3upload_multipart(chunks, region, bucket_name, file_location):
+    """
+    Uploads a file from an iterable of bytes (for example a `Spreadsheet` being
+    converted to CSV) as a multipart upload, so only one part of it needs to be
+    held in memory at a time.
+    """
+    s3_object = resource('s3', region_name=region).Object(bucket_name, file_location)
+    multipart_upload = s3_object.initiate_multipart_upload(ServerSideEncryption='AES256')
+    try:
+        parts = [
+            {'PartNumber': part_number, 'ETag': multipart_upload.Part(part_number).upload(Body=body)['ETag']}
+            for part_number, body in enumerate(
+                join_into_parts(chunks, part_size=MULTIPART_UPLOAD_PART_SIZE_IN_BYTES), start=1
+            )
+        ]
+        multipart_upload.complete(MultipartUpload={'Parts': parts})
+    except Exception:
+        multipart_upload.abort()
+        raise
+
+
 def s3download(service_id, upload_id, bucket=None):
     contents = ''
     try:
@@ -44,6 +148,42 @@ def s3download(service_id, upload_id, bucket=None):
     return contents
 
 
+def s3download_stream(service_id, upload_id, bucket=None):
+    """
+    Returns the body of an uploaded file as a file-like object which reads it
+    from S3 as it goes, so big files don’t need to fit in memory.
+    """
+    try:
+        key = get_csv_upload(service_id, upload_id, bucket)
+        return key.get()['Body']
+    except botocore.exceptions.ClientError as e:
+        current_app.logger.error("Unable to download s3 file {}".format(
+            FILE_LOCATION_STRUCTURE.format(service_id, upload_id)))
+        raise e
+
+
+def s3download_lines(service_id, upload_id, bucket=None):
+    for line in s3download_stream(service_id, upload_id, bucket).iter_lines(chunk_size=DOWNLOAD_CHUNK_SIZE_IN_BYTES):
+        yield line.decode('utf-8')
+
+
+def get_csv_download_url(bucket_name, file_location, filename, expires_in_seconds):
+    """
+    Returns a link which lets whoever has it download a file straight from S3
+    for the next `expires_in_seconds`, saving it as `filename`.
+    """
+    return resource('s3', region_name=current_app.config['AWS_REGION']).meta.client.generate_presigned_url(
+        'get_object',
+        Params={
+            'Bucket': bucket_name,
+            'Key': file_location,
+            'ResponseContentType': 'text/csv',
+            'ResponseContentDisposition': "attachment; filename*=UTF-8''{}".format(quote(filename)),
+        },
+        ExpiresIn=expires_in_seconds,
+    )
+
+
 def set_metadata_on_csv_upload(service_id, upload_id, bucket=None, **kwargs):
     get_csv_upload(
         service_id, upload_id, bucket=bucket
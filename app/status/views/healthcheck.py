@@ -2,6 +2,7 @@ from flask import current_app, jsonify, request
 from notifications_python_client.errors import HTTPError
 
 from app import status_api_client, version
+from app.http_sessions import http_sessions
 from app.status import status
 
 
@@ -18,5 +19,6 @@ def show_status():
         return jsonify(
             status="ok",
             api=api_status,
+            http_pools=http_sessions.get_stats(),
             git_commit=version.__git_commit__,
             build_time=version.__time__), 200
@@ -1,62 +1,216 @@
 import base64
+import hashlib
+from functools import partial
 from io import BytesIO
 
-import requests
-from flask import current_app, json
+from flask import current_app, has_request_context, json, request
 from notifications_utils.pdf import extract_page_from_pdf
+from PyPDF2 import PdfFileReader, PdfFileWriter
 
 from app import current_service
+from app.extensions import redis_client
+from app.http_sessions import http_sessions
+from app.local_cache import LocalCache
+from app.notify_client import cache, fetch_concurrently
+from app.utils import REVALIDATE_CACHE_CONTROL
+
+# the same letter always has the same number of pages, so page counts only expire to make room for
+# others and in case template preview changes how it lays letters out
+PAGE_COUNT_CACHE_TTL_IN_SECONDS = 24 * 60 * 60
+# there’s one for every row of every file checked, and they’re only needed while someone’s looking at it
+PERSONALISED_PAGE_COUNT_CACHE_TTL_IN_SECONDS = 10 * 60
+PAGE_COUNT_CACHE_MAX_SIZE = 1000
+
+page_count_cache = LocalCache(maxsize=PAGE_COUNT_CACHE_MAX_SIZE, ttl=PAGE_COUNT_CACHE_TTL_IN_SECONDS)
+
+PREVIEW_CACHE_TTL_IN_SECONDS = 24 * 60 * 60
+# previews with personal data in only need to last while someone is looking at them
+PERSONAL_PREVIEW_CACHE_TTL_IN_SECONDS = 10 * 60
+# PDFs of long letters aren’t worth the room they’d take up in Redis
+PREVIEW_CACHE_MAX_SIZE_IN_BYTES = 1024 * 1024
+# every preview gets the same budget of bytes × seconds in Redis, so bigger ones expire sooner and the
+# size of the cache depends on how many previews are made, not how big they are
+PREVIEW_CACHE_BUDGET_IN_BYTE_SECONDS = 64 * 1024 * PREVIEW_CACHE_TTL_IN_SECONDS
+
+# so one long letter doesn’t send template preview dozens of pages at once
+PDF_PAGE_PREVIEW_CONCURRENCY = 5
+
+
+def _get_preview_cache_key(url, kwargs):
+    digest = hashlib.sha256(url.encode('utf-8'))
+    if 'json' in kwargs:
+        digest.update(json.dumps(kwargs['json'], sort_keys=True, default=str).encode('utf-8'))
+    else:
+        data = kwargs['data']
+        digest.update(data if isinstance(data, bytes) else data.encode('utf-8'))
+    return 'template-preview-{}'.format(digest.hexdigest())
+
+
+def _get_preview_response(content_type, content, personal_data):
+    headers = {'Content-Type': content_type}
+
+    if personal_data:
+        return (content, 200, headers.items())
+
+    etag = hashlib.sha256(content).hexdigest()
+    headers['ETag'] = '"{}"'.format(etag)
+    headers['Cache-Control'] = REVALIDATE_CACHE_CONTROL
+
+    if has_request_context() and request.if_none_match.contains(etag):
+        return (b'', 304, headers.items())
+
+    return (content, 200, headers.items())
+
+
+def get_cached_preview(key, *, personal_data):
+    """
+    Returns the preview stored under `key`, or `None` if there isn’t one.
+    Previews are read straight from Redis rather than through the request
+    memo, so a request can wait for another one to store a preview.
+    """
+    cached = redis_client.get(key)
+    if cached is None:
+        return None
+    content_type, _, content = cached.partition(b'\n')
+    return _get_preview_response(content_type.decode('utf-8'), content, personal_data)
+
+
+def _get_preview(url, *, personal_data, cache_key=None, **kwargs):
+    """
+    Renders a preview with template preview, or gets it from Redis if the same
+    thing has been rendered recently. Previews are stored with their content
+    type, as `{content type}\n{content}`, under `cache_key` or a hash of
+    everything sent to template preview.
+
+    Previews without `personal_data` have an ETag, so the browser can keep them
+    and we only need to send them again if they’ve changed. Previews with
+    `personal_data` are only kept for a few minutes.
+    """
+    headers = {'Authorization': 'Token {}'.format(current_app.config['TEMPLATE_PREVIEW_API_KEY'])}
+
+    if not current_app.config['TEMPLATE_PREVIEW_CACHE_ENABLED']:
+        resp = http_sessions.post(url, headers=headers, **kwargs)
+        return (resp.content, resp.status_code, resp.headers.items())
+
+    key = cache_key or _get_preview_cache_key(url, kwargs)
+    cached = get_cached_preview(key, personal_data=personal_data)
+    if cached is not None:
+        return cached
+
+    resp = http_sessions.post(url, headers=headers, **kwargs)
+    if resp.status_code != 200:
+        return (resp.content, resp.status_code, resp.headers.items())
+
+    content_type, content = resp.headers.get('Content-Type', 'application/octet-stream'), resp.content
+    if len(content) <= PREVIEW_CACHE_MAX_SIZE_IN_BYTES:
+        redis_client.set(
+            key,
+            content_type.encode('utf-8') + b'\n' + content,
+            ex=min(
+                PERSONAL_PREVIEW_CACHE_TTL_IN_SECONDS if personal_data else PREVIEW_CACHE_TTL_IN_SECONDS,
+                PREVIEW_CACHE_BUDGET_IN_BYTE_SECONDS // max(len(content), 1),
+            ),
+        )
+
+    return _get_preview_response(content_type, content, personal_data)
+
+
+def extract_pages_from_pdf(pdf_file, pages):
+    """
+    Like `extract_page_from_pdf`, but for several pages at once, so the PDF
+    only has to be read once.
+    """
+    pdf = PdfFileReader(BytesIO(pdf_file))
+    extracted_pages = {}
+    for page in pages:
+        writer = PdfFileWriter()
+        writer.addPage(pdf.getPage(page - 1))
+        with BytesIO() as pdf_page:
+            writer.write(pdf_page)
+            extracted_pages[page] = pdf_page.getvalue()
+    return extracted_pages
 
 
 class TemplatePreview:
+    @staticmethod
+    def get_letter_contact_block_and_filename(template):
+        return (
+            template.get('reply_to_text', ''),
+            current_service.letter_branding and current_service.letter_branding['filename'],
+        )
+
     @classmethod
     def from_database_object(cls, template, filetype, values=None, page=None):
+        letter_contact_block, filename = cls.get_letter_contact_block_and_filename(template)
         data = {
-            'letter_contact_block': template.get('reply_to_text', ''),
+            'letter_contact_block': letter_contact_block,
             'template': template,
             'values': values,
-            'filename': current_service.letter_branding and current_service.letter_branding['filename']
+            'filename': filename,
         }
-        resp = requests.post(
+        return _get_preview(
             '{}/preview.{}{}'.format(
                 current_app.config['TEMPLATE_PREVIEW_API_HOST'],
                 filetype,
                 '?page={}'.format(page) if page else '',
             ),
+            personal_data=bool(values),
             json=data,
-            headers={'Authorization': 'Token {}'.format(current_app.config['TEMPLATE_PREVIEW_API_KEY'])}
         )
-        return (resp.content, resp.status_code, resp.headers.items())
 
     @classmethod
     def from_valid_pdf_file(cls, pdf_file, page):
         pdf_page = extract_page_from_pdf(BytesIO(pdf_file), int(page) - 1)
+        return cls.from_valid_pdf_page(pdf_page, page)
 
-        response = requests.post(
+    @classmethod
+    def from_valid_pdf_page(cls, pdf_page, page, cache_key=None):
+        return _get_preview(
             '{}/precompiled-preview.png{}'.format(
                 current_app.config['TEMPLATE_PREVIEW_API_HOST'],
                 '?hide_notify=true' if page == '1' else ''
             ),
+            personal_data=True,
+            cache_key=cache_key,
             data=base64.b64encode(pdf_page).decode('utf-8'),
-            headers={'Authorization': 'Token {}'.format(current_app.config['TEMPLATE_PREVIEW_API_KEY'])}
         )
 
-        return (response.content, response.status_code, response.headers.items())
-
     @classmethod
     def from_invalid_pdf_file(cls, pdf_file, page):
         pdf_page = extract_page_from_pdf(BytesIO(pdf_file), int(page) - 1)
+        return cls.from_invalid_pdf_page(pdf_page, page)
 
-        response = requests.post(
+    @classmethod
+    def from_invalid_pdf_page(cls, pdf_page, page, cache_key=None):
+        return _get_preview(
             '{}/precompiled/overlay.png{}'.format(
                 current_app.config['TEMPLATE_PREVIEW_API_HOST'],
                 '?page_number={}'.format(page)
             ),
+            personal_data=True,
+            cache_key=cache_key,
             data=pdf_page,
-            headers={'Authorization': 'Token {}'.format(current_app.config['TEMPLATE_PREVIEW_API_KEY'])}
         )
 
-        return (response.content, response.status_code, response.headers.items())
+    @classmethod
+    def from_pdf_file_pages(cls, pdf_file, pages, *, invalid_pages=(), get_cache_key=lambda page: None):
+        """
+        Renders several pages of a PDF at once, reading it only once and asking
+        template preview for a few pages at a time. Returns the preview of each
+        page, by page number. `invalid_pages` are shown with an overlay of the
+        printable area.
+        """
+        pdf_pages = extract_pages_from_pdf(pdf_file, pages)
+        previews = fetch_concurrently(max_concurrency=PDF_PAGE_PREVIEW_CONCURRENCY, **{
+            str(page): partial(
+                cls.from_invalid_pdf_page if page in invalid_pages else cls.from_valid_pdf_page,
+                pdf_pages[page],
+                page,
+                cache_key=get_cache_key(page),
+            )
+            for page in pages
+        })
+        return {int(page): preview for page, preview in previews.items()}
 
     @classmethod
     def from_example_template(cls, template, filename):
@@ -66,12 +220,11 @@ class TemplatePreview:
             'values': None,
             'filename': filename
         }
-        resp = requests.post(
+        return _get_preview(
             '{}/preview.png'.format(current_app.config['TEMPLATE_PREVIEW_API_HOST']),
+            personal_data=False,
             json=data,
-            headers={'Authorization': 'Token {}'.format(current_app.config['TEMPLATE_PREVIEW_API_KEY'])}
         )
-        return (resp.content, resp.status_code, resp.headers.items())
 
     @classmethod
     def from_utils_template(cls, template, filetype, page=None):
@@ -83,19 +236,66 @@ class TemplatePreview:
         )
 
 
-def get_page_count_for_letter(template, values=None):
+def _get_page_count_cache_key(template, values):
+    """
+    Everything which affects how many pages a letter has, hashed so that the
+    personalisation isn’t stored in the key.
+    """
+    letter_contact_block, filename = TemplatePreview.get_letter_contact_block_and_filename(template)
+    letter = json.dumps(
+        {
+            'subject': template.get('subject'),
+            'content': template.get('content'),
+            'letter_contact_block': letter_contact_block,
+            'filename': filename,
+            'values': values,
+        },
+        sort_keys=True,
+        default=str,
+    )
+    return 'letter-page-count-{}'.format(hashlib.sha256(letter.encode('utf-8')).hexdigest())
+
+
+def _get_page_count_from_template_preview(template, values):
+    page_count, _, _ = TemplatePreview.from_database_object(template, 'json', values)
+    return json.loads(page_count.decode('utf-8'))['count']
+
 
+def get_page_count_for_letter(template, values=None):
+    """
+    Page counts are kept in this worker and in Redis (so other workers can use
+    them), and only fetched from template preview the first time a letter is
+    seen.
+    """
     if template['template_type'] != 'letter':
         return None
 
-    page_count, _, _ = TemplatePreview.from_database_object(template, 'json', values)
-    page_count = json.loads(page_count.decode('utf-8'))['count']
+    if not current_app.config['LETTER_PAGE_COUNT_CACHE_ENABLED']:
+        return _get_page_count_from_template_preview(template, values)
+
+    key = _get_page_count_cache_key(template, values)
+
+    page_count = page_count_cache.get(key)
+    if page_count is not None:
+        return page_count
+
+    cached = cache.redis_client.get(key)
+    if cached is not None:
+        page_count = int(cached)
+    else:
+        page_count = _get_page_count_from_template_preview(template, values)
+        cache.redis_client.set(
+            key,
+            str(page_count),
+            ex=PERSONALISED_PAGE_COUNT_CACHE_TTL_IN_SECONDS if values else PAGE_COUNT_CACHE_TTL_IN_SECONDS,
+        )
 
+    page_count_cache.set(key, page_count)
     return page_count
 
 
 def sanitise_letter(pdf_file, *, allow_international_letters):
-    return requests.post(
+    return http_sessions.post(
         '{}/precompiled/sanitise?allow_international_letters={}'.format(
             current_app.config['TEMPLATE_PREVIEW_API_HOST'],
             'true' if allow_international_letters else 'false',
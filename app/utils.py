@@ -1,6 +1,9 @@
+import csv
 import os
+from collections import namedtuple
 from datetime import datetime, timedelta
-from functools import wraps
+from functools import partial, wraps
+from io import StringIO
 from itertools import chain
 from urllib.parse import urlparse
 
@@ -21,7 +24,6 @@ from notifications_utils.field import Field
 from notifications_utils.formatters import unescaped_formatted_list
 from notifications_utils.letter_timings import letter_can_be_cancelled
 from notifications_utils.postal_address import PostalAddress
-from notifications_utils.recipients import RecipientCSV
 from notifications_utils.template import (
     BroadcastPreviewTemplate,
     EmailPreviewTemplate,
@@ -38,7 +40,7 @@ from orderedset._orderedset import OrderedSet
 from werkzeug.datastructures import MultiDict
 from werkzeug.routing import RequestRedirect
 
-from app.models.spreadsheet import Spreadsheet
+from app.models.spreadsheet import Spreadsheet, StreamingCSV  # noqa: F401
 from app.notify_client.organisations_api_client import organisations_client
 
 SENDING_STATUSES = ['created', 'pending', 'sending', 'pending-virus-check']
@@ -49,6 +51,9 @@ REQUESTED_STATUSES = SENDING_STATUSES + DELIVERED_STATUSES + FAILURE_STATUSES
 
 NOTIFICATION_TYPES = ["sms", "email", "letter", "broadcast"]
 
+# lets the browser keep a response, as long as it checks with us that it’s still current before using it
+REVALIDATE_CACHE_CONTROL = 'no-cache, private, must-revalidate'
+
 
 with open('{}/email_domains.txt'.format(
     os.path.dirname(os.path.realpath(__file__))
@@ -118,12 +123,49 @@ def redirect_to_sign_in(f):
     return wrapped
 
 
+RowErrorCounts = namedtuple('RowErrorCounts', [
+    'bad_recipients',
+    'missing_data',
+    'message_too_long',
+    'empty_message',
+    'rows_with_errors',
+])
+
+
+def count_row_errors(recipients):
+    """
+    Counts the rows with each kind of error in one pass over the rows, rather
+    than going through them once for each of the `rows_with_…` properties.
+    """
+    bad_recipients = missing_data = message_too_long = empty_message = rows_with_errors = 0
+    for row in recipients:
+        # rows past `max_rows` are `None`
+        if not row:
+            continue
+        bad_recipients += bool(row.has_bad_recipient)
+        missing_data += bool(row.has_missing_data)
+        message_too_long += bool(row.message_too_long)
+        empty_message += bool(row.message_empty)
+        rows_with_errors += bool(row.has_error)
+    return RowErrorCounts(
+        bad_recipients=bad_recipients,
+        missing_data=missing_data,
+        message_too_long=message_too_long,
+        empty_message=empty_message,
+        rows_with_errors=rows_with_errors,
+    )
+
+
 def get_errors_for_csv(recipients, template_type):
+    return get_errors_for_row_error_counts(count_row_errors(recipients), template_type)
+
+
+def get_errors_for_row_error_counts(row_error_counts, template_type):
 
     errors = []
 
-    if any(recipients.rows_with_bad_recipients):
-        number_of_bad_recipients = len(list(recipients.rows_with_bad_recipients))
+    if row_error_counts.bad_recipients:
+        number_of_bad_recipients = row_error_counts.bad_recipients
         if 'sms' == template_type:
             if 1 == number_of_bad_recipients:
                 errors.append("fix 1 phone number")
@@ -140,22 +182,22 @@ def get_errors_for_csv(recipients, template_type):
             else:
                 errors.append("fix {} addresses".format(number_of_bad_recipients))
 
-    if any(recipients.rows_with_missing_data):
-        number_of_rows_with_missing_data = len(list(recipients.rows_with_missing_data))
+    if row_error_counts.missing_data:
+        number_of_rows_with_missing_data = row_error_counts.missing_data
         if 1 == number_of_rows_with_missing_data:
             errors.append("enter missing data in 1 row")
         else:
             errors.append("enter missing data in {} rows".format(number_of_rows_with_missing_data))
 
-    if any(recipients.rows_with_message_too_long):
-        number_of_rows_with_message_too_long = len(list(recipients.rows_with_message_too_long))
+    if row_error_counts.message_too_long:
+        number_of_rows_with_message_too_long = row_error_counts.message_too_long
         if 1 == number_of_rows_with_message_too_long:
             errors.append("shorten the message in 1 row")
         else:
             errors.append("shorten the messages in {} rows".format(number_of_rows_with_message_too_long))
 
-    if any(recipients.rows_with_empty_message):
-        number_of_rows_with_empty_message = len(list(recipients.rows_with_empty_message))
+    if row_error_counts.empty_message:
+        number_of_rows_with_empty_message = row_error_counts.empty_message
         if 1 == number_of_rows_with_empty_message:
             errors.append("check you have content for the empty message in 1 row")
         else:
@@ -179,14 +221,14 @@ def get_sample_template(template_type):
 
 def generate_notifications_csv(**kwargs):
     from app import notification_api_client
-    from app.s3_client.s3_csv_client import s3download
+    from app.notify_client import fetch_in_background
+    from app.s3_client.s3_csv_client import s3download_lines
     if 'page' not in kwargs:
         kwargs['page'] = 1
 
     if kwargs.get('job_id'):
-        original_file_contents = s3download(kwargs['service_id'], kwargs['job_id'])
-        original_upload = RecipientCSV(
-            original_file_contents,
+        original_upload = StreamingCSV(
+            s3download_lines(kwargs['service_id'], kwargs['job_id']),
             template=get_sample_template(kwargs['template_type']),
         )
         original_column_headers = original_upload.column_headers
@@ -196,42 +238,53 @@ def generate_notifications_csv(**kwargs):
 
     yield ','.join(fieldnames) + '\n'
 
-    while kwargs['page']:
-        notifications_resp = notification_api_client.get_notifications_for_service(**kwargs)
-        for notification in notifications_resp['notifications']:
-            if kwargs.get('job_id'):
-                values = [
-                    notification['row_number'],
-                ] + [
-                    original_upload[notification['row_number'] - 1].get(header).data
-                    for header in original_column_headers
-                ] + [
-                    notification['template_name'],
-                    notification['template_type'],
-                    notification['job_name'],
-                    notification['status'],
-                    notification['created_at'],
-                ]
+    next_page = fetch_in_background(partial(notification_api_client.get_notifications_for_service, **kwargs))
+
+    with StringIO() as converted:
+        output = csv.writer(converted)
+
+        while next_page:
+            notifications_resp = next_page.wait()
+
+            # get the next page from the API while this one is being sent
+            if notifications_resp['links'].get('next'):
+                kwargs['page'] += 1
+                next_page = fetch_in_background(
+                    partial(notification_api_client.get_notifications_for_service, **kwargs)
+                )
             else:
-                values = [
-                    # the recipient for precompiled letters is the full address block
-                    notification['recipient'].splitlines()[0].lstrip().rstrip(' ,'),
-                    notification['client_reference'],
-                    notification['template_name'],
-                    notification['template_type'],
-                    notification['created_by_name'] or '',
-                    notification['created_by_email_address'] or '',
-                    notification['job_name'] or '',
-                    notification['status'],
-                    notification['created_at']
-                ]
-            yield Spreadsheet.from_rows([map(str, values)]).as_csv_data
-
-        if notifications_resp['links'].get('next'):
-            kwargs['page'] += 1
-        else:
-            return
-    raise Exception("Should never reach here")
+                next_page = None
+
+            for notification in notifications_resp['notifications']:
+                if kwargs.get('job_id'):
+                    values = [
+                        notification['row_number'],
+                    ] + original_upload.get_data(
+                        notification['row_number'] - 1
+                    ) + [
+                        notification['template_name'],
+                        notification['template_type'],
+                        notification['job_name'],
+                        notification['status'],
+                        notification['created_at'],
+                    ]
+                else:
+                    values = [
+                        # the recipient for precompiled letters is the full address block
+                        notification['recipient'].splitlines()[0].lstrip().rstrip(' ,'),
+                        notification['client_reference'],
+                        notification['template_name'],
+                        notification['template_type'],
+                        notification['created_by_name'] or '',
+                        notification['created_by_email_address'] or '',
+                        notification['job_name'] or '',
+                        notification['status'],
+                        notification['created_at']
+                    ]
+                output.writerow(map(str, values))
+                yield converted.getvalue()
+                converted.seek(0)
+                converted.truncate()
 
 
 def get_page_from_request():
@@ -1,13 +1,18 @@
+import json
+import sqlite3
+
 import pytest
 
-from app.broadcast_areas import (
-    BroadcastAreasRepository,
-    broadcast_area_libraries,
-)
+from app.broadcast_areas import broadcast_area_libraries
+from app.broadcast_areas.polygons import Polygons
 from app.broadcast_areas.populations import (
     CITY_OF_LONDON,
     estimate_number_of_smartphones_for_population,
 )
+from app.broadcast_areas.repo import (
+    BroadcastAreasRepository,
+    SharedBroadcastAreasRepository,
+)
 
 
 def test_loads_libraries():
@@ -153,6 +158,198 @@ def test_repository_has_all_libraries():
     ] == [(name, name_singular) for _, name, name_singular, _is_group in libraries]
 
 
+def test_shared_repository_reuses_one_read_only_connection(tmp_path):
+    repo = BroadcastAreasRepository()
+    repo.database = tmp_path / 'broadcast-areas.sqlite3'
+    repo.create_tables()
+    repo.insert_broadcast_area_library('ctry19', name='Countries', name_singular='country', is_group=False)
+
+    shared_repo = SharedBroadcastAreasRepository()
+    shared_repo.database = repo.database
+
+    assert shared_repo.get_libraries() == [('ctry19', 'Countries', 'country', 0)]
+    assert shared_repo._get_connection() is shared_repo._get_connection()
+    assert shared_repo.query('PRAGMA cache_size') == [(-2000,)]
+
+    with pytest.raises(sqlite3.OperationalError):
+        shared_repo.query('DELETE FROM broadcast_area_libraries')
+
+
+def test_get_all_areas_for_library_only_returns_areas_with_sub_areas(tmp_path):
+    repo = BroadcastAreasRepository()
+    repo.database = tmp_path / 'broadcast-areas.sqlite3'
+    repo.create_tables()
+    repo.insert_broadcast_areas([
+        ('ctry19-A', 'Country', 'ctry19', None, 10),
+        ('wd20-A', 'Ward A', 'wd20-lad20', 'lad20-A', 2),
+        ('wd20-B', 'Ward B', 'wd20-lad20', 'lad20-A', 3),
+        ('lad20-A', 'Local authority', 'wd20-lad20', None, 5),
+    ])
+
+    assert repo.get_all_areas_for_library('ctry19') == [('ctry19-A', 'Country', 10, 'ctry19')]
+    assert repo.get_all_areas_for_library('wd20-lad20') == [('lad20-A', 'Local authority', 5, 'wd20-lad20')]
+
+
+def test_migrates_json_polygons_to_wkb(tmp_path):
+    repo = BroadcastAreasRepository()
+    repo.database = tmp_path / 'broadcast-areas.sqlite3'
+    repo.create_tables()
+    with repo.conn() as conn:
+        conn.execute(
+            'INSERT INTO broadcast_area_polygons (id, polygons, simple_polygons) VALUES (?, ?, ?)',
+            (
+                'ctry19-A',
+                json.dumps([[[0, 0], [1, 0], [1, 1], [0, 0]]]),
+                json.dumps([[[0, 0], [1, 0], [0, 1], [0, 0]]]),
+            ),
+        )
+
+    # polygons can still be read before they’re migrated
+    assert list(repo.get_polygons_for_area('ctry19-A')[0].exterior.coords) == [(0, 0), (1, 0), (1, 1), (0, 0)]
+
+    repo.migrate_polygons_to_wkb()
+
+    assert repo.query('SELECT typeof(polygons), typeof(simple_polygons) FROM broadcast_area_polygons') == [
+        ('blob', 'blob'),
+    ]
+    assert list(repo.get_polygons_for_area('ctry19-A')[0].exterior.coords) == [(0, 0), (1, 0), (1, 1), (0, 0)]
+    assert list(repo.get_simple_polygons_for_area('ctry19-A')[0].exterior.coords) == [(0, 0), (1, 0), (0, 1), (0, 0)]
+
+
+@pytest.fixture
+def repo_with_triangles(tmp_path):
+    repo = BroadcastAreasRepository()
+    repo.database = tmp_path / 'broadcast-areas.sqlite3'
+    repo.create_tables()
+    repo.insert_broadcast_areas(
+        [
+            ('ctry19-A', 'Lower triangle', 'ctry19', None, 1),
+            ('ctry19-B', 'Upper triangle', 'ctry19', None, 1),
+            ('ctry19-C', 'Far away', 'ctry19', None, 1),
+        ],
+        [
+            ('ctry19-A', [[[0, 0], [1, 0], [1, 1], [0, 0]]], [], 'a'),
+            ('ctry19-B', [[[0, 0], [1, 1], [0, 1], [0, 0]]], [], 'b'),
+            ('ctry19-C', [[[5, 5], [6, 5], [6, 6], [5, 5]]], [], 'c'),
+        ],
+    )
+    repo.insert_bounding_boxes([
+        ('ctry19-A', 0, 0, 1, 1),
+        ('ctry19-B', 0, 0, 1, 1),
+        ('ctry19-C', 5, 5, 6, 6),
+    ])
+    return repo
+
+
+@pytest.mark.parametrize('point, expected_area_ids', [
+    ((0.9, 0.1), ['ctry19-A']),
+    ((0.1, 0.9), ['ctry19-B']),
+    ((0.5, 0.5), ['ctry19-A', 'ctry19-B']),
+    ((3, 3), []),
+])
+def test_get_areas_containing_point(repo_with_triangles, point, expected_area_ids):
+    assert [
+        area_id for area_id, *_ in repo_with_triangles.get_areas_containing_point(*point)
+    ] == expected_area_ids
+
+
+@pytest.mark.parametrize('bounding_box, expected_area_ids', [
+    ((0.8, 0, 1, 0.2), ['ctry19-A']),
+    ((0, 0.8, 0.2, 1), ['ctry19-B']),
+    ((0.5, 0.5, 5.5, 5.5), ['ctry19-A', 'ctry19-B', 'ctry19-C']),
+    ((2, 2, 3, 3), []),
+])
+def test_get_areas_intersecting_bounding_box(repo_with_triangles, bounding_box, expected_area_ids):
+    assert [
+        area_id for area_id, *_ in repo_with_triangles.get_areas_intersecting_bounding_box(*bounding_box)
+    ] == expected_area_ids
+
+
+def test_polygons_without_any_polygons_have_no_bounds():
+    assert Polygons([]).bounds is None
+    assert Polygons([[[0, 0], [1, 0], [1, 2], [0, 0]]]).bounds == (0, 0, 1, 2)
+
+
+def test_insert_broadcast_areas_replaces_polygons_and_keeps_source_hashes(repo_with_triangles):
+    repo_with_triangles.delete_library_data()
+    repo_with_triangles.insert_broadcast_areas(
+        [
+            ('ctry19-A', 'Lower triangle', 'ctry19', None, 1),
+            ('ctry19-B', 'Upper triangle', 'ctry19', None, 1),
+        ],
+        (polygons for polygons in [('ctry19-A', [[[2, 2], [3, 2], [3, 3], [2, 2]]], [], 'new')]),
+    )
+    repo_with_triangles.delete_polygons_without_areas()
+
+    assert repo_with_triangles.get_source_hashes() == {'ctry19-A': 'new', 'ctry19-B': 'b'}
+    assert list(repo_with_triangles.get_polygons_for_area('ctry19-A')[0].exterior.coords)[0] == (2, 2)
+
+
+def test_migrates_databases_built_before_wkb_source_hashes_estimated_areas_and_bounding_boxes(tmp_path):
+    repo = BroadcastAreasRepository()
+    repo.database = tmp_path / 'broadcast-areas.sqlite3'
+    with repo.conn() as conn:
+        conn.execute("""
+        CREATE TABLE broadcast_area_libraries (
+            id TEXT PRIMARY KEY, name TEXT NOT NULL, name_singular TEXT NOT NULL, is_group BOOLEAN NOT NULL
+        )""")
+        conn.execute("""
+        CREATE TABLE broadcast_area_library_groups (
+            id TEXT PRIMARY KEY, name TEXT NOT NULL, broadcast_area_library_id TEXT NOT NULL
+        )""")
+        conn.execute("""
+        CREATE TABLE broadcast_areas (
+            id TEXT PRIMARY KEY, name TEXT NOT NULL, broadcast_area_library_id TEXT NOT NULL,
+            broadcast_area_library_group_id TEXT, count_of_phones INTEGER
+        )""")
+        conn.execute("""
+        CREATE TABLE broadcast_area_polygons (
+            id TEXT PRIMARY KEY, polygons TEXT NOT NULL, simple_polygons TEXT NOT NULL
+        )""")
+        conn.execute(
+            "INSERT INTO broadcast_areas VALUES ('ctry19-A', 'Lower triangle', 'ctry19', NULL, 1)"
+        )
+        conn.execute(
+            'INSERT INTO broadcast_area_polygons VALUES (?, ?, ?)',
+            (
+                'ctry19-A',
+                json.dumps([[[0, 0], [1, 0], [1, 1], [0, 0]]]),
+                json.dumps([[[0, 0], [1, 0], [1, 1], [0, 0]]]),
+            ),
+        )
+
+    # the same steps as create-broadcast-areas-db.py with --keep-old-polygons
+    repo.delete_library_data()
+    repo.migrate_polygons_to_wkb()
+    repo.add_missing_columns_and_tables()
+    repo.add_missing_columns_and_tables()
+    repo.insert_broadcast_areas([('ctry19-A', 'Lower triangle', 'ctry19', None, 1)])
+    assert not repo.has_estimated_areas()
+    repo.update_estimated_areas_and_counts_of_phones([('ctry19-A', 0.5, 1)])
+    repo.insert_bounding_boxes([('ctry19-A', 0, 0, 1, 1)])
+
+    assert repo.has_estimated_areas()
+    assert repo.get_source_hashes() == {'ctry19-A': None}
+    assert repo.query('SELECT typeof(polygons), typeof(simple_polygons) FROM broadcast_area_polygons') == [
+        ('blob', 'blob'),
+    ]
+    assert repo.get_areas(['ctry19-A']) == [('ctry19-A', 'Lower triangle', 1, 'ctry19')]
+    assert [area_id for area_id, *_ in repo.get_areas_containing_point(0.9, 0.1)] == ['ctry19-A']
+
+
+def test_shared_repository_reconnects_after_fork(mocker):
+    shared_repo = SharedBroadcastAreasRepository()
+    mock_connect = mocker.patch.object(shared_repo, '_connect')
+
+    mocker.patch('app.broadcast_areas.repo.os.getpid', return_value=1)
+    shared_repo._get_connection()
+    shared_repo._get_connection()
+    mocker.patch('app.broadcast_areas.repo.os.getpid', return_value=2)
+    shared_repo._get_connection()
+
+    assert mock_connect.call_count == 2
+
+
 @pytest.mark.parametrize('library', (
     broadcast_area_libraries
 ))
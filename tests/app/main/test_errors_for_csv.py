@@ -1,20 +1,40 @@
 from collections import namedtuple
 
 import pytest
+from notifications_utils.recipients import RecipientCSV
+from notifications_utils.template import SMSMessageTemplate
 
-from app.utils import get_errors_for_csv
+from app.utils import RowErrorCounts, count_row_errors, get_errors_for_csv
 
-MockRecipients = namedtuple(
-    'RecipientCSV',
+MockRow = namedtuple(
+    'Row',
     [
-        'rows_with_bad_recipients',
-        'rows_with_missing_data',
-        'rows_with_message_too_long',
-        'rows_with_empty_message'
+        'has_bad_recipient',
+        'has_missing_data',
+        'message_too_long',
+        'message_empty',
+        'has_error',
     ]
 )
 
 
+def MockRecipients(
+    rows_with_bad_recipients, rows_with_missing_data, rows_with_message_too_long, rows_with_empty_message
+):
+    return [
+        MockRow(
+            has_bad_recipient=index in rows_with_bad_recipients,
+            has_missing_data=index in rows_with_missing_data,
+            message_too_long=index in rows_with_message_too_long,
+            message_empty=index in rows_with_empty_message,
+            has_error=True,
+        )
+        for index in set().union(
+            rows_with_bad_recipients, rows_with_missing_data, rows_with_message_too_long, rows_with_empty_message
+        )
+    ]
+
+
 @pytest.mark.parametrize(
     "rows_with_bad_recipients, rows_with_missing_data, "
     "rows_with_message_too_long, rows_with_empty_message, template_type, expected_errors",
@@ -111,3 +131,34 @@ def test_get_errors_for_csv(
         ),
         template_type
     ) == expected_errors
+
+
+def test_count_row_errors_counts_each_kind_of_error_in_one_pass():
+    recipients = MockRecipients({2, 4}, {4, 6}, {8}, set())
+
+    assert count_row_errors(recipients) == RowErrorCounts(
+        bad_recipients=2,
+        missing_data=2,
+        message_too_long=1,
+        empty_message=0,
+        rows_with_errors=4,
+    )
+
+    assert count_row_errors(iter(recipients)).rows_with_errors == 4
+
+
+def test_count_row_errors_ignores_rows_past_max_rows(mocker):
+    mocker.patch.object(RecipientCSV, 'max_rows', 4)
+    recipients = RecipientCSV(
+        'phone number\n' + '\n'.join(['07700900001', 'not a number'] * 3),
+        template=SMSMessageTemplate({'content': 'Hello', 'template_type': 'sms'}),
+    )
+
+    assert recipients.too_many_rows
+    assert count_row_errors(recipients) == RowErrorCounts(
+        bad_recipients=2,
+        missing_data=0,
+        message_too_long=0,
+        empty_message=0,
+        rows_with_errors=2,
+    )
@@ -1,3 +1,6 @@
+from flask import url_for
+
+from tests.conftest import set_config
 
 
 def test_owasp_useful_headers_set(
@@ -28,6 +31,27 @@ def test_owasp_useful_headers_set(
         '<https://static.example.com>; rel=dns-prefetch, '
         '<https://static.example.com>; rel=preconnect'
     )
+    assert response.headers['Cache-Control'] == 'no-store, no-cache, private, must-revalidate'
+
+
+def test_previews_without_personal_data_can_be_revalidated(
+    app_,
+    platform_admin_client,
+    mocker,
+):
+    mocker.patch('app.extensions.RedisClient.get', return_value=b'image/png\npng')
+
+    url = url_for('no_cookie.letter_branding_preview_image', filename='hm-government')
+
+    with set_config(app_, 'TEMPLATE_PREVIEW_CACHE_ENABLED', True):
+        response = platform_admin_client.get(url)
+        not_modified_response = platform_admin_client.get(url, headers={'If-None-Match': response.headers['ETag']})
+
+    assert response.status_code == 200
+    assert response.get_data() == b'png'
+    assert response.headers['Cache-Control'] == 'no-cache, private, must-revalidate'
+    assert not_modified_response.status_code == 304
+    assert not_modified_response.get_data() == b''
 
 
 def test_headers_non_ascii_characters_are_replaced(
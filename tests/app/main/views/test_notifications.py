@@ -1,4 +1,6 @@
 import base64
+import json
+import uuid
 from functools import partial
 from unittest.mock import mock_open
 
@@ -8,6 +10,8 @@ from freezegun import freeze_time
 from notifications_python_client.errors import APIError
 from PyPDF2.utils import PdfReadError
 
+from app.models.notifications_export import NotificationsExport
+from tests import sample_uuid
 from tests.conftest import (
     SERVICE_ONE_ID,
     create_active_caseworking_user,
@@ -16,6 +20,8 @@ from tests.conftest import (
     normalize_spaces,
 )
 
+EXPORT_ID = '3d1f2aaf-5a2c-4d0c-bc53-7aab1e7da0b2'
+
 
 @pytest.mark.parametrize('key_type, notification_status, expected_status', [
     (None, 'created', 'Sending'),
@@ -949,3 +955,149 @@ def test_cancelling_a_letter_calls_the_api(
     )
 
     assert cancel_endpoint.called
+
+
+@pytest.mark.parametrize('endpoint, extra_args, api_mocks', [
+    ('main.download_notifications_csv', {'message_type': 'sms'}, ['mock_get_service_data_retention']),
+    ('main.view_job_csv', {'job_id': sample_uuid()}, ['mock_get_job', 'mock_get_service_template']),
+])
+def test_download_starts_export_in_background_and_redirects_to_it(
+    client_request,
+    mocker,
+    request,
+    endpoint,
+    extra_args,
+    api_mocks,
+):
+    for api_mock in api_mocks:
+        request.getfixturevalue(api_mock)
+    mocker.patch('app.models.notifications_export.NotificationsExport.can_start', return_value=True)
+    mock_start = mocker.patch(
+        'app.models.notifications_export.NotificationsExport.start',
+        return_value=NotificationsExport(
+            service_id=SERVICE_ONE_ID, id=EXPORT_ID, filename='report.csv', status='pending', started_at=0,
+        ),
+    )
+
+    client_request.get(
+        endpoint,
+        service_id=SERVICE_ONE_ID,
+        **extra_args,
+        _expected_status=302,
+        _expected_redirect=url_for(
+            'main.view_notifications_export',
+            service_id=SERVICE_ONE_ID,
+            export_id=EXPORT_ID,
+            _external=True,
+        ),
+    )
+
+    assert mock_start.call_args[1]['service_id'] == uuid.UUID(SERVICE_ONE_ID)
+    assert mock_start.call_args[1]['filename'].endswith('.csv')
+    assert mock_start.call_args[1]['format_for_csv'] is True
+
+
+@pytest.mark.parametrize('status, expected_message, expected_polling', [
+    ('pending', 'Preparing your report…', True),
+    ('finished', 'report.csv', False),
+    ('failed', 'There was a problem preparing your report. Go back and try downloading it again.', False),
+])
+def test_notifications_export_page(
+    client_request,
+    mocker,
+    status,
+    expected_message,
+    expected_polling,
+):
+    mocker.patch('app.models.notifications_export.time', return_value=0)
+    mocker.patch('app.extensions.RedisClient.get', return_value=json.dumps({
+        'filename': 'report.csv', 'status': status, 'started_at': 0,
+    }).encode('utf-8'))
+
+    page = client_request.get(
+        'main.view_notifications_export',
+        service_id=SERVICE_ONE_ID,
+        export_id=EXPORT_ID,
+    )
+
+    assert normalize_spaces(page.select_one('main p').text) == expected_message
+    assert bool(page.select('[data-module=update-content]')) is expected_polling
+
+
+def test_notifications_export_page_404s_for_unknown_export(client_request, mocker):
+    mocker.patch('app.extensions.RedisClient.get', return_value=None)
+    client_request.get(
+        'main.view_notifications_export',
+        service_id=SERVICE_ONE_ID,
+        export_id=EXPORT_ID,
+        _expected_status=404,
+    )
+
+
+@pytest.mark.parametrize('status, expected_download_url, expected_stop', [
+    ('pending', None, 0),
+    ('finished', 'https://s3.example.com/report.csv?signature=1', 1),
+])
+def test_notifications_export_updates(
+    logged_in_client,
+    mocker,
+    status,
+    expected_download_url,
+    expected_stop,
+):
+    mocker.patch('app.models.notifications_export.time', return_value=0)
+    mocker.patch('app.extensions.RedisClient.get', return_value=json.dumps({
+        'filename': 'report.csv', 'status': status, 'started_at': 0,
+    }).encode('utf-8'))
+    mock_get_url = mocker.patch(
+        'app.models.notifications_export.get_csv_download_url',
+        return_value='https://s3.example.com/report.csv?signature=1',
+    )
+
+    response = logged_in_client.get(url_for(
+        'main.view_notifications_export_updates',
+        service_id=SERVICE_ONE_ID,
+        export_id=EXPORT_ID,
+    ))
+
+    assert response.status_code == 200
+    json_response = json.loads(response.get_data(as_text=True))
+    assert json_response['status'] == status
+    assert json_response['download_url'] == expected_download_url
+    assert json_response['stop'] == expected_stop
+    assert 'export' in json_response
+    if expected_download_url:
+        mock_get_url.assert_called_once_with(
+            'test-notifications-csv-upload',
+            'service-{}-notify/notifications-exports/{}.csv'.format(SERVICE_ONE_ID, EXPORT_ID),
+            'report.csv',
+            expires_in_seconds=60,
+        )
+
+
+@pytest.mark.parametrize('status, expected_status', [
+    ('pending', 404),
+    ('finished', 302),
+])
+def test_download_notifications_export_redirects_to_s3(
+    client_request,
+    mocker,
+    status,
+    expected_status,
+):
+    mocker.patch('app.models.notifications_export.time', return_value=0)
+    mocker.patch('app.extensions.RedisClient.get', return_value=json.dumps({
+        'filename': 'report.csv', 'status': status, 'started_at': 0,
+    }).encode('utf-8'))
+    mocker.patch(
+        'app.models.notifications_export.get_csv_download_url',
+        return_value='https://s3.example.com/report.csv?signature=1',
+    )
+
+    client_request.get(
+        'main.download_notifications_export',
+        service_id=SERVICE_ONE_ID,
+        export_id=EXPORT_ID,
+        _expected_status=expected_status,
+        _expected_redirect='https://s3.example.com/report.csv?signature=1' if expected_status == 302 else None,
+    )
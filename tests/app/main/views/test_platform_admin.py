@@ -9,6 +9,7 @@ import pytest
 from bs4 import BeautifulSoup
 from flask import url_for
 from freezegun import freeze_time
+from prometheus_client.metrics_core import Metric
 
 from app.main.views.platform_admin import (
     create_global_stats,
@@ -715,6 +716,10 @@ def test_clear_cache_shows_form(client_request, platform_admin_user, mocker):
     ('broadcast', [
         call('service-????????-????-????-????-????????????-broadcast-message-????????-????-????-????-????????????'),
     ], 'Removed 101 broadcast objects from redis'),
+    ('template_preview', [
+        call('template-preview-*'),
+        call('service-????????-????-????-????-????????????-letter-upload-????????-????-????-????-????????????-page-*'),
+    ], 'Removed 102 template_preview objects from redis'),
 ))
 def test_clear_cache_submits_and_tells_you_how_many_things_were_deleted(
     client_request,
@@ -748,6 +753,70 @@ def test_clear_cache_requires_option(client_request, platform_admin_user, mocker
     assert not redis.delete_cache_keys_by_pattern.called
 
 
+def _metric(name, samples):
+    metric = Metric(name, '', 'untyped')
+    for sample_name, labels, value in samples:
+        metric.add_sample(sample_name, labels, value)
+    return metric
+
+
+def test_cache_statistics_shows_hit_ratios_by_key_family(client_request, platform_admin_user, mocker):
+    mock_metrics = mocker.patch('app.main.views.platform_admin.metrics')
+    mock_metrics.registry.collect.return_value = [
+        _metric('admin_cache_hits', [
+            ('admin_cache_hits_total', {'family': 'user'}, 30.0),
+            ('admin_cache_hits_total', {'family': 'branding'}, 1.0),
+        ]),
+        _metric('admin_cache_misses', [
+            ('admin_cache_misses_total', {'family': 'user'}, 10.0),
+            ('admin_cache_misses_total', {'family': 'templates'}, 1234.0),
+        ]),
+        _metric('admin_cache_sets', [
+            ('admin_cache_sets_total', {'family': 'user'}, 10.0),
+        ]),
+        _metric('admin_cache_deletes', [
+            ('admin_cache_deletes_total', {'family': 'user'}, 2.0),
+        ]),
+        _metric('admin_redis_request_duration_seconds', [
+            ('admin_redis_request_duration_seconds_bucket', {'operation': 'get', 'family': 'user', 'le': '0.5'}, 40.0),
+            ('admin_redis_request_duration_seconds_sum', {'operation': 'get', 'family': 'user'}, 0.06),
+            ('admin_redis_request_duration_seconds_count', {'operation': 'get', 'family': 'user'}, 40.0),
+            ('admin_redis_request_duration_seconds_sum', {'operation': 'set', 'family': 'user'}, 10.0),
+            ('admin_redis_request_duration_seconds_count', {'operation': 'set', 'family': 'user'}, 10.0),
+        ]),
+        _metric('http_server_requests', [
+            ('http_server_requests_total', {'method': 'GET'}, 99.0),
+        ]),
+    ]
+    client_request.login(platform_admin_user)
+
+    mocker.patch('app.main.views.platform_admin.os.getpid', return_value=1234)
+    page = client_request.get('main.cache_statistics')
+
+    assert normalize_spaces(page.select_one('main p').text) == (
+        'These are only for the worker which served this page (process 1234), counted since it last started, '
+        'so refreshing the page may show a different worker. '
+        'For every worker added together, use the admin_cache_ and admin_redis_ metrics in Prometheus.'
+    )
+    assert [
+        normalize_spaces(row.text) for row in page.select('tbody tr')
+    ] == [
+        'branding 100% 1 0 0 0',
+        'templates 0% 0 1,234 0 0',
+        'user 75% 30 10 10 2 1.5ms',
+    ]
+
+
+def test_cache_statistics_with_nothing_cached(client_request, platform_admin_user, mocker):
+    mock_metrics = mocker.patch('app.main.views.platform_admin.metrics')
+    mock_metrics.registry.collect.return_value = []
+    client_request.login(platform_admin_user)
+
+    page = client_request.get('main.cache_statistics')
+
+    assert normalize_spaces(page.select_one('tbody').text) == 'Nothing has been cached yet'
+
+
 def test_reports_page(
     platform_admin_client
 ):
@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+import json
 import uuid
 from functools import partial
 from glob import glob
@@ -28,6 +29,7 @@ from xlrd.xldate import (
     XLDateTooLarge,
 )
 
+from app.main.views.send import _get_row_line_numbers
 from tests import (
     template_json,
     validate_route_permission,
@@ -45,6 +47,7 @@ from tests.conftest import (
     mock_get_service_letter_template,
     mock_get_service_template,
     normalize_spaces,
+    set_config,
 )
 
 template_types = ['email', 'sms']
@@ -382,6 +385,41 @@ def test_upload_files_in_different_formats(
         )
 
 
+@pytest.mark.parametrize("filename", test_spreadsheet_files)
+def test_upload_files_in_different_formats_streams_them_to_s3(
+    filename,
+    app_,
+    logged_in_client,
+    service_one,
+    mocker,
+    mock_get_service_template,
+    mock_s3_set_metadata,
+    fake_uuid,
+):
+    uploaded_data = []
+
+    def _upload(service_id, filedata, region):
+        uploaded_data.append(b''.join(filedata['data']))
+        return fake_uuid
+
+    mocker.patch('app.main.views.send.s3upload', side_effect=_upload)
+
+    with set_config(app_, 'STREAMING_SPREADSHEET_UPLOADS', True), open(filename, 'rb') as uploaded:
+        response = logged_in_client.post(
+            url_for('main.send_messages', service_id=service_one['id'], template_id=fake_uuid),
+            data={'file': (BytesIO(uploaded.read()), filename)},
+            content_type='multipart/form-data'
+        )
+
+    assert response.status_code == 302
+    assert uploaded_data[0].decode('utf-8').strip() == (
+        "phone number,name,favourite colour,fruit\r\n"
+        "07739 468 050,Pete,Coral,tomato\r\n"
+        "07527 125 974,Not Pete,Magenta,Avacado\r\n"
+        "07512 058 823,Still Not Pete,Crimson,Pear"
+    )
+
+
 def test_send_messages_sanitises_and_truncates_file_name_for_metadata(
     logged_in_client,
     service_one,
@@ -2808,6 +2846,95 @@ def test_should_show_preview_letter_message(
     assert mocked_preview.call_args[1] == {'page': expected_page}
 
 
+def test_preview_letter_message_uses_checked_upload_from_cache(
+    platform_admin_client,
+    mock_get_service_letter_template,
+    service_one,
+    fake_uuid,
+    mocker,
+):
+    service_one['permissions'] = ['letter']
+    mocker.patch('app.service_api_client.get_service', return_value={"data": service_one})
+    mocker.patch('app.main.views.send.get_page_count_for_letter', return_value=1)
+    mocker.patch(
+        'app.main.views.send.s3download',
+        return_value='\n'.join(
+            ['address line 1, postcode'] +
+            ['123 street, abc123'] +
+            ['321 avenue, cba321']
+        )
+    )
+    mock_redis_get = mocker.patch('app.extensions.RedisClient.get', return_value=json.dumps({
+        'count_of_recipients': 2,
+        'column_headers': ['address line 1', 'postcode'],
+        'header_line_count': 1,
+        'rows_can_be_found': True,
+        'row_line_numbers': None,
+    }).encode('utf-8'))
+    mock_redis_set = mocker.patch('app.extensions.RedisClient.set')
+    mocked_preview = mocker.patch('app.main.views.send.TemplatePreview.from_utils_template', return_value='foo')
+
+    response = platform_admin_client.get(url_for(
+        'no_cookie.check_messages_preview',
+        service_id=service_one['id'],
+        template_id=fake_uuid,
+        upload_id=fake_uuid,
+        filetype='png',
+        row_index=3,
+    ))
+
+    assert response.status_code == 200
+    mock_redis_get.assert_called_once_with(
+        'service-{0}-checked-upload-{1}-template-{1}-version-1'.format(service_one['id'], fake_uuid)
+    )
+    assert mock_redis_set.called is False
+    assert mocked_preview.call_args[0][0].values == {'postcode': 'cba321', 'addressline1': '321 avenue'}
+
+
+def test_preview_letter_message_404s_for_rows_past_the_end_of_the_file(
+    platform_admin_client,
+    mock_get_service_letter_template,
+    service_one,
+    fake_uuid,
+    mocker,
+):
+    service_one['permissions'] = ['letter']
+    mocker.patch('app.service_api_client.get_service', return_value={"data": service_one})
+    mocker.patch('app.main.views.send.get_page_count_for_letter', return_value=1)
+    mocker.patch('app.main.views.send.s3download', return_value='address line 1, postcode\n123 street, abc123')
+    mock_redis_set = mocker.patch('app.extensions.RedisClient.set')
+
+    response = platform_admin_client.get(url_for(
+        'no_cookie.check_messages_preview',
+        service_id=service_one['id'],
+        template_id=fake_uuid,
+        upload_id=fake_uuid,
+        filetype='png',
+        row_index=3,
+    ))
+
+    assert response.status_code == 404
+    assert json.loads(mock_redis_set.call_args[0][1])['count_of_recipients'] == 1
+
+
+@pytest.mark.parametrize('contents, expected_line_numbers', [
+    (
+        'phone number, name\n07700900001, Jo\n07700900002, Al\n',
+        (1, 2, None),
+    ),
+    (
+        '\n\nphone number, name\n07700900001, "Jo\nBloggs"\n07700900002, Al',
+        (1, 2, [1, 3, 4]),
+    ),
+    (
+        '"phone\nnumber", name\n07700900001, Jo',
+        (2, 1, None),
+    ),
+])
+def test_get_row_line_numbers(contents, expected_line_numbers):
+    assert _get_row_line_numbers(contents) == expected_line_numbers
+
+
 def test_dont_show_preview_letter_templates_for_bad_filetype(
     logged_in_client,
     mock_get_service_template,
@@ -3677,6 +3804,45 @@ def test_check_messages_shows_over_max_row_error(
     )
 
 
+def test_check_messages_shows_over_max_row_error_without_checking_extra_rows(
+    client_request,
+    mock_get_users_by_service,
+    mock_get_service_template_with_placeholders,
+    mock_has_permissions,
+    mock_get_service_statistics,
+    mock_get_job_doesnt_exist,
+    mock_get_jobs,
+    mock_s3_get_metadata,
+    mock_s3_download,
+    fake_uuid,
+    mocker
+):
+    mocker.patch('app.main.views.send.RecipientCSV.max_rows', 1)
+
+    with client_request.session_transaction() as session:
+        session['file_uploads'] = {
+            fake_uuid: {
+                'template_id': fake_uuid,
+            }
+        }
+
+    page = client_request.get(
+        'main.check_messages',
+        service_id=SERVICE_ONE_ID,
+        template_id=fake_uuid,
+        upload_id=fake_uuid,
+        _test_page_title=False,
+    )
+
+    assert ' '.join(
+        page.find('div', class_='banner-dangerous').text.split()
+    ) == (
+        'Your file has too many rows '
+        'Notify can process up to 1 rows at once. '
+        'Your file has 2 rows.'
+    )
+
+
 @pytest.mark.parametrize('existing_session_items', [
     {},
     {'recipient': '07700900001'},
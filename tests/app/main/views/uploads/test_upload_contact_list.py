@@ -647,8 +647,8 @@ def test_download_contact_list(
     mock_get_contact_list,
 ):
     mocker.patch(
-        'app.models.contact_list.s3download',
-        return_value='phone number\n07900900321'
+        'app.models.contact_list.s3download_stream',
+        return_value=BytesIO(b'phone number\n07900900321')
     )
     response = logged_in_client.get(url_for(
         'main.download_contact_list',
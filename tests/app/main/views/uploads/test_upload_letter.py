@@ -7,7 +7,7 @@ from requests import RequestException
 
 from app.formatters import normalize_spaces
 from app.s3_client.s3_letter_upload_client import LetterMetadata
-from tests.conftest import SERVICE_ONE_ID
+from tests.conftest import SERVICE_ONE_ID, set_config
 
 
 def test_get_upload_letter(client_request):
@@ -560,6 +560,93 @@ def test_uploaded_letter_preview_image_400s_for_bad_page_type(
     )
 
 
+@pytest.fixture
+def letter_upload_preview_cache(app_, mocker):
+    mocker.patch('app.main.views.uploads.redis_client.active', True)
+    mocker.patch('app.main.views.uploads.redis_client.release_lock')
+    with set_config(app_, 'TEMPLATE_PREVIEW_CACHE_ENABLED', True):
+        yield
+
+
+def test_uploaded_letter_preview_renders_every_page_at_once(
+    mocker,
+    logged_in_client,
+    mock_get_service,
+    fake_uuid,
+    letter_upload_preview_cache,
+):
+    mocker.patch('app.main.views.uploads.get_cached_preview', return_value=None)
+    mocker.patch('app.main.views.uploads.redis_client.acquire_lock', return_value=True)
+    mocker.patch('app.main.views.uploads.get_letter_pdf_and_metadata', return_value=('pdf_file', {
+        'message': 'content-outside-printable-area',
+        'invalid_pages': '[2]',
+        'page_count': '3',
+    }))
+    mock_render = mocker.patch('app.main.views.uploads.TemplatePreview.from_pdf_file_pages', return_value={
+        1: make_response('page 1', 200),
+        2: make_response('page 2', 200),
+        3: make_response('page 3', 200),
+    })
+
+    response = logged_in_client.get(
+        url_for('main.view_letter_upload_as_preview', file_id=fake_uuid, service_id=SERVICE_ONE_ID, page=2)
+    )
+
+    assert response.get_data(as_text=True) == 'page 2'
+    assert mock_render.call_args[0] == ('pdf_file', range(1, 4))
+    assert mock_render.call_args[1]['invalid_pages'] == [2]
+    assert mock_render.call_args[1]['get_cache_key'](3) == 'service-{}-letter-upload-{}-page-3'.format(
+        SERVICE_ONE_ID, fake_uuid
+    )
+
+
+def test_uploaded_letter_preview_is_served_from_cache(
+    mocker,
+    logged_in_client,
+    mock_get_service,
+    fake_uuid,
+    letter_upload_preview_cache,
+):
+    mock_get_cached_preview = mocker.patch(
+        'app.main.views.uploads.get_cached_preview',
+        return_value=(b'png', 200, {'Content-Type': 'image/png'}.items()),
+    )
+    mock_get_pdf = mocker.patch('app.main.views.uploads.get_letter_pdf_and_metadata')
+
+    response = logged_in_client.get(
+        url_for('main.view_letter_upload_as_preview', file_id=fake_uuid, service_id=SERVICE_ONE_ID, page=2)
+    )
+
+    assert response.get_data() == b'png'
+    mock_get_cached_preview.assert_called_once_with(
+        'service-{}-letter-upload-{}-page-2'.format(SERVICE_ONE_ID, fake_uuid), personal_data=True,
+    )
+    assert mock_get_pdf.called is False
+
+
+def test_uploaded_letter_preview_waits_for_another_request_rendering_every_page(
+    mocker,
+    logged_in_client,
+    mock_get_service,
+    fake_uuid,
+    letter_upload_preview_cache,
+):
+    mocker.patch('app.main.views.uploads.get_cached_preview', side_effect=[
+        None, None, (b'png', 200, {'Content-Type': 'image/png'}.items()),
+    ])
+    mocker.patch('app.main.views.uploads.redis_client.acquire_lock', return_value=False)
+    mock_sleep = mocker.patch('app.main.views.uploads.sleep')
+    mock_get_pdf = mocker.patch('app.main.views.uploads.get_letter_pdf_and_metadata')
+
+    response = logged_in_client.get(
+        url_for('main.view_letter_upload_as_preview', file_id=fake_uuid, service_id=SERVICE_ONE_ID, page=2)
+    )
+
+    assert response.get_data() == b'png'
+    assert mock_sleep.call_count == 2
+    assert mock_get_pdf.called is False
+
+
 @pytest.mark.parametrize('address, post_data, expected_postage', (
     (
         'address',
@@ -0,0 +1,180 @@
+import json
+from unittest.mock import ANY
+
+import pytest
+from freezegun import freeze_time
+
+from app.models.notifications_export import NotificationsExport, _write_to_s3
+from tests.conftest import SERVICE_ONE_ID, set_config
+
+EXPORT_ID = '3d1f2aaf-5a2c-4d0c-bc53-7aab1e7da0b2'
+
+
+@pytest.fixture(autouse=True)
+def mock_delete_old_exports(mocker):
+    return mocker.patch('app.models.notifications_export.delete_notifications_exports_older_than')
+
+
+@pytest.fixture
+def export():
+    return NotificationsExport(
+        service_id=SERVICE_ONE_ID,
+        id=EXPORT_ID,
+        filename='report.csv',
+        status='pending',
+        started_at=1_000_000,
+    )
+
+
+@pytest.mark.parametrize('background_exports, redis_active, expected_can_start', [
+    (True, True, True),
+    (True, False, False),
+    (False, True, False),
+])
+def test_can_start(app_, mocker, background_exports, redis_active, expected_can_start):
+    mocker.patch('app.models.notifications_export.redis_client.active', redis_active)
+    with set_config(app_, 'NOTIFICATION_EXPORTS_IN_BACKGROUND', background_exports):
+        assert bool(NotificationsExport.can_start()) is expected_can_start
+
+
+@freeze_time('2020-01-01 12:00')
+def test_start_saves_export_and_writes_it_in_background(app_, mocker):
+    mock_redis_set = mocker.patch('app.extensions.RedisClient.set')
+    mock_spawn = mocker.patch('app.models.notifications_export.spawn_n')
+
+    with app_.test_request_context():
+        export = NotificationsExport.start(service_id=SERVICE_ONE_ID, filename='report.csv', job_id=None, page=1)
+
+    assert export.pending
+    mock_redis_set.assert_called_once_with(
+        'service-{}-notifications-export-{}'.format(SERVICE_ONE_ID, export.id),
+        json.dumps({
+            'filename': 'report.csv',
+            'status': 'pending',
+            'started_at': 1577880000.0,
+            'updated_at': 1577880000.0,
+        }),
+        ex=86400,
+    )
+    mock_spawn.assert_called_once_with(ANY, app_, export, {'service_id': SERVICE_ONE_ID, 'job_id': None, 'page': 1})
+
+
+@pytest.mark.parametrize('status, time_now, expected_status', [
+    ('pending', 1_000_000 + 300, 'pending'),
+    ('pending', 1_000_000 + 301, 'failed'),
+    ('finished', 1_000_000 + 86400, 'finished'),
+])
+def test_pending_exports_fail_after_timeout(mocker, export, status, time_now, expected_status):
+    mocker.patch('app.models.notifications_export.time', return_value=time_now)
+    export._status = status
+    assert export.status == expected_status
+
+
+def test_pending_exports_time_out_from_when_they_were_last_updated(mocker, export):
+    mocker.patch('app.models.notifications_export.time', return_value=1_000_000 + 3600)
+    export.updated_at = 1_000_000 + 3500
+    assert export.status == 'pending'
+
+
+def test_write_to_s3_saves_export_while_it_is_being_written(app_, mocker, export):
+    mocker.patch('app.models.notifications_export.time', side_effect=[
+        1_000_000 + 29,  # first line, not due yet
+        1_000_000 + 30,  # second line, saved
+        1_000_000 + 30,  # updated_at
+        1_000_000 + 40,  # finished
+    ])
+    mock_redis_set = mocker.patch('app.extensions.RedisClient.set')
+    mocker.patch(
+        'app.models.notifications_export.generate_notifications_csv',
+        return_value=iter(['a,b\n', '1,2\n']),
+    )
+
+    def consume_chunks(chunks, **kwargs):
+        assert list(chunks) == [b'a,b\n', b'1,2\n']
+
+    mocker.patch('app.models.notifications_export.s3upload_multipart', side_effect=consume_chunks)
+
+    with app_.app_context():
+        export.write_to_s3({'service_id': SERVICE_ONE_ID})
+
+    assert [
+        json.loads(call[0][1]) for call in mock_redis_set.call_args_list
+    ] == [
+        {'filename': 'report.csv', 'status': 'pending', 'started_at': 1_000_000, 'updated_at': 1_000_030},
+        {'filename': 'report.csv', 'status': 'finished', 'started_at': 1_000_000, 'updated_at': 1_000_040},
+    ]
+
+
+def test_write_to_s3_uploads_csv_and_finishes(app_, mocker, export):
+    mocker.patch('app.models.notifications_export.time', return_value=1_000_000)
+    mock_redis_set = mocker.patch('app.extensions.RedisClient.set')
+    mock_generate = mocker.patch(
+        'app.models.notifications_export.generate_notifications_csv',
+        return_value=iter(['a,b\n', '1,2\n']),
+    )
+    mock_upload = mocker.patch('app.models.notifications_export.s3upload_multipart')
+
+    with app_.app_context():
+        export.write_to_s3({'service_id': SERVICE_ONE_ID, 'job_id': None})
+
+    mock_generate.assert_called_once_with(service_id=SERVICE_ONE_ID, job_id=None)
+    assert list(mock_upload.call_args[1]['chunks']) == [b'a,b\n', b'1,2\n']
+    assert mock_upload.call_args[1]['bucket_name'] == 'test-notifications-csv-upload'
+    assert mock_upload.call_args[1]['file_location'] == (
+        'service-{}-notify/notifications-exports/{}.csv'.format(SERVICE_ONE_ID, EXPORT_ID)
+    )
+    assert export.finished
+    assert json.loads(mock_redis_set.call_args[0][1])['status'] == 'finished'
+
+
+def test_write_to_s3_marks_export_as_failed(app_, mocker, export):
+    mocker.patch('app.models.notifications_export.time', return_value=1_000_000)
+    mock_redis_set = mocker.patch('app.extensions.RedisClient.set')
+    mocker.patch('app.models.notifications_export.generate_notifications_csv', return_value=iter(['a,b\n']))
+    mocker.patch('app.models.notifications_export.s3upload_multipart', side_effect=Exception('S3 is down'))
+
+    with app_.app_context():
+        export.write_to_s3({'service_id': SERVICE_ONE_ID})
+
+    assert export.failed
+    assert json.loads(mock_redis_set.call_args[0][1])['status'] == 'failed'
+
+
+def test_write_to_s3_deletes_old_exports(app_, mocker, export, mock_delete_old_exports):
+    mocker.patch('app.extensions.RedisClient.set')
+    mocker.patch('app.models.notifications_export.generate_notifications_csv', return_value=iter(['a,b\n']))
+    mock_upload = mocker.patch('app.models.notifications_export.s3upload_multipart')
+
+    with app_.app_context():
+        export.write_to_s3({'service_id': SERVICE_ONE_ID})
+
+    mock_delete_old_exports.assert_called_once_with(SERVICE_ONE_ID, 86400)
+    assert mock_upload.called
+
+
+def test_write_to_s3_still_exports_if_old_exports_cannot_be_deleted(app_, mocker, export, mock_delete_old_exports):
+    mocker.patch('app.extensions.RedisClient.set')
+    mocker.patch('app.models.notifications_export.generate_notifications_csv', return_value=iter(['a,b\n']))
+    mocker.patch('app.models.notifications_export.s3upload_multipart')
+    mock_delete_old_exports.side_effect = Exception('S3 is down')
+
+    with app_.app_context():
+        export.write_to_s3({'service_id': SERVICE_ONE_ID})
+
+    assert export.finished
+
+
+def test_export_is_deleted_from_s3_when_it_expires(app_, mocker, export):
+    mock_write_to_s3 = mocker.patch.object(export, 'write_to_s3')
+    mock_spawn_after = mocker.patch('app.models.notifications_export.spawn_after')
+
+    _write_to_s3(app_, export, {'service_id': SERVICE_ONE_ID})
+
+    mock_write_to_s3.assert_called_once_with({'service_id': SERVICE_ONE_ID})
+    mock_spawn_after.assert_called_once_with(86400, ANY, app_, export)
+
+    mock_delete = mocker.patch('app.models.notifications_export.delete_notifications_export')
+    delete_from_s3 = mock_spawn_after.call_args[0][1]
+    delete_from_s3(app_, export)
+
+    mock_delete.assert_called_once_with(SERVICE_ONE_ID, EXPORT_ID)
@@ -1,17 +1,37 @@
+import zlib
 from datetime import date
-from unittest.mock import patch
+from functools import partial
+from unittest.mock import Mock, call, patch
 
+import eventlet
 import pytest
 import werkzeug
+from flask import request, session
+from notifications_python_client.errors import HTTPError
 
+from app import (
+    current_service,
+    get_cache_keys_for_request,
+    prefetch_cache_before_request,
+)
 from app.models.service import Service
-from app.notify_client import NotifyAdminAPIClient
+from app.notify_client import (
+    NotifyAdminAPIClient,
+    RequestScopedRedisClient,
+    fetch_concurrently,
+    fetch_in_background,
+    get_request_memo,
+    stale_while_revalidate,
+)
 from app.notify_client.notification_api_client import notification_api_client
 from tests import service_json
 from tests.conftest import (
+    SERVICE_ONE_ID,
+    SERVICE_TWO_ID,
     create_api_user_active,
     create_platform_admin_user,
     set_config,
+    set_config_values,
 )
 
 
@@ -120,3 +140,493 @@ def test_get_notification_status_by_service(mocker):
         url='service/monthly-data-by-service',
         params={'start_date': '2019-04-01', 'end_date': '2019-04-30'}
     )
+
+
+def test_get_is_remembered_for_the_rest_of_the_request(app_):
+    api_client = NotifyAdminAPIClient()
+
+    with app_.test_request_context():
+        with patch.object(api_client, 'request', return_value={'data': 'foo'}) as request:
+            first = api_client.get('url', params={'a': 1})
+            first['data'] = 'changed by the caller'
+            second = api_client.get('url', params={'a': 1})
+
+    assert request.call_count == 1
+    assert second == {'data': 'foo'}
+
+
+@pytest.mark.parametrize('second_url, second_params', [
+    ('other-url', {'a': 1}),
+    ('url', {'a': 2}),
+    ('url', None),
+])
+def test_get_with_different_arguments_is_not_remembered(app_, second_url, second_params):
+    api_client = NotifyAdminAPIClient()
+
+    with app_.test_request_context():
+        with patch.object(api_client, 'request', return_value={}) as request:
+            api_client.get('url', params={'a': 1})
+            api_client.get(second_url, params=second_params)
+
+    assert request.call_count == 2
+
+
+def test_get_is_not_remembered_between_requests(app_):
+    api_client = NotifyAdminAPIClient()
+
+    with patch.object(api_client, 'request', return_value={}) as request:
+        for _ in range(2):
+            with app_.test_request_context():
+                api_client.get('url')
+
+    assert request.call_count == 2
+
+
+def test_get_is_not_remembered_outside_a_request(app_):
+    api_client = NotifyAdminAPIClient()
+
+    with patch.object(api_client, 'request', return_value={}) as request:
+        api_client.get('url')
+        api_client.get('url')
+
+    assert request.call_count == 2
+
+
+@pytest.mark.parametrize('method', [
+    'put',
+    'post',
+    'delete'
+])
+def test_changing_something_forgets_remembered_responses(app_, platform_admin_user, method):
+    api_client = NotifyAdminAPIClient()
+
+    with app_.test_request_context() as request_context, app_.test_client() as client:
+        client.login(platform_admin_user)
+        request_context.service = Service(service_json(active=True))
+
+        with patch.object(api_client, 'request', return_value={}) as request:
+            api_client.get('url')
+            getattr(api_client, method)('url', 'data')
+            api_client.get('url')
+            memo = get_request_memo()
+
+    assert request.call_args_list == [
+        call('GET', 'url', params=None),
+        call(method.upper(), 'url', data='data'),
+        call('GET', 'url', params=None),
+    ]
+    assert (memo.hits, memo.misses) == (0, 2)
+
+
+def test_request_memo_counts_hits_and_misses(app_):
+    api_client = NotifyAdminAPIClient()
+
+    with app_.test_request_context():
+        with patch.object(api_client, 'request', return_value={}):
+            api_client.get('url')
+            api_client.get('url')
+            api_client.get('url')
+            api_client.get('other-url')
+            memo = get_request_memo()
+
+    assert (memo.hits, memo.misses) == (2, 2)
+
+
+def test_fetch_concurrently_returns_results_by_name(app_):
+    with app_.test_request_context():
+        assert fetch_concurrently(
+            a=lambda: 1,
+            b=partial(dict, foo='bar'),
+        ) == {
+            'a': 1,
+            'b': {'foo': 'bar'},
+        }
+
+
+def test_fetch_concurrently_works_outside_a_request(app_):
+    assert fetch_concurrently(a=lambda: 1) == {'a': 1}
+
+
+def test_fetch_concurrently_shares_the_request_context(app_):
+    api_client = NotifyAdminAPIClient()
+
+    with app_.test_request_context('/some-path') as request_context:
+        request_context.service = Service(service_json(active=True))
+        with patch.object(api_client, 'request', return_value={}) as mock_request:
+            results = fetch_concurrently(
+                path=lambda: request.path,
+                service_name=lambda: current_service.name,
+                first=partial(api_client.get, 'url'),
+                second=partial(api_client.get, 'url'),
+            )
+            memo = get_request_memo()
+
+    assert results['path'] == '/some-path'
+    assert results['service_name'] == 'Test Service'
+    assert memo.hits + memo.misses == 2
+    assert mock_request.call_count == memo.misses
+
+
+def test_fetch_concurrently_raises_errors(app_):
+    def broken():
+        raise ValueError('oh no')
+
+    with app_.test_request_context():
+        with pytest.raises(ValueError) as exception:
+            fetch_concurrently(a=lambda: 1, b=broken)
+
+    assert str(exception.value) == 'oh no'
+
+
+def test_fetch_concurrently_makes_no_more_than_max_concurrency_calls_at_once(app_):
+    running, most_running = set(), set()
+
+    def call(name):
+        running.add(name)
+        if len(running) > len(most_running):
+            most_running.clear()
+            most_running.update(running)
+        eventlet.sleep(0)
+        running.remove(name)
+        return name
+
+    with app_.test_request_context():
+        results = fetch_concurrently(max_concurrency=2, **{str(i): partial(call, i) for i in range(5)})
+
+    assert results == {str(i): i for i in range(5)}
+    assert len(most_running) == 2
+
+
+def test_fetch_in_background_shares_the_request_context(app_):
+    with app_.test_request_context('/some-path'):
+        thread = fetch_in_background(lambda: request.path)
+        assert thread.wait() == '/some-path'
+
+
+def test_fetch_in_background_raises_errors_when_waited_for(app_):
+    def broken():
+        raise ValueError('oh no')
+
+    thread = fetch_in_background(broken)
+
+    with pytest.raises(ValueError) as exception:
+        thread.wait()
+
+    assert str(exception.value) == 'oh no'
+
+
+def test_request_scoped_redis_client_only_reads_each_key_once_per_request(app_):
+    redis = Mock(get=Mock(side_effect=[b'1', b'2', b'3']))
+    client = RequestScopedRedisClient(redis)
+
+    with app_.test_request_context():
+        assert [client.get('a'), client.get('a'), client.get('b')] == [b'1', b'1', b'2']
+
+    with app_.test_request_context():
+        assert client.get('a') == b'3'
+
+    assert redis.get.call_args_list == [call('a'), call('b'), call('a')]
+
+
+def test_request_scoped_redis_client_passes_through_outside_a_request(app_):
+    redis = Mock(get=Mock(side_effect=[b'1', b'2']))
+    client = RequestScopedRedisClient(redis)
+
+    assert [client.get('a'), client.get('a')] == [b'1', b'2']
+    client.set('a', 'value', ex=100)
+    client.delete('a', 'b')
+    client.incr('a')
+
+    assert redis.set.call_args_list == [call('a', 'value', ex=100)]
+    assert redis.delete.call_args_list == [call('a', 'b')]
+    assert redis.incr.call_args_list == [call('a')]
+
+
+def test_request_scoped_redis_client_prefetches_keys_in_one_go(app_):
+    redis = Mock(active=True)
+    redis.redis_store.mget.return_value = [b'1', None]
+    client = RequestScopedRedisClient(redis)
+
+    with app_.test_request_context():
+        client.prefetch('a', 'b')
+        assert client.get('a') == b'1'
+        assert client.get('b') is None
+
+    redis.redis_store.mget.assert_called_once_with(['a', 'b'])
+    assert not redis.get.called
+
+
+def test_request_scoped_redis_client_does_not_prefetch_if_redis_disabled(app_):
+    redis = Mock(active=False, get=Mock(return_value=b'1'))
+    client = RequestScopedRedisClient(redis)
+
+    with app_.test_request_context():
+        client.prefetch('a')
+        assert client.get('a') == b'1'
+
+    assert not redis.redis_store.mget.called
+
+
+def test_request_scoped_redis_client_carries_on_if_prefetch_fails(app_):
+    redis = Mock(active=True, get=Mock(return_value=b'1'))
+    redis.redis_store.mget.side_effect = ConnectionError
+    client = RequestScopedRedisClient(redis)
+
+    with app_.test_request_context():
+        client.prefetch('a')
+        assert client.get('a') == b'1'
+
+
+@pytest.mark.parametrize('method, args', [
+    ('set', ['a', 'new value']),
+    ('delete', ['b', 'a']),
+    ('delete_cache_keys_by_pattern', ['*']),
+])
+def test_request_scoped_redis_client_forgets_changed_keys(app_, method, args):
+    redis = Mock(get=Mock(side_effect=[b'1', b'2']))
+    client = RequestScopedRedisClient(redis)
+
+    with app_.test_request_context():
+        assert client.get('a') == b'1'
+        getattr(client, method)(*args)
+        assert client.get('a') == b'2'
+
+
+@pytest.mark.parametrize('url, endpoint, session_values, expected_keys', [
+    (
+        '/',
+        'main.index',
+        {},
+        [],
+    ),
+    (
+        '/',
+        'main.index',
+        {'user_id': 'abc'},
+        ['user-abc'],
+    ),
+    (
+        f'/services/{SERVICE_ONE_ID}/usage',
+        'main.usage',
+        {'user_id': 'abc'},
+        ['user-abc', f'service-{SERVICE_ONE_ID}', f'has_jobs-{SERVICE_ONE_ID}'],
+    ),
+    (
+        '/user-profile',
+        'main.user_profile',
+        {'user_id': 'abc', 'service_id': SERVICE_ONE_ID},
+        ['user-abc', f'service-{SERVICE_ONE_ID}', f'has_jobs-{SERVICE_ONE_ID}'],
+    ),
+    (
+        f'/services/{SERVICE_ONE_ID}/templates',
+        'main.choose_template',
+        {'user_id': 'abc'},
+        [
+            'user-abc',
+            f'service-{SERVICE_ONE_ID}',
+            f'has_jobs-{SERVICE_ONE_ID}',
+            f'service-{SERVICE_ONE_ID}-templates',
+            f'service-{SERVICE_ONE_ID}-template-folders',
+        ],
+    ),
+    (
+        f'/services/{SERVICE_ONE_ID}/send/{SERVICE_TWO_ID}/one-off',
+        'main.send_one_off',
+        {'user_id': 'abc'},
+        [
+            'user-abc',
+            f'service-{SERVICE_ONE_ID}',
+            f'has_jobs-{SERVICE_ONE_ID}',
+            f'service-{SERVICE_ONE_ID}-templates',
+            f'service-{SERVICE_ONE_ID}-template-folders',
+        ],
+    ),
+])
+def test_get_cache_keys_for_request(app_, url, endpoint, session_values, expected_keys):
+    with app_.test_request_context(url):
+        session.update(session_values)
+        assert request.endpoint == endpoint
+        assert list(get_cache_keys_for_request()) == expected_keys
+
+
+@pytest.mark.parametrize('url, expected_keys', [
+    ('/user-profile', ('user-abc',)),
+    ('/_status', None),
+    ('/static/images/favicon.ico', None),
+])
+def test_prefetch_cache_before_request_skips_requests_which_do_not_use_the_cache(app_, mocker, url, expected_keys):
+    mock_prefetch = mocker.patch('app.prefetch_cache_keys')
+
+    with app_.test_request_context(url):
+        session['user_id'] = 'abc'
+        prefetch_cache_before_request()
+
+    if expected_keys:
+        mock_prefetch.assert_called_once_with(*expected_keys)
+    else:
+        assert mock_prefetch.called is False
+
+
+def test_request_scoped_redis_client_counts_cache_operations_by_key_family(app_, mocker):
+    counters = {
+        name: mocker.patch('app.notify_client.{}'.format(name))
+        for name in ('CACHE_HITS', 'CACHE_MISSES', 'CACHE_SETS', 'CACHE_DELETES')
+    }
+    redis = Mock(active=True, get=Mock(side_effect=[b'1', None]))
+    client = RequestScopedRedisClient(redis)
+
+    client.get('user-1')
+    client.get('service-1-templates')
+    client.set('service-1-templates', 'value')
+    client.delete('service-1', 'email_branding')
+
+    assert counters['CACHE_HITS'].labels.call_args_list == [call('user')]
+    assert counters['CACHE_MISSES'].labels.call_args_list == [call('templates')]
+    assert counters['CACHE_SETS'].labels.call_args_list == [call('templates')]
+    assert counters['CACHE_DELETES'].labels.call_args_list == [call('service'), call('branding')]
+
+
+def test_request_scoped_redis_client_does_not_count_if_redis_disabled(app_, mocker):
+    mock_misses = mocker.patch('app.notify_client.CACHE_MISSES')
+    client = RequestScopedRedisClient(Mock(active=False, get=Mock(return_value=None)))
+
+    client.get('user-1')
+
+    assert not mock_misses.labels.called
+
+
+@pytest.fixture
+def slow_api_call(mocker):
+    api_call = Mock(return_value={'new': 'value'})
+
+    @stale_while_revalidate('slow-thing', refresh_after_seconds=60, expire_after_seconds=600)
+    def get_slow_thing(start_date, params=None):
+        return api_call(start_date, params=params)
+
+    get_slow_thing.api_call = api_call
+    return get_slow_thing
+
+
+@pytest.fixture
+def mock_redis_for_revalidation(mocker):
+    mocker.patch('app.notify_client.time', return_value=1000)
+    mock_redis_client = mocker.patch('app.notify_client.redis_client', active=True)
+    mock_cache = mocker.patch('app.notify_client.cache')
+    return mock_redis_client, mock_cache.redis_client
+
+
+def test_stale_while_revalidate_does_nothing_if_redis_disabled(app_, mocker, slow_api_call):
+    mocker.patch('app.notify_client.redis_client', active=False)
+    mock_cache = mocker.patch('app.notify_client.cache')
+
+    assert slow_api_call(date(2020, 1, 1)) == {'new': 'value'}
+    assert not mock_cache.redis_client.get.called
+
+
+def test_stale_while_revalidate_fetches_and_caches_if_nothing_cached(
+    app_, slow_api_call, mock_redis_for_revalidation
+):
+    _, mock_cache_client = mock_redis_for_revalidation
+    mock_cache_client.get.return_value = None
+
+    assert slow_api_call(date(2020, 1, 1), params={'b': 1, 'a': 2}) == {'new': 'value'}
+
+    key = 'slow-thing-{"params": {"a": 2, "b": 1}, "start_date": "2020-01-01"}'
+    mock_cache_client.get.assert_called_once_with(key)
+    mock_cache_client.set.assert_called_once_with(
+        key, '{"value": {"new": "value"}, "refresh_after": 1060}', ex=600,
+    )
+
+
+def test_stale_while_revalidate_returns_fresh_value_from_cache(
+    app_, mocker, slow_api_call, mock_redis_for_revalidation
+):
+    mock_redis_client, mock_cache_client = mock_redis_for_revalidation
+    mock_cache_client.get.return_value = b'{"value": {"old": "value"}, "refresh_after": 1001}'
+    mock_spawn = mocker.patch('app.notify_client.spawn_n')
+
+    assert slow_api_call(date(2020, 1, 1)) == {'old': 'value'}
+
+    assert not slow_api_call.api_call.called
+    assert not mock_redis_client.acquire_lock.called
+    assert not mock_spawn.called
+
+
+@pytest.mark.parametrize('got_lock', [True, False])
+def test_stale_while_revalidate_returns_stale_value_and_refreshes_it_once(
+    app_, mocker, slow_api_call, mock_redis_for_revalidation, got_lock
+):
+    mock_redis_client, mock_cache_client = mock_redis_for_revalidation
+    mock_redis_client.acquire_lock.return_value = got_lock
+    mock_cache_client.get.return_value = b'{"value": {"old": "value"}, "refresh_after": 1000}'
+    mock_spawn = mocker.patch('app.notify_client.spawn_n')
+
+    assert slow_api_call(date(2020, 1, 1)) == {'old': 'value'}
+
+    assert not slow_api_call.api_call.called
+    mock_redis_client.acquire_lock.assert_called_once_with(
+        'slow-thing-{"params": null, "start_date": "2020-01-01"}', 60
+    )
+    assert mock_spawn.called is got_lock
+
+
+@pytest.mark.parametrize('api_error, expected_sets', [
+    (None, 1),
+    (HTTPError(), 0),
+])
+def test_stale_while_revalidate_refreshes_in_background_and_releases_lock(
+    app_, mocker, slow_api_call, mock_redis_for_revalidation, api_error, expected_sets
+):
+    mock_redis_client, mock_cache_client = mock_redis_for_revalidation
+    mock_cache_client.get.return_value = b'{"value": {"old": "value"}, "refresh_after": 1000}'
+    mock_spawn = mocker.patch('app.notify_client.spawn_n')
+    slow_api_call.api_call.side_effect = api_error
+
+    slow_api_call(date(2020, 1, 1))
+    refresh, *refresh_args = mock_spawn.call_args[0]
+    refresh(*refresh_args)
+
+    slow_api_call.api_call.assert_called_once_with(date(2020, 1, 1), params=None)
+    assert mock_cache_client.set.call_count == expected_sets
+    mock_redis_client.release_lock.assert_called_once_with(
+        'slow-thing-{"params": null, "start_date": "2020-01-01"}'
+    )
+
+
+@pytest.mark.parametrize('compression_enabled, value, expected_value_in_redis', [
+    (False, 'x' * 100, 'x' * 100),
+    (True, 'x' * 99, b'x' * 99),
+    (True, 'x' * 100, b'zlib:' + zlib.compress(b'x' * 100)),
+])
+def test_request_scoped_redis_client_compresses_big_values(
+    app_, compression_enabled, value, expected_value_in_redis
+):
+    redis = Mock()
+    client = RequestScopedRedisClient(redis)
+
+    with set_config_values(app_, {
+        'CACHE_COMPRESSION_ENABLED': compression_enabled,
+        'CACHE_COMPRESSION_THRESHOLD_IN_BYTES': 100,
+    }):
+        client.set('service-1-templates', value, ex=100)
+
+    redis.set.assert_called_once_with('service-1-templates', expected_value_in_redis, ex=100)
+
+
+@pytest.mark.parametrize('value_in_redis, expected_value', [
+    (None, None),
+    (b'{"data": []}', b'{"data": []}'),
+    (b'zlib:' + zlib.compress(b'{"data": []}'), b'{"data": []}'),
+])
+def test_request_scoped_redis_client_reads_compressed_and_uncompressed_values(
+    app_, value_in_redis, expected_value
+):
+    redis = Mock(active=True, get=Mock(return_value=value_in_redis))
+    redis.redis_store.mget.return_value = [value_in_redis]
+    client = RequestScopedRedisClient(redis)
+
+    assert client.get('service-1-templates') == expected_value
+
+    with app_.test_request_context():
+        client.prefetch('service-1-templates')
+        assert client.get('service-1-templates') == expected_value
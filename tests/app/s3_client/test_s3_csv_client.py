@@ -1,6 +1,18 @@
+from datetime import datetime, timezone
+from io import BytesIO
 from unittest.mock import Mock
 
-from app.s3_client.s3_csv_client import set_metadata_on_csv_upload
+import pytest
+from botocore.response import StreamingBody
+from freezegun import freeze_time
+
+from app.s3_client.s3_csv_client import (
+    delete_notifications_exports_older_than,
+    join_into_parts,
+    s3download_lines,
+    s3upload,
+    set_metadata_on_csv_upload,
+)
 
 
 def test_sets_metadata(client, mocker):
@@ -19,3 +31,118 @@ def test_sets_metadata(client, mocker):
         MetadataDirective='REPLACE',
         ServerSideEncryption='AES256',
     )
+
+
+def test_s3download_lines_reads_file_in_chunks(client, mocker):
+    file_contents = 'phone number,name\r\n07700900001,🐝\r\n07700900002,Zoë\r\n'.encode('utf-8')
+    mocker.patch('app.s3_client.s3_csv_client.DOWNLOAD_CHUNK_SIZE_IN_BYTES', 5)
+    mocked_s3_object = Mock()
+    mocked_s3_object.get.return_value = {'Body': StreamingBody(BytesIO(file_contents), len(file_contents))}
+    mocker.patch('app.s3_client.s3_csv_client.get_csv_upload', return_value=mocked_s3_object)
+
+    assert list(s3download_lines('1234', '5678')) == [
+        'phone number,name',
+        '07700900001,🐝',
+        '07700900002,Zoë',
+    ]
+
+
+@pytest.mark.parametrize('chunks, expected_parts', [
+    ([], [b'']),
+    ([b'ab', b'cd', b'e'], [b'abcd', b'e']),
+    ([b'abcde', b'f'], [b'abcde', b'f']),
+    ([b'ab', b'cd'], [b'abcd']),
+])
+def test_join_into_parts(chunks, expected_parts):
+    assert list(join_into_parts(iter(chunks), part_size=4)) == expected_parts
+
+
+def test_s3upload_uploads_streamed_data_in_parts(client, mocker):
+    mocker.patch('app.s3_client.s3_csv_client.MULTIPART_UPLOAD_PART_SIZE_IN_BYTES', 4)
+    mock_resource = mocker.patch('app.s3_client.s3_csv_client.resource')
+    mock_multipart_upload = mock_resource.return_value.Object.return_value.initiate_multipart_upload.return_value
+    mock_multipart_upload.Part.return_value.upload.side_effect = [{'ETag': 'one'}, {'ETag': 'two'}]
+    mock_utils_s3upload = mocker.patch('app.s3_client.s3_csv_client.utils_s3upload')
+
+    upload_id = s3upload('1234', {'data': iter([b'ab', b'cd', b'e'])}, 'eu-west-1')
+
+    mock_resource.assert_called_once_with('s3', region_name='eu-west-1')
+    mock_resource.return_value.Object.assert_called_once_with(
+        'test-notifications-csv-upload', 'service-1234-notify/{}.csv'.format(upload_id)
+    )
+    assert [call[1] for call in mock_multipart_upload.Part.return_value.upload.call_args_list] == [
+        {'Body': b'abcd'},
+        {'Body': b'e'},
+    ]
+    mock_multipart_upload.complete.assert_called_once_with(MultipartUpload={'Parts': [
+        {'PartNumber': 1, 'ETag': 'one'},
+        {'PartNumber': 2, 'ETag': 'two'},
+    ]})
+    assert mock_multipart_upload.abort.called is False
+    assert mock_utils_s3upload.called is False
+
+
+def test_s3upload_uploads_streamed_data_smaller_than_a_part_in_one_request(client, mocker):
+    mocker.patch('app.s3_client.s3_csv_client.MULTIPART_UPLOAD_PART_SIZE_IN_BYTES', 4)
+    mock_resource = mocker.patch('app.s3_client.s3_csv_client.resource')
+    mock_utils_s3upload = mocker.patch('app.s3_client.s3_csv_client.utils_s3upload')
+
+    upload_id = s3upload('1234', {'data': iter([b'ab', b'c'])}, 'eu-west-1')
+
+    mock_utils_s3upload.assert_called_once_with(
+        filedata=b'abc',
+        region='eu-west-1',
+        bucket_name='test-notifications-csv-upload',
+        file_location='service-1234-notify/{}.csv'.format(upload_id),
+    )
+    assert mock_resource.called is False
+
+
+def test_s3upload_does_not_upload_streamed_data_smaller_than_a_part_if_it_cant_be_read(client, mocker):
+    mock_resource = mocker.patch('app.s3_client.s3_csv_client.resource')
+    mock_utils_s3upload = mocker.patch('app.s3_client.s3_csv_client.utils_s3upload')
+
+    def bad_data():
+        yield b'ab'
+        raise UnicodeDecodeError('utf-8', b'', 0, 1, 'invalid start byte')
+
+    with pytest.raises(UnicodeDecodeError):
+        s3upload('1234', {'data': bad_data()}, 'eu-west-1')
+
+    assert mock_resource.called is False
+    assert mock_utils_s3upload.called is False
+
+
+def test_s3upload_aborts_streamed_upload_if_data_cant_be_read(client, mocker):
+    mocker.patch('app.s3_client.s3_csv_client.MULTIPART_UPLOAD_PART_SIZE_IN_BYTES', 4)
+    mock_resource = mocker.patch('app.s3_client.s3_csv_client.resource')
+    mock_multipart_upload = mock_resource.return_value.Object.return_value.initiate_multipart_upload.return_value
+    mock_multipart_upload.Part.return_value.upload.return_value = {'ETag': 'one'}
+
+    def bad_data():
+        yield b'abcd'
+        yield b'efgh'
+        yield b'ij'
+        raise UnicodeDecodeError('utf-8', b'', 0, 1, 'invalid start byte')
+
+    with pytest.raises(UnicodeDecodeError):
+        s3upload('1234', {'data': bad_data()}, 'eu-west-1')
+
+    assert mock_multipart_upload.complete.called is False
+    mock_multipart_upload.abort.assert_called_once_with()
+
+
+def test_delete_notifications_exports_older_than(client, mocker):
+    mock_resource = mocker.patch('app.s3_client.s3_csv_client.resource')
+    old_export = Mock(last_modified=datetime(2020, 1, 1, 10, 59, tzinfo=timezone.utc))
+    new_export = Mock(last_modified=datetime(2020, 1, 1, 11, 30, tzinfo=timezone.utc))
+    mock_bucket = mock_resource.return_value.Bucket.return_value
+    mock_bucket.objects.filter.return_value = [old_export, new_export]
+
+    with freeze_time('2020-01-01 12:00'):
+        delete_notifications_exports_older_than('1234', 3600)
+
+    mock_resource.return_value.Bucket.assert_called_once_with('test-notifications-csv-upload')
+    mock_bucket.objects.filter.assert_called_once_with(Prefix='service-1234-notify/notifications-exports/')
+    old_export.delete.assert_called_once_with()
+    assert new_export.delete.called is False
@@ -0,0 +1,338 @@
+import json
+from unittest.mock import Mock, call
+
+import pytest
+
+from app.extensions import (
+    NotifyAdminRedisClient,
+    get_cache_key_family,
+    get_cache_key_tags,
+    is_cache_key_tag,
+)
+from app.local_cache import LocalCache
+
+
+@pytest.fixture
+def redis_client_with_local_cache(mocker):
+    client = NotifyAdminRedisClient()
+    client.local_cache = LocalCache(maxsize=10, ttl=60)
+    client._listener = Mock(is_alive=Mock(return_value=True))
+    mocker.patch.object(client, 'redis_store')
+    return client
+
+
+def test_local_cache_keys_are_only_read_from_redis_once(mocker, redis_client_with_local_cache):
+    mock_redis_get = mocker.patch('app.extensions.RedisClient.get', side_effect=[b'1', b'2', b'3'])
+
+    assert redis_client_with_local_cache.get('organisations') == b'1'
+    assert redis_client_with_local_cache.get('organisations') == b'1'
+    assert redis_client_with_local_cache.get('service-1234') == b'2'
+    assert redis_client_with_local_cache.get('service-1234') == b'3'
+
+    assert mock_redis_get.call_args_list == [
+        call('organisations'),
+        call('service-1234'),
+        call('service-1234'),
+    ]
+
+
+def test_local_cache_is_not_used_if_listener_has_stopped(mocker, redis_client_with_local_cache):
+    mock_redis_get = mocker.patch('app.extensions.RedisClient.get', side_effect=[b'1', b'2'])
+
+    assert redis_client_with_local_cache.get('domains') == b'1'
+    redis_client_with_local_cache._listener.is_alive.return_value = False
+    assert redis_client_with_local_cache.get('domains') == b'2'
+
+    assert mock_redis_get.call_count == 2
+    assert redis_client_with_local_cache.local_cache.get('domains') is None
+
+
+def test_local_cache_is_not_used_if_not_enabled(mocker):
+    client = NotifyAdminRedisClient()
+    mock_redis_get = mocker.patch('app.extensions.RedisClient.get', side_effect=[b'1', b'2'])
+
+    assert client.get('organisations') == b'1'
+    assert client.get('organisations') == b'2'
+    assert mock_redis_get.call_count == 2
+
+
+def test_deleting_local_cache_keys_tells_other_workers(mocker, redis_client_with_local_cache):
+    mocker.patch('app.extensions.RedisClient.delete')
+    redis_client_with_local_cache.local_cache.set('organisations', b'1')
+
+    redis_client_with_local_cache.delete('organisations', 'service-1234')
+
+    assert redis_client_with_local_cache.local_cache.get('organisations') is None
+    redis_client_with_local_cache.redis_store.publish.assert_called_once_with(
+        'admin-local-cache-invalidation',
+        json.dumps({'keys': ['organisations']}),
+    )
+
+
+def test_deleting_other_keys_does_not_tell_other_workers(mocker, redis_client_with_local_cache):
+    mocker.patch('app.extensions.RedisClient.delete')
+
+    redis_client_with_local_cache.delete('service-1234')
+
+    assert not redis_client_with_local_cache.redis_store.publish.called
+
+
+def test_deleting_by_pattern_tells_other_workers(mocker, redis_client_with_local_cache):
+    mocker.patch('app.extensions.RedisClient.delete_cache_keys_by_pattern', return_value=1)
+    redis_client_with_local_cache.local_cache.set('letter_branding-1234', b'1')
+
+    assert redis_client_with_local_cache.delete_cache_keys_by_pattern('letter_branding-????') == 1
+
+    assert redis_client_with_local_cache.local_cache.get('letter_branding-1234') is None
+    redis_client_with_local_cache.redis_store.publish.assert_called_once_with(
+        'admin-local-cache-invalidation',
+        json.dumps({'pattern': 'letter_branding-????'}),
+    )
+
+
+@pytest.mark.parametrize('message_data, expected_remaining_keys', [
+    (b'{"keys": ["organisations"]}', {'domains'}),
+    (b'{"pattern": "d*"}', {'organisations'}),
+])
+def test_invalidation_messages_from_other_workers_forget_keys(
+    redis_client_with_local_cache,
+    message_data,
+    expected_remaining_keys,
+):
+    for key in ('organisations', 'domains'):
+        redis_client_with_local_cache.local_cache.set(key, b'1')
+
+    redis_client_with_local_cache._handle_invalidation_message({'data': message_data})
+
+    assert {
+        key for key in ('organisations', 'domains')
+        if redis_client_with_local_cache.local_cache.get(key)
+    } == expected_remaining_keys
+
+
+@pytest.mark.parametrize('key, expected_tags', [
+    ('organisations', {'organisations'}),
+    ('user-7b395b52-c6c1-469c-9d61-54166461c1ab', {'user-????????-????-????-????-????????????'}),
+    ('service-7b395b52-c6c1-469c-9d61-54166461c1ab-templates', {
+        'service-????????-????-????-????-????????????-templates',
+    }),
+    ('service-7b395b52-c6c1-469c-9d61-54166461c1ab-template-folders', {
+        'service-????????-????-????-????-????????????-template-folders',
+        'service-7b395b52-c6c1-469c-9d61-54166461c1ab-template-*',
+    }),
+    ('service-7b395b52-c6c1-469c-9d61-54166461c1ab-template-5d729fbd-239c-44ab-b498-75a985f3198f-version-None', {
+        'service-????????-????-????-????-????????????-template-????????-????-????-????-????????????-version-*',
+        'service-7b395b52-c6c1-469c-9d61-54166461c1ab-template-*',
+    }),
+    ('service-7b395b52-c6c1-469c-9d61-54166461c1ab-letter-upload-5d729fbd-239c-44ab-b498-75a985f3198f-page-2', {
+        'service-????????-????-????-????-????????????-letter-upload-????????-????-????-????-????????????-page-*',
+    }),
+    ('something-else', set()),
+])
+def test_get_cache_key_tags(key, expected_tags):
+    assert get_cache_key_tags(key) == expected_tags
+
+
+@pytest.mark.parametrize('pattern, expected_result', [
+    ('domains', True),
+    ('service-????????-????-????-????-????????????-templates', True),
+    ('service-7b395b52-c6c1-469c-9d61-54166461c1ab-template-*', True),
+    ('service-7b395b52-c6c1-469c-9d61-54166461c1ab-*', False),
+    ('*', False),
+])
+def test_is_cache_key_tag(pattern, expected_result):
+    assert is_cache_key_tag(pattern) == expected_result
+
+
+@pytest.fixture
+def active_redis_client(mocker):
+    client = NotifyAdminRedisClient()
+    client.active = True
+    mocker.patch.object(client, 'redis_store')
+    return client
+
+
+def test_setting_a_key_adds_it_to_its_tags(mocker, active_redis_client):
+    mock_redis_set = mocker.patch('app.extensions.RedisClient.set')
+    mocker.patch('app.extensions.time', return_value=1_000)
+
+    active_redis_client.set('service-7b395b52-c6c1-469c-9d61-54166461c1ab-template-folders', 'value', ex=100)
+
+    mock_redis_set.assert_called_once_with(
+        'service-7b395b52-c6c1-469c-9d61-54166461c1ab-template-folders', 'value', ex=100
+    )
+    pipeline = active_redis_client.redis_store.pipeline.return_value
+    assert sorted(pipeline.zadd.call_args_list) == [
+        call(
+            'cache-tag:service-7b395b52-c6c1-469c-9d61-54166461c1ab-template-*',
+            {'service-7b395b52-c6c1-469c-9d61-54166461c1ab-template-folders': 1_100},
+        ),
+        call(
+            'cache-tag:service-????????-????-????-????-????????????-template-folders',
+            {'service-7b395b52-c6c1-469c-9d61-54166461c1ab-template-folders': 1_100},
+        ),
+    ]
+    tag_keys = [args[0] for args, _kwargs in pipeline.zadd.call_args_list]
+    assert pipeline.zremrangebyscore.call_args_list == [
+        call(tag_key, '-inf', 1_000) for tag_key in tag_keys
+    ]
+    assert pipeline.expire.call_args_list == [
+        call(tag_key, 604800) for tag_key in tag_keys
+    ]
+    pipeline.execute.assert_called_once_with()
+
+
+def test_tags_last_as_long_as_keys_with_longer_ttls(mocker, active_redis_client):
+    mocker.patch('app.extensions.RedisClient.set')
+
+    active_redis_client.set('organisations', 'value', ex=1_000_000)
+
+    pipeline = active_redis_client.redis_store.pipeline.return_value
+    pipeline.expire.assert_called_once_with('cache-tag:organisations', 1_000_000)
+
+
+def test_keys_without_a_ttl_are_never_pruned_from_their_tags(mocker, active_redis_client):
+    mocker.patch('app.extensions.RedisClient.set')
+
+    active_redis_client.set('organisations', 'value')
+
+    pipeline = active_redis_client.redis_store.pipeline.return_value
+    pipeline.zadd.assert_called_once_with('cache-tag:organisations', {'organisations': float('inf')})
+    pipeline.expire.assert_called_once_with('cache-tag:organisations', 604800)
+
+
+def test_deleting_a_key_removes_it_from_its_tags(mocker, active_redis_client):
+    mocker.patch('app.extensions.RedisClient.delete')
+
+    active_redis_client.delete('organisations', 'user-1234')
+
+    pipeline = active_redis_client.redis_store.pipeline.return_value
+    pipeline.zrem.assert_called_once_with('cache-tag:organisations', 'organisations')
+    pipeline.execute.assert_called_once_with()
+
+
+def test_setting_a_key_does_not_tag_it_if_redis_disabled(mocker):
+    client = NotifyAdminRedisClient()
+    mocker.patch.object(client, 'redis_store')
+    mocker.patch('app.extensions.RedisClient.set')
+
+    client.set('organisations', 'value')
+
+    assert not client.redis_store.pipeline.called
+
+
+def test_delete_by_pattern_uses_tag_once_tags_are_complete(mocker, active_redis_client):
+    mocker.patch('app.extensions.RedisClient.get', return_value=b'true')
+    mock_scan_and_delete = mocker.patch('app.extensions.RedisClient.delete_cache_keys_by_pattern')
+    mocker.patch('app.extensions.time', return_value=1_000)
+    active_redis_client.redis_store.zrangebyscore.return_value = [b'service-1-template-a', b'service-1-template-b']
+    pipeline = active_redis_client.redis_store.pipeline.return_value
+    pipeline.execute.return_value = [2, 2, 1]
+
+    assert active_redis_client.delete_cache_keys_by_pattern(
+        'service-7b395b52-c6c1-469c-9d61-54166461c1ab-template-*'
+    ) == 2
+
+    active_redis_client.redis_store.zrangebyscore.assert_called_once_with(
+        'cache-tag:service-7b395b52-c6c1-469c-9d61-54166461c1ab-template-*', 1_000, '+inf'
+    )
+    pipeline.delete.assert_called_once_with(b'service-1-template-a', b'service-1-template-b')
+    pipeline.zrem.assert_called_once_with(
+        'cache-tag:service-7b395b52-c6c1-469c-9d61-54166461c1ab-template-*',
+        b'service-1-template-a',
+        b'service-1-template-b',
+    )
+    pipeline.zremrangebyscore.assert_called_once_with(
+        'cache-tag:service-7b395b52-c6c1-469c-9d61-54166461c1ab-template-*', '-inf', 1_000
+    )
+    assert not mock_scan_and_delete.called
+
+
+def test_delete_by_pattern_with_empty_tag_does_nothing(mocker, active_redis_client):
+    mocker.patch('app.extensions.RedisClient.get', return_value=b'true')
+    mocker.patch('app.extensions.time', return_value=1_000)
+    active_redis_client.redis_store.zrangebyscore.return_value = []
+
+    assert active_redis_client.delete_cache_keys_by_pattern('domains') == 0
+    assert not active_redis_client.redis_store.pipeline.called
+    active_redis_client.redis_store.zremrangebyscore.assert_called_once_with('cache-tag:domains', '-inf', 1_000)
+
+
+@pytest.mark.parametrize('tags_complete, pattern', [
+    (None, 'domains'),
+    (b'true', 'service-*'),
+])
+def test_delete_by_pattern_scans_if_tag_cannot_be_used(mocker, active_redis_client, tags_complete, pattern):
+    mocker.patch('app.extensions.RedisClient.get', return_value=tags_complete)
+    mock_scan_and_delete = mocker.patch('app.extensions.RedisClient.delete_cache_keys_by_pattern', return_value=3)
+
+    assert active_redis_client.delete_cache_keys_by_pattern(pattern) == 3
+
+    mock_scan_and_delete.assert_called_once_with(pattern)
+    assert not active_redis_client.redis_store.zrangebyscore.called
+
+
+def test_tag_existing_keys(mocker, active_redis_client):
+    mocker.patch('app.extensions.time', return_value=1_000)
+    active_redis_client.redis_store.scan_iter.side_effect = lambda pattern: {
+        'domains': [b'domains'],
+        'organisations': [b'organisations'],
+        'email_branding': [b'email_branding'],
+    }.get(pattern, [])
+    active_redis_client.redis_store.ttl.side_effect = lambda key: {
+        'domains': 100,
+        'organisations': -1,
+        'email_branding': -2,
+    }[key]
+
+    active_redis_client.tag_existing_keys()
+
+    pipeline = active_redis_client.redis_store.pipeline.return_value
+    assert pipeline.zadd.call_args_list == [
+        call('cache-tag:organisations', {'organisations': float('inf')}),
+        call('cache-tag:domains', {'domains': 1_100}),
+    ]
+    active_redis_client.redis_store.set.assert_called_once_with('cache-tags-complete', b'true')
+
+
+@pytest.mark.parametrize('keys, expected_family', [
+    (['user-7b395b52-c6c1-469c-9d61-54166461c1ab'], 'user'),
+    (['service-7b395b52-c6c1-469c-9d61-54166461c1ab'], 'service'),
+    (['service-7b395b52-c6c1-469c-9d61-54166461c1ab-templates'], 'templates'),
+    (['service-7b395b52-c6c1-469c-9d61-54166461c1ab-template-folders'], 'template-folders'),
+    (['service-????????-????-????-????-????????????-template-????????-????-????-????-????????????-version-*'], (
+        'template-version'
+    )),
+    (['service-1-checked-upload-2-template-3-version-4'], 'checked-upload'),
+    (['template-preview-2c26b46b68ffc68ff99b453c1d30413413422d706483bfa0f98a5e886266e7ae'], 'template-preview'),
+    (['letter-page-count-2c26b46b68ffc68ff99b453c1d30413413422d706483bfa0f98a5e886266e7ae'], 'letter-page-count'),
+    (['email_branding', 'letter_branding-7b395b52-c6c1-469c-9d61-54166461c1ab'], 'branding'),
+    (['user-7b395b52-c6c1-469c-9d61-54166461c1ab', 'domains'], 'multiple'),
+    (['something-else'], 'other'),
+])
+def test_get_cache_key_family(keys, expected_family):
+    assert get_cache_key_family(*keys) == expected_family
+
+
+def test_requests_to_redis_are_timed_by_key_family(mocker, active_redis_client):
+    mocker.patch('app.extensions.RedisClient.get', return_value=b'1')
+    mock_histogram = mocker.patch('app.extensions.REDIS_REQUEST_DURATION_SECONDS')
+
+    assert active_redis_client.get('user-7b395b52-c6c1-469c-9d61-54166461c1ab') == b'1'
+
+    mock_histogram.labels.assert_called_once_with('get', 'user')
+    assert mock_histogram.labels.return_value.observe.call_count == 1
+
+
+@pytest.mark.parametrize('set_result, expected_result', [
+    (True, True),
+    (None, False),
+])
+def test_acquire_lock(active_redis_client, set_result, expected_result):
+    active_redis_client.redis_store.set.return_value = set_result
+
+    assert active_redis_client.acquire_lock('platform-stats-{}', 60) is expected_result
+
+    active_redis_client.redis_store.set.assert_called_once_with(
+        'lock:platform-stats-{}', b'locked', nx=True, ex=60
+    )
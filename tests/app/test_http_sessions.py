@@ -0,0 +1,69 @@
+from unittest.mock import Mock
+
+import pytest
+
+from app.http_sessions import HTTPSessions
+
+
+@pytest.fixture
+def http_sessions():
+    http_sessions = HTTPSessions()
+    http_sessions.init_app(Mock(config={
+        'HTTP_POOL_MAX_SIZE': 3,
+        'HTTP_KEEP_ALIVE': True,
+        'HTTP_CONNECT_TIMEOUT_IN_SECONDS': 5,
+        'HTTP_READ_TIMEOUT_IN_SECONDS': None,
+    }))
+    return http_sessions
+
+
+def test_one_session_is_kept_per_host(http_sessions):
+    api_session = http_sessions.get_session('https://api.example.com/service/1234')
+
+    assert http_sessions.get_session('https://api.example.com/user/5678') is api_session
+    assert http_sessions.get_session('http://api.example.com/user/5678') is not api_session
+    assert http_sessions.get_session('https://template-preview.example.com/preview.pdf') is not api_session
+
+
+def test_sessions_use_configured_pool_size(http_sessions):
+    adapter = http_sessions.get_session('https://api.example.com').get_adapter('https://api.example.com')
+
+    assert adapter._pool_maxsize == 3
+    assert adapter._pool_block is False
+
+
+@pytest.mark.parametrize('kwargs, expected_timeout', [
+    ({}, (5, None)),
+    ({'timeout': 30}, 30),
+])
+def test_request_uses_default_timeouts(mocker, http_sessions, kwargs, expected_timeout):
+    mock_request = mocker.patch('requests.Session.request')
+
+    http_sessions.post('https://api.example.com/thing', data='1', **kwargs)
+
+    mock_request.assert_called_once_with('POST', 'https://api.example.com/thing', data='1', timeout=expected_timeout)
+
+
+def test_connections_are_closed_if_keep_alive_is_off(http_sessions):
+    http_sessions.keep_alive = False
+
+    assert http_sessions.get_session('https://api.example.com').headers['Connection'] == 'close'
+
+
+def test_get_stats(http_sessions):
+    assert http_sessions.get_stats() == {}
+
+    adapter = http_sessions.get_session('https://api.example.com').get_adapter('https://api.example.com')
+    pool = adapter.poolmanager.connection_from_url('https://api.example.com')
+    pool.num_connections, pool.num_requests = 2, 10
+    pool.pool.get()
+    pool.pool.put(Mock())
+
+    assert http_sessions.get_stats() == {
+        'https://api.example.com': {
+            'pool_max_size': 3,
+            'connections_made': 2,
+            'requests_made': 10,
+            'idle_connections': 1,
+        },
+    }
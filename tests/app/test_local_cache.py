@@ -0,0 +1,47 @@
+from app.local_cache import LocalCache
+
+
+class FakeTimer:
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+def test_local_cache_expires_values():
+    timer = FakeTimer()
+    local_cache = LocalCache(maxsize=10, ttl=60, timer=timer)
+    local_cache.set('a', b'1')
+
+    timer.now = 59
+    assert local_cache.get('a') == b'1'
+
+    timer.now = 61
+    assert local_cache.get('a') is None
+
+
+def test_local_cache_drops_least_recently_used_values_when_full():
+    local_cache = LocalCache(maxsize=2, ttl=60)
+    local_cache.set('a', b'1')
+    local_cache.set('b', b'2')
+    local_cache.get('a')
+    local_cache.set('c', b'3')
+
+    assert local_cache.get('a') == b'1'
+    assert local_cache.get('b') is None
+    assert local_cache.get('c') == b'3'
+
+
+def test_local_cache_forgets_keys_matching_pattern():
+    local_cache = LocalCache(maxsize=10, ttl=60)
+    local_cache.set('email_branding', b'1')
+    local_cache.set('email_branding-1234', b'2')
+    local_cache.set('letter_branding-1234', b'3')
+
+    local_cache.forget_matching('email_branding-????')
+
+    assert local_cache.get('email_branding') == b'1'
+    assert local_cache.get('email_branding-1234') is None
+    assert local_cache.get('letter_branding-1234') == b'3'
@@ -1,15 +1,22 @@
 import base64
+import hashlib
 from functools import partial
+from io import BytesIO
 from unittest.mock import Mock
 
 import pytest
+from notifications_utils.pdf import pdf_page_count
 from notifications_utils.template import LetterPreviewTemplate
 
 from app.template_previews import (
     TemplatePreview,
+    _get_page_count_cache_key,
+    extract_pages_from_pdf,
     get_page_count_for_letter,
+    page_count_cache,
     sanitise_letter,
 )
+from tests.conftest import set_config
 
 
 @pytest.mark.parametrize('partial_call, expected_page_argument', [
@@ -59,7 +66,7 @@ def test_from_database_object_makes_request(
     mock_get_service_letter_template
 ):
     resp = Mock(content='a', status_code='b', headers={'c': 'd'})
-    request_mock = mocker.patch('app.template_previews.requests.post', return_value=resp)
+    request_mock = mocker.patch('app.template_previews.http_sessions.post', return_value=resp)
     mocker.patch('app.template_previews.current_service', letter_branding=letter_branding)
     template = mock_get_service_letter_template('123', '456')['data']
 
@@ -87,7 +94,7 @@ def test_from_database_object_makes_request(
 def test_from_valid_pdf_file_makes_request(mocker, page_number, expected_url):
     mocker.patch('app.template_previews.extract_page_from_pdf', return_value=b'pdf page')
     request_mock = mocker.patch(
-        'app.template_previews.requests.post',
+        'app.template_previews.http_sessions.post',
         return_value=Mock(content='a', status_code='b', headers={'c': 'd'})
     )
 
@@ -104,7 +111,7 @@ def test_from_valid_pdf_file_makes_request(mocker, page_number, expected_url):
 def test_from_invalid_pdf_file_makes_request(mocker):
     mocker.patch('app.template_previews.extract_page_from_pdf', return_value=b'pdf page')
     request_mock = mocker.patch(
-        'app.template_previews.requests.post',
+        'app.template_previews.http_sessions.post',
         return_value=Mock(content='a', status_code='b', headers={'c': 'd'})
     )
 
@@ -136,6 +143,7 @@ def test_page_count_returns_none_for_non_letter_templates(template_type):
     ),
 ])
 def test_page_count_unpacks_from_json_response(
+    app_,
     mocker,
     partial_call,
     expected_template_preview_args,
@@ -147,8 +155,260 @@ def test_page_count_unpacks_from_json_response(
     mock_template_preview.assert_called_once_with(*expected_template_preview_args)
 
 
+@pytest.fixture
+def letter_page_count_cache(app_, mocker):
+    mocker.patch('app.template_previews.current_service', letter_branding={'filename': 'hm-government'})
+    page_count_cache.clear()
+    with set_config(app_, 'LETTER_PAGE_COUNT_CACHE_ENABLED', True):
+        yield
+    page_count_cache.clear()
+
+
+def test_page_count_is_only_fetched_once_for_the_same_letter(mocker, letter_page_count_cache):
+    mock_redis_set = mocker.patch('app.extensions.RedisClient.set')
+    mock_template_preview = mocker.patch(
+        'app.template_previews.TemplatePreview.from_database_object',
+        return_value=(b'{"count": 3}', 200, {}),
+    )
+    template = {'template_type': 'letter', 'subject': 'Hello', 'content': 'Dear ((name))'}
+
+    assert get_page_count_for_letter(template, values={'name': 'Jo'}) == 3
+    assert get_page_count_for_letter(dict(template, version=2), values={'name': 'Jo'}) == 3
+
+    mock_template_preview.assert_called_once_with(template, 'json', {'name': 'Jo'})
+    mock_redis_set.assert_called_once_with(
+        _get_page_count_cache_key(template, {'name': 'Jo'}), '3', ex=600,
+    )
+
+
+def test_page_counts_without_personalisation_are_cached_for_a_day(mocker, letter_page_count_cache):
+    mocker.patch('app.extensions.RedisClient.get', return_value=None)
+    mock_redis_set = mocker.patch('app.extensions.RedisClient.set')
+    mocker.patch(
+        'app.template_previews.TemplatePreview.from_database_object',
+        return_value=(b'{"count": 3}', 200, {}),
+    )
+    template = {'template_type': 'letter', 'subject': 'Hello', 'content': 'Hello'}
+
+    assert get_page_count_for_letter(template) == 3
+
+    mock_redis_set.assert_called_once_with(_get_page_count_cache_key(template, None), '3', ex=86400)
+
+
+def test_page_count_is_read_from_redis_if_another_worker_has_fetched_it(mocker, letter_page_count_cache):
+    mock_redis_get = mocker.patch('app.extensions.RedisClient.get', return_value=b'2')
+    mock_template_preview = mocker.patch('app.template_previews.TemplatePreview.from_database_object')
+    template = {'template_type': 'letter', 'subject': 'Hello', 'content': 'Hello'}
+
+    assert get_page_count_for_letter(template) == 2
+    assert get_page_count_for_letter(template) == 2
+
+    assert mock_redis_get.call_count == 1
+    assert mock_template_preview.called is False
+
+
+@pytest.mark.parametrize('changes, values', [
+    ({'content': 'Goodbye'}, None),
+    ({'subject': 'Goodbye'}, None),
+    ({'reply_to_text': '1 Example Street'}, None),
+    ({}, {'name': 'Jo'}),
+])
+def test_page_count_cache_key_changes_with_anything_affecting_the_letter(letter_page_count_cache, changes, values):
+    template = {'template_type': 'letter', 'subject': 'Hello', 'content': 'Hello'}
+
+    assert _get_page_count_cache_key(dict(template, **changes), values) != _get_page_count_cache_key(template, None)
+
+
+def test_page_count_cache_key_changes_with_letter_branding(mocker, letter_page_count_cache):
+    template = {'template_type': 'letter', 'subject': 'Hello', 'content': 'Hello'}
+    key = _get_page_count_cache_key(template, None)
+
+    mocker.patch('app.template_previews.current_service', letter_branding=None)
+
+    assert _get_page_count_cache_key(template, None) != key
+    assert key.startswith('letter-page-count-')
+
+
+@pytest.fixture
+def template_preview_cache(app_, mocker):
+    mocker.patch('app.template_previews.current_service', letter_branding=None)
+    with set_config(app_, 'TEMPLATE_PREVIEW_CACHE_ENABLED', True):
+        yield
+
+
+def test_preview_is_rendered_and_cached(app_, mocker, template_preview_cache):
+    mocker.patch('app.extensions.RedisClient.get', return_value=None)
+    mock_redis_set = mocker.patch('app.extensions.RedisClient.set')
+    mock_post = mocker.patch(
+        'app.template_previews.http_sessions.post',
+        return_value=Mock(content=b'png', status_code=200, headers={'Content-Type': 'image/png', 'X-Other': '1'}),
+    )
+    template = {'template_type': 'letter', 'subject': 'Hello', 'content': 'Hello'}
+
+    with app_.test_request_context():
+        content, status_code, headers = TemplatePreview.from_database_object(template, 'png')
+
+    assert content == b'png'
+    assert status_code == 200
+    assert dict(headers) == {
+        'Content-Type': 'image/png',
+        'ETag': '"{}"'.format(hashlib.sha256(b'png').hexdigest()),
+        'Cache-Control': 'no-cache, private, must-revalidate',
+    }
+    assert mock_post.call_count == 1
+    key, value = mock_redis_set.call_args[0]
+    assert key.startswith('template-preview-')
+    assert value == b'image/png\npng'
+    assert mock_redis_set.call_args[1] == {'ex': 86400}
+
+
+@pytest.mark.parametrize('if_none_match, expected_status, expected_content', [
+    (None, 200, b'png'),
+    ('"something-else"', 200, b'png'),
+    ('"{}"'.format(hashlib.sha256(b'png').hexdigest()), 304, b''),
+])
+def test_cached_preview_is_served_from_redis(
+    app_,
+    mocker,
+    template_preview_cache,
+    if_none_match,
+    expected_status,
+    expected_content,
+):
+    mocker.patch('app.extensions.RedisClient.get', return_value=b'image/png\npng')
+    mock_post = mocker.patch('app.template_previews.http_sessions.post')
+
+    with app_.test_request_context(headers={'If-None-Match': if_none_match} if if_none_match else {}):
+        content, status_code, headers = TemplatePreview.from_example_template({'subject': 'Hello'}, 'hm-government')
+
+    assert content == expected_content
+    assert status_code == expected_status
+    assert dict(headers)['Content-Type'] == 'image/png'
+    assert mock_post.called is False
+
+
+def test_previews_with_personal_data_have_no_etag(app_, mocker, template_preview_cache):
+    mocker.patch('app.extensions.RedisClient.get', return_value=b'image/png\npng')
+
+    with app_.test_request_context():
+        content, status_code, headers = TemplatePreview.from_database_object(
+            {'template_type': 'letter'}, 'png', values={'name': 'Jo'}
+        )
+
+    assert content == b'png'
+    assert dict(headers) == {'Content-Type': 'image/png'}
+
+
+def test_previews_with_personal_data_are_only_cached_for_a_few_minutes(app_, mocker, template_preview_cache):
+    mocker.patch('app.extensions.RedisClient.get', return_value=None)
+    mock_redis_set = mocker.patch('app.extensions.RedisClient.set')
+    mocker.patch(
+        'app.template_previews.http_sessions.post',
+        return_value=Mock(content=b'png', status_code=200, headers={'Content-Type': 'image/png'}),
+    )
+
+    with app_.test_request_context():
+        TemplatePreview.from_database_object({'template_type': 'letter'}, 'png', values={'name': 'Jo'})
+
+    assert mock_redis_set.call_args[1] == {'ex': 600}
+
+
+@pytest.mark.parametrize('content, values, expected_ttl', [
+    (b'x' * 64 * 1024, None, 86400),
+    (b'x' * 128 * 1024, None, 43200),
+    (b'x' * 1024 * 1024, None, 5400),
+    (b'x' * 1024 * 1024, {'name': 'Jo'}, 600),
+])
+def test_big_previews_are_cached_for_less_time(
+    app_,
+    mocker,
+    template_preview_cache,
+    content,
+    values,
+    expected_ttl,
+):
+    mocker.patch('app.extensions.RedisClient.get', return_value=None)
+    mock_redis_set = mocker.patch('app.extensions.RedisClient.set')
+    mocker.patch(
+        'app.template_previews.http_sessions.post',
+        return_value=Mock(content=content, status_code=200, headers={'Content-Type': 'application/pdf'}),
+    )
+
+    with app_.test_request_context():
+        TemplatePreview.from_database_object({'template_type': 'letter'}, 'pdf', values=values)
+
+    assert mock_redis_set.call_args[1] == {'ex': expected_ttl}
+
+
+@pytest.mark.parametrize('status_code, content', [
+    (500, b'error'),
+    (200, b'x' * (1024 * 1024 + 1)),
+])
+def test_errors_and_big_previews_are_not_cached(app_, mocker, template_preview_cache, status_code, content):
+    mocker.patch('app.extensions.RedisClient.get', return_value=None)
+    mock_redis_set = mocker.patch('app.extensions.RedisClient.set')
+    mocker.patch(
+        'app.template_previews.http_sessions.post',
+        return_value=Mock(content=content, status_code=status_code, headers={'Content-Type': 'application/pdf'}),
+    )
+
+    with app_.test_request_context():
+        assert TemplatePreview.from_database_object({'template_type': 'letter'}, 'pdf')[:2] == (content, status_code)
+
+    assert mock_redis_set.called is False
+
+
+def test_extract_pages_from_pdf():
+    with open('tests/test_pdf_files/multi_page_pdf.pdf', 'rb') as pdf_file:
+        pdf_file = pdf_file.read()
+
+    pages = extract_pages_from_pdf(pdf_file, [1, 3])
+
+    assert list(pages.keys()) == [1, 3]
+    assert all(pdf_page_count(BytesIO(page)) == 1 for page in pages.values())
+
+
+def test_from_pdf_file_pages_renders_each_page(app_, mocker):
+    mocker.patch(
+        'app.template_previews.extract_pages_from_pdf',
+        return_value={1: b'page 1', 2: b'page 2', 3: b'page 3'},
+    )
+    mock_valid = mocker.patch(
+        'app.template_previews.TemplatePreview.from_valid_pdf_page',
+        side_effect=lambda pdf_page, page, cache_key: ('valid', page, cache_key),
+    )
+    mock_invalid = mocker.patch(
+        'app.template_previews.TemplatePreview.from_invalid_pdf_page',
+        side_effect=lambda pdf_page, page, cache_key: ('invalid', page, cache_key),
+    )
+
+    with app_.test_request_context():
+        previews = TemplatePreview.from_pdf_file_pages(
+            b'pdf', [1, 2, 3], invalid_pages=[2], get_cache_key='page-{}'.format,
+        )
+
+    assert previews == {
+        1: ('valid', 1, 'page-1'),
+        2: ('invalid', 2, 'page-2'),
+        3: ('valid', 3, 'page-3'),
+    }
+    assert mock_valid.call_args_list[0][0] == (b'page 1', 1)
+    mock_invalid.assert_called_once_with(b'page 2', 2, cache_key='page-2')
+
+
+def test_from_pdf_file_pages_renders_a_few_pages_at_a_time(app_, mocker):
+    mocker.patch('app.template_previews.extract_pages_from_pdf', return_value={1: b'page 1'})
+    mocker.patch('app.template_previews.TemplatePreview.from_valid_pdf_page')
+    mock_fetch = mocker.patch('app.template_previews.fetch_concurrently', return_value={'1': 'preview'})
+
+    with app_.test_request_context():
+        assert TemplatePreview.from_pdf_file_pages(b'pdf', [1]) == {1: 'preview'}
+
+    assert mock_fetch.call_args[1]['max_concurrency'] == 5
+
+
 def test_from_example_template_makes_request(mocker):
-    request_mock = mocker.patch('app.template_previews.requests.post')
+    request_mock = mocker.patch('app.template_previews.http_sessions.post')
     template = {}
     filename = 'geo'
 
@@ -173,7 +433,7 @@ def test_sanitise_letter_calls_template_preview_sanitise_endoint_with_file(
     allow_international_letters,
     expected_url,
 ):
-    request_mock = mocker.patch('app.template_previews.requests.post')
+    request_mock = mocker.patch('app.template_previews.http_sessions.post')
 
     sanitise_letter('pdf_data', allow_international_letters=allow_international_letters)
 
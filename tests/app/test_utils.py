@@ -1,16 +1,19 @@
 from collections import OrderedDict
 from csv import DictReader
-from io import StringIO
+from io import BytesIO, StringIO
 from pathlib import Path
 
+import eventlet
 import pytest
 from bs4 import BeautifulSoup
 from flask import url_for
 from freezegun import freeze_time
+from notifications_utils.recipients import RecipientCSV
 from notifications_utils.template import Template
 
 from app import format_datetime_relative
 from app.formatters import email_safe, round_to_significant_figures
+from app.models.spreadsheet import StreamingCSV
 from app.utils import (
     Spreadsheet,
     generate_next_dict,
@@ -164,6 +167,122 @@ def test_spreadsheet_checks_for_bad_arguments(args, kwargs):
     assert str(exception.value) == 'Spreadsheet must be created from either rows or CSV data'
 
 
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 1024])
+@pytest.mark.parametrize('file_contents', [
+    'phone number,name\r\n07700900001,🐝\n07700900002,"Zoë\r\nBloggs"\r\n\r\n',
+    'phone number\r07700900001\r',
+    '',
+])
+def test_iter_normalised_lines_matches_normalise_newlines(file_contents, chunk_size):
+    assert '\r\n'.join(Spreadsheet.iter_normalised_lines(
+        BytesIO(file_contents.encode('utf-8')), chunk_size=chunk_size
+    )) == Spreadsheet.normalise_newlines(BytesIO(file_contents.encode('utf-8')))
+
+
+def test_streaming_spreadsheet_from_csv_file(mocker):
+    mocker.patch('app.models.spreadsheet.Spreadsheet.CHUNK_SIZE_IN_BYTES', 10)
+    file_contents = 'phone number,name\n07700900001,"Jo\nBloggs"\n07700900002,Zoë\n'.encode('utf-8')
+    spreadsheet = Spreadsheet.from_file(BytesIO(file_contents), filename='file.csv', streaming=True)
+
+    data = spreadsheet.as_dict['data']
+    assert spreadsheet.row_count is None
+
+    chunks = list(data)
+    assert len(chunks) > 1
+    assert b''.join(chunks) == Spreadsheet.from_file(
+        BytesIO(file_contents), filename='file.csv'
+    ).as_csv_data.encode('utf-8')
+    assert spreadsheet.row_count == 2
+    assert spreadsheet.column_headers == ['phone number', 'name']
+
+
+def test_streaming_spreadsheet_uploads_files_it_cannot_summarise():
+    file_contents = 'phone number,name\n07700900001,{}\n07700900002,Zoë\n'.format('a' * 200_000).encode('utf-8')
+    spreadsheet = Spreadsheet.from_file(BytesIO(file_contents), filename='file.csv', streaming=True)
+
+    assert b''.join(spreadsheet.as_dict['data']) == Spreadsheet.from_file(
+        BytesIO(file_contents), filename='file.csv'
+    ).as_csv_data.encode('utf-8')
+    assert spreadsheet.row_count is None
+    assert spreadsheet.column_headers is None
+
+
+def test_streaming_spreadsheet_from_excel_file():
+    with open(str(Path.cwd() / 'tests' / 'spreadsheet_files' / 'excel 2007.xlsx'), 'rb') as xl:
+        csv_data = Spreadsheet.from_file(xl, filename='xl.xlsx').as_csv_data
+    with open(str(Path.cwd() / 'tests' / 'spreadsheet_files' / 'excel 2007.xlsx'), 'rb') as xl:
+        spreadsheet = Spreadsheet.from_file(xl, filename='xl.xlsx', streaming=True)
+        assert b''.join(spreadsheet.as_dict['data']) == csv_data.encode('utf-8')
+
+    assert spreadsheet.row_count == len(Spreadsheet(csv_data=csv_data).as_rows) - 1
+    assert spreadsheet.column_headers == Spreadsheet(csv_data=csv_data).as_rows[0]
+
+
+def test_streaming_csv_reads_rows_like_recipient_csv():
+    csv = StreamingCSV(iter([
+        '',
+        'Phone number, name, Name, extra',
+        '07700900001,  Alice , Smith',
+        '',
+        '"07700900003","Bob, Jones",,Z',
+    ]), template=get_sample_template('sms'))
+
+    assert csv.column_headers == ['Phone number', 'name', 'Name', 'extra']
+    assert csv[2].get('phone_number').data == '07700900003'
+    assert csv[2].get('extra').data == 'Z'
+    assert csv[0].get('Phone number').data == '07700900001'
+    assert csv[0].get('name').data == 'Smith'
+    assert csv[0].get('extra').data is None
+    assert csv[1].get('phone number').data is None
+    assert csv[0].get('something else') is None
+
+
+def test_streaming_csv_can_be_iterated_over():
+    csv = StreamingCSV(
+        iter(['phone number', '07700900001', '07700900002', '07700900003']),
+        template=get_sample_template('sms'),
+    )
+
+    assert csv[0].get('phone number').data == '07700900001'
+    assert [row.get('phone number').data for row in csv] == ['07700900001', '07700900002', '07700900003']
+
+
+@pytest.mark.parametrize('template_type, lines', [
+    ('sms', [
+        'Phone number, name, Name, extra',
+        '07700900001,  Alice , Smith',
+        '',
+        '"07700900003","Bob, Jones",,Z',
+    ]),
+    ('sms', [
+        'phone number,name,name,Phone Number,phone number,NAME',
+        '07700900001,Alice,Smith,07700900002,07700900003,Jones',
+        '07700900004,Bob,Jones',
+        '07700900005,,Jones,,,',
+    ]),
+    ('email', [
+        'email address,name,Email Address,name,name',
+        'one@example.com,Alice,two@example.com,Smith,Jones',
+        ',,,,',
+    ]),
+    ('letter', [
+        'address line 1,Address Line 1,address_line_2,postcode,name,name',
+        'A. Name,B. Name,1 Street,SW1A 1AA,Alice',
+    ]),
+])
+def test_streaming_csv_matches_recipient_csv(template_type, lines):
+    template = get_sample_template(template_type)
+    recipient_csv = RecipientCSV('\n'.join(lines), template=template)
+    streaming_csv = StreamingCSV(iter(lines), template=template)
+
+    assert streaming_csv.column_headers == recipient_csv.column_headers
+
+    for index, row in enumerate(recipient_csv.rows):
+        expected_data = [row.get(header).data for header in recipient_csv.column_headers]
+        assert [streaming_csv[index].get(header).data for header in streaming_csv.column_headers] == expected_data
+        assert streaming_csv.get_data(index) == expected_data
+
+
 @pytest.mark.parametrize('created_by_name, expected_content', [
     (
         None, [
@@ -231,8 +350,8 @@ def test_generate_notifications_csv_returns_correct_csv_file(
     expected_1st_row,
 ):
     mocker.patch(
-        'app.s3_client.s3_csv_client.s3download',
-        return_value=original_file_contents,
+        'app.s3_client.s3_csv_client.s3download_lines',
+        return_value=original_file_contents.splitlines(),
     )
     csv_content = generate_notifications_csv(service_id='1234', job_id=fake_uuid, template_type='sms')
     csv_file = DictReader(StringIO('\n'.join(csv_content)))
@@ -257,7 +376,7 @@ def test_generate_notifications_csv_calls_twice_if_next_link(
 ):
 
     mocker.patch(
-        'app.s3_client.s3_csv_client.s3download',
+        'app.s3_client.s3_csv_client.s3download_lines',
         return_value="""
             phone_number
             07700900000
@@ -270,7 +389,7 @@ def test_generate_notifications_csv_calls_twice_if_next_link(
             07700900007
             07700900008
             07700900009
-        """
+        """.splitlines()
     )
 
     service_id = '1234'
@@ -301,6 +420,29 @@ def test_generate_notifications_csv_calls_twice_if_next_link(
     assert mock_get_notifications.mock_calls[1][2]['page'] == 2
 
 
+def test_generate_notifications_csv_gets_next_page_before_sending_this_one(
+    app_,
+    mocker,
+):
+    mock_get_notifications = mocker.patch(
+        'app.notification_api_client.get_notifications_for_service',
+        side_effect=[
+            _get_notifications_csv(rows=2, with_links=True)('1234'),
+            _get_notifications_csv(rows=1, with_links=False)('1234'),
+        ]
+    )
+
+    csv_content = generate_notifications_csv(service_id='1234')
+    next(csv_content)
+    next(csv_content)
+    # let the green thread getting the next page run, as it would while
+    # the response is being written
+    eventlet.sleep()
+
+    assert mock_get_notifications.call_count == 2
+    assert len(list(csv_content)) == 2
+
+
 def test_get_cdn_domain_on_localhost(client, mocker):
     mocker.patch.dict('app.current_app.config', values={'ADMIN_BASE_URL': 'http://localhost:6012'})
     domain = get_logo_cdn_domain()
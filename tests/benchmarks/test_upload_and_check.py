@@ -0,0 +1,212 @@
+"""
+Benchmarks for each stage of sending messages from a spreadsheet: converting
+the uploaded file to CSV, putting it in and getting it back out of S3,
+checking the recipients and rendering the check page.
+
+These are skipped unless `RUN_BENCHMARKS` is set – run them with
+`make benchmark`. As well as the timings pytest-benchmark reports, each
+benchmark records the most memory the stage used in `peak_memory_in_bytes`,
+which is saved with `--benchmark-json` or `--benchmark-autosave`.
+"""
+import csv
+import os
+import tracemalloc
+from functools import lru_cache
+from io import BytesIO
+from pathlib import Path
+
+import pyexcel_ods3
+import pyexcel_xlsx
+import pytest
+from notifications_utils.recipients import RecipientCSV
+from notifications_utils.template import SMSMessageTemplate
+
+from app.models.spreadsheet import Spreadsheet
+from app.s3_client.s3_csv_client import s3download, s3upload
+from app.utils import get_errors_for_csv
+from tests.conftest import SERVICE_ONE_ID
+
+pytestmark = pytest.mark.skipif(
+    not os.environ.get('RUN_BENCHMARKS'),
+    reason='Benchmarks only run when RUN_BENCHMARKS is set',
+)
+
+ROW_COUNTS = [1000, 10000, 100000]
+
+FILE_FORMATS = {
+    'csv': 'newline_windows.csv',
+    'xlsx': 'excel 2007.xlsx',
+    'ods': 'open document spreadsheet.ods',
+}
+
+
+@lru_cache()
+def get_rows(row_count):
+    with open(str(Path.cwd() / 'tests' / 'spreadsheet_files' / FILE_FORMATS['csv']), 'rb') as spreadsheet_file:
+        header, *rows = Spreadsheet.from_file(spreadsheet_file, filename=FILE_FORMATS['csv']).as_rows
+    return [header] + [rows[index % len(rows)] for index in range(row_count)]
+
+
+@lru_cache()
+def get_file(file_format, row_count):
+    if file_format == 'csv':
+        return Spreadsheet.from_rows(get_rows(row_count)).as_csv_data.encode('utf-8')
+    with BytesIO() as spreadsheet_file:
+        {
+            'xlsx': pyexcel_xlsx,
+            'ods': pyexcel_ods3,
+        }[file_format].save_data(spreadsheet_file, {'Sheet 1': get_rows(row_count)})
+        return spreadsheet_file.getvalue()
+
+
+def count_rows(csv_data):
+    # the header row plus `row_count` rows, however the last line ends
+    return len(Spreadsheet(csv_data=csv_data).as_rows)
+
+
+class ChunkedFile():
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+
+    def read(self, _size):
+        return next(self._chunks, b'')
+
+
+def count_rows_in_chunks(chunks):
+    # the same as `count_rows`, but without joining the chunks together first
+    return sum(1 for _row in csv.reader(
+        Spreadsheet.iter_normalised_lines(ChunkedFile(chunk for chunk in chunks if chunk)),
+        quoting=csv.QUOTE_MINIMAL,
+        skipinitialspace=True,
+    ))
+
+
+def get_peak_memory_in_bytes(function, *args, **kwargs):
+    tracemalloc.start()
+    try:
+        function(*args, **kwargs)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run_stage(benchmark, function, *args):
+    result = benchmark.pedantic(function, args=args, rounds=3)
+    benchmark.extra_info['peak_memory_in_bytes'] = get_peak_memory_in_bytes(function, *args)
+    return result
+
+
+@pytest.fixture
+def local_s3(mocker):
+    files = {}
+
+    def _upload(filedata, region, bucket_name, file_location):
+        files[bucket_name, file_location] = filedata.encode('utf-8')
+
+    def _get_csv_upload(service_id, upload_id, bucket=None):
+        body = files[
+            bucket or 'test-notifications-csv-upload',
+            'service-{}-notify/{}.csv'.format(service_id, upload_id),
+        ]
+        return mocker.Mock(get=lambda: {'Body': BytesIO(body)})
+
+    mocker.patch('app.s3_client.s3_csv_client.utils_s3upload', side_effect=_upload)
+    mocker.patch('app.s3_client.s3_csv_client.get_csv_upload', side_effect=_get_csv_upload)
+    return files
+
+
+@pytest.mark.parametrize('row_count', ROW_COUNTS)
+@pytest.mark.parametrize('file_format', FILE_FORMATS.keys())
+def test_convert_spreadsheet(benchmark, file_format, row_count):
+
+    def convert():
+        return Spreadsheet.from_file(
+            BytesIO(get_file(file_format, row_count)), filename='file.{}'.format(file_format)
+        ).as_csv_data
+
+    assert count_rows(run_stage(benchmark, convert)) == row_count + 1
+
+
+@pytest.mark.parametrize('row_count', ROW_COUNTS)
+@pytest.mark.parametrize('file_format', FILE_FORMATS.keys())
+def test_convert_spreadsheet_streaming(benchmark, file_format, row_count):
+
+    def get_spreadsheet():
+        return Spreadsheet.from_file(
+            BytesIO(get_file(file_format, row_count)), filename='file.{}'.format(file_format), streaming=True
+        )
+
+    def convert():
+        for _chunk in get_spreadsheet().iter_csv_data():
+            pass
+
+    run_stage(benchmark, convert)
+
+    assert count_rows_in_chunks(get_spreadsheet().iter_csv_data()) == row_count + 1
+
+
+@pytest.mark.parametrize('row_count', ROW_COUNTS)
+def test_upload_to_s3(client, benchmark, local_s3, row_count):
+    csv_data = get_file('csv', row_count).decode('utf-8')
+
+    run_stage(benchmark, s3upload, SERVICE_ONE_ID, {'data': csv_data}, 'eu-west-1')
+
+    assert set(local_s3.values()) == {csv_data.encode('utf-8')}
+
+
+@pytest.mark.parametrize('row_count', ROW_COUNTS)
+def test_download_from_s3(client, benchmark, local_s3, row_count):
+    upload_id = s3upload(SERVICE_ONE_ID, {'data': get_file('csv', row_count).decode('utf-8')}, 'eu-west-1')
+
+    assert count_rows(run_stage(benchmark, s3download, SERVICE_ONE_ID, upload_id)) == row_count + 1
+
+
+@pytest.mark.parametrize('row_count', ROW_COUNTS)
+def test_check_recipients(benchmark, row_count):
+    contents = get_file('csv', row_count).decode('utf-8')
+    template = SMSMessageTemplate({'content': 'Hello ((name))', 'template_type': 'sms'})
+
+    def check():
+        recipients = RecipientCSV(contents, template=template, max_initial_rows_shown=50, max_errors_shown=50)
+        return len(recipients), get_errors_for_csv(recipients, 'sms')
+
+    assert run_stage(benchmark, check) == (row_count, [])
+
+
+@pytest.mark.parametrize('row_count', ROW_COUNTS)
+def test_check_messages_page(
+    client_request,
+    benchmark,
+    mocker,
+    service_one,
+    mock_get_users_by_service,
+    mock_get_service_template,
+    mock_get_job_doesnt_exist,
+    mock_get_jobs,
+    mock_s3_get_metadata,
+    mock_s3_set_metadata,
+    fake_uuid,
+    row_count,
+):
+    service_one['message_limit'] = row_count
+    service_one['restricted'] = False
+    mocker.patch('app.service_api_client.get_service', return_value={'data': service_one})
+    mocker.patch('app.service_api_client.get_service_statistics', return_value={
+        'sms': {'requested': 0, 'delivered': 0, 'failed': 0},
+        'email': {'requested': 0, 'delivered': 0, 'failed': 0},
+    })
+    mocker.patch('app.main.views.send.s3download', return_value=get_file('csv', row_count).decode('utf-8'))
+
+    def render():
+        return client_request.get(
+            'main.check_messages',
+            service_id=SERVICE_ONE_ID,
+            template_id=fake_uuid,
+            upload_id=fake_uuid,
+            _test_page_title=False,
+        )
+
+    page = run_stage(benchmark, render)
+
+    assert not page.select('.banner-dangerous')